@@ -0,0 +1,72 @@
+"""
+Batching of changes until transactions are committed
+"""
+from django.db import transaction
+
+
+class _Pending:
+    """
+    Items collected during a transaction
+    """
+
+    def __init__(self, handler):
+        """
+        Initialize pending items
+        :param handler: callable receiving the list of items
+        """
+        self.handler = handler
+        self.items = []
+        self.done = False
+
+    def registered(self, connection) -> bool:
+        """
+        Still to be handled on commit, callbacks being dropped
+        when the transaction or a savepoint is rolled back
+        :param connection: database connection
+        """
+        return not self.done and any(
+            callback[1] is self for callback in connection.run_on_commit)
+
+    def __call__(self):
+        """
+        Handle items
+        """
+        self.done = True
+        self.handler(self.items)
+
+
+class CommitBatch:
+    """
+    Items added during a transaction are handled together, by a single
+    call once it is committed, items added out of a transaction
+    are handled at once
+    """
+
+    def __init__(self, handler):
+        """
+        Initialize batch
+        :param handler: callable receiving the list of items,
+        in the order they were added
+        """
+        self.handler = handler
+
+    def add(self, items: []):
+        """
+        Add items to the batch of the current transaction
+        :param items: items to handle
+        """
+        items = list(items)
+        if not items:
+            return
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            self.handler(items)
+            return
+        if not hasattr(connection, 'commit_batches'):
+            connection.commit_batches = {}
+        pending = connection.commit_batches.get(self)
+        if pending is None or not pending.registered(connection):
+            pending = _Pending(self.handler)
+            connection.commit_batches[self] = pending
+            transaction.on_commit(pending)
+        pending.items.extend(items)
@@ -2,6 +2,7 @@
 Core helpers
 """
 import logging
+from datetime import date, datetime
 from importlib import import_module
 
 from django.apps import apps
@@ -39,3 +40,15 @@ def validate_language(lang):
     if lang in [language[0] for language in settings.LANGUAGES]:
         return lang
     return 'en'
+
+
+def to_date(value) -> date:
+    """
+    Normalize a date, a datetime or an ISO formatted string to a date
+    :param value: date like value
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
@@ -0,0 +1,131 @@
+"""
+HTTP client shared by services
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .settings import HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF_FACTOR, \
+    HTTP_POOL_SIZE
+
+
+class HttpClient:
+    """
+    HTTP client keeping a pool of connections per host.
+    Requests have a timeout and are retried with backoff,
+    latency and errors are counted per service.
+    """
+    timeout = 10
+    retries = 3
+    backoff_factor = 0.5
+    pool_size = 10
+
+    def __init__(self, timeout: float = 10, retries: int = 3,
+                 backoff_factor: float = 0.5, pool_size: int = 10):
+        """
+        Initialize client
+        :param timeout: timeout in seconds of a request
+        :param retries: number of retries of a failed request
+        :param backoff_factor: factor of the exponential delay
+        between retries, in seconds
+        :param pool_size: number of connections kept per host
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        """
+        Session of the host of an URL
+        :param url: URL to request
+        """
+        parts = urlsplit(url)
+        host = f'{parts.scheme}://{parts.netloc}'
+        with self._lock:
+            if host not in self._sessions:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False)
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    max_retries=retry)
+                session = requests.Session()
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def get(self, url: str, params: dict = None, service: str = None,
+            **kwargs) -> requests.Response:
+        """
+        GET request
+        :param url: URL to request
+        :param params: query parameters
+        :param service: name of the calling service, for metrics
+        :param kwargs: arguments of requests.Session.get
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        error = True
+        try:
+            response = self.session(url).get(url, params=params, **kwargs)
+            error = response.status_code >= 400
+            return response
+        finally:
+            self._record(service or urlsplit(url).netloc,
+                         time.monotonic() - start, error)
+
+    def _record(self, service: str, latency: float, error: bool):
+        """
+        Count a request
+        :param service: name of the service
+        :param latency: duration of the request in seconds
+        :param error: the request failed
+        """
+        with self._lock:
+            metrics = self._metrics.setdefault(service, {
+                'requests': 0, 'errors': 0,
+                'latency_total': 0.0, 'latency_max': 0.0})
+            metrics['requests'] += 1
+            metrics['errors'] += int(error)
+            metrics['latency_total'] += latency
+            metrics['latency_max'] = max(metrics['latency_max'], latency)
+
+    def stats(self) -> {str: {}}:
+        """
+        Counters of requests, errors and latency by service
+        """
+        with self._lock:
+            return {
+                service: dict(
+                    metrics,
+                    latency_mean=metrics['latency_total'] / metrics['requests'])
+                for service, metrics in self._metrics.items()
+            }
+
+    def reset_stats(self):
+        """
+        Reset counters
+        """
+        with self._lock:
+            self._metrics.clear()
+
+
+http_client = HttpClient(
+    timeout=getattr(settings, 'HTTP_TIMEOUT', HTTP_TIMEOUT),
+    retries=getattr(settings, 'HTTP_RETRIES', HTTP_RETRIES),
+    backoff_factor=getattr(settings, 'HTTP_BACKOFF_FACTOR',
+                           HTTP_BACKOFF_FACTOR),
+    pool_size=getattr(settings, 'HTTP_POOL_SIZE', HTTP_POOL_SIZE))
@@ -1 +1,9 @@
 MAX_PAGE_SIZE = 1000
+# Timeout in seconds of requests to external services
+HTTP_TIMEOUT = 10
+# Number of retries of failed requests to external services
+HTTP_RETRIES = 3
+# Factor in seconds of the exponential delay between retries
+HTTP_BACKOFF_FACTOR = 0.5
+# Number of connections kept per host
+HTTP_POOL_SIZE = 10
@@ -0,0 +1,116 @@
+"""
+Coalescing of concurrent calls
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+
+class _Call:
+    """
+    Call in progress in this process
+    """
+
+    def __init__(self):
+        """
+        Initialize call
+        """
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Only one caller per key runs a function, other callers wait for
+    its result. Threads of a process wait on an event, processes wait
+    on a lock stored in the Django cache, the result being shared
+    through the cache.
+    """
+    prefix = 'singleflight'
+    lock_timeout = 30
+    result_timeout = 10
+    poll_interval = 0.05
+
+    def __init__(self, prefix: str = 'singleflight',
+                 lock_timeout: int = 30,
+                 result_timeout: int = 10,
+                 poll_interval: float = 0.05):
+        """
+        Initialize
+        :param prefix: prefix of the cache keys
+        :param lock_timeout: time in seconds after which a lock expires,
+        waiting callers then run the function themselves
+        :param result_timeout: time in seconds a result is kept
+        in the cache for waiting processes
+        :param poll_interval: time in seconds between checks of the lock
+        """
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+        self.result_timeout = result_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run fn once for concurrent callers sharing the same key
+        :param key: hashable key identifying the call
+        :param fn: callable without arguments, its result must be picklable
+        :return: result of fn
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._do_shared(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _do_shared(self, key, fn):
+        """
+        Run fn once for processes sharing the cache
+        :param key: hashable key identifying the call
+        :param fn: callable without arguments
+        """
+        digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        lock_key = f'{self.prefix}:{digest}:lock'
+        result_key = f'{self.prefix}:{digest}:result'
+        deadline = time.monotonic() + self.lock_timeout
+        waiting_for = None
+        while True:
+            if waiting_for:
+                entry = cache.get(result_key)
+                if entry and entry[0] == waiting_for:
+                    return entry[1]
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, self.lock_timeout):
+                try:
+                    result = fn()
+                    cache.set(result_key, (token, result),
+                              self.result_timeout)
+                    return result
+                finally:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+            waiting_for = cache.get(lock_key) or waiting_for
+            if time.monotonic() > deadline:
+                return fn()
+            time.sleep(self.poll_interval)
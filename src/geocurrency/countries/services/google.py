@@ -4,8 +4,8 @@ Google Geocoder service
 import json
 import logging
 
-import requests
 from django.conf import settings
+from geocurrency.core.http import http_client
 
 from . import Geocoder
 
@@ -49,14 +49,14 @@ class GoogleGeocoder(Geocoder):
         Retrieves coordinates based on address
         """
         try:
-            response = requests.get('{}/{}'.format(
+            response = http_client.get('{}/{}'.format(
                 GEOCODER_GOOGLE_URL,
                 'geocode/json'
             ), {
                 'address': address,
                 'key': self.key,
                 'language': language
-            })
+            }, service=self.coder_type)
             data = response.json()
             if data.get('status') != "OK":
                 return {}
@@ -79,14 +79,14 @@ class GoogleGeocoder(Geocoder):
         :param lng: longitude
         """
         try:
-            response = requests.get('{}/{}'.format(
+            response = http_client.get('{}/{}'.format(
                 GEOCODER_GOOGLE_URL,
                 'geocode/json'
             ),
                 {
                     'latlng': ",".join(map(str, [lat, lng])),
                     'key': self.key,
-                })
+                }, service=self.coder_type)
             data = response.json()
             if data.get('status') != "OK":
                 return {}
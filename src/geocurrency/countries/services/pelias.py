@@ -3,8 +3,8 @@ Pelias geocoder
 """
 import logging
 
-import requests
 from django.conf import settings
+from geocurrency.core.http import http_client
 from pycountry import countries
 
 from . import Geocoder
@@ -56,7 +56,9 @@ class PeliasGeocoder(Geocoder):
         if self.key:
             search_args['api_key'] = self.key
         try:
-            response = requests.get(f'{self.server_url}/search', search_args)
+            response = http_client.get(
+                f'{self.server_url}/search', search_args,
+                service=self.coder_type)
             data = response.json()
             if 'errors' in data:
                 logging.error("Invalid request")
@@ -84,7 +86,9 @@ class PeliasGeocoder(Geocoder):
         if self.key:
             search_args['api_key'] = self.key
         try:
-            response = requests.get(f'{self.server_url}/reverse', search_args)
+            response = http_client.get(
+                f'{self.server_url}/reverse', search_args,
+                service=self.coder_type)
             data = response.json()
             if 'errors' in data:
                 logging.error("ERROR - Invalid request")
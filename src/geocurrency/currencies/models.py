@@ -5,6 +5,8 @@ import logging
 from datetime import date
 from typing import Iterator
 
+import numpy as np
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.db import models
@@ -12,6 +14,7 @@ from geocurrency.countries.models import Country
 from iso4217 import Currency as Iso4217
 
 from . import CURRENCY_SYMBOLS, DEFAULT_SYMBOL
+from .settings import BASE_CURRENCY
 
 
 class CurrencyNotFoundError(Exception):
@@ -139,26 +142,59 @@ class Currency:
                   end_date: date = None) -> Iterator:
         """
         Return a list of rates for this currency
-        and an optional base currency between two dates
+        and an optional base currency between two dates,
+        in the direction they are stored
         :params base_currency: code of the base currency
         :params start_date: rates from that date included
         :params end_date: rates to that date included
         :return: List of rates
         """
         from geocurrency.rates.models import Rate
-        qs = Rate.objects.filter(currency=self.code)
+        if Rate.objects.canonical_storage():
+            # Rates may be stored in the other direction
+            qs = Rate.objects.filter(
+                models.Q(currency=self.code) |
+                models.Q(base_currency=self.code))
+            if base_currency:
+                qs = qs.filter(
+                    models.Q(currency=base_currency) |
+                    models.Q(base_currency=base_currency))
+        else:
+            qs = Rate.objects.filter(currency=self.code)
+            if base_currency:
+                qs = qs.filter(base_currency=base_currency)
         if user:
             qs = qs.filter(models.Q(user=user) | models.Q(user=None))
         if key:
             qs = qs.filter(key=key)
-        if base_currency:
-            qs = qs.filter(base_currency=base_currency)
         if start_date:
             qs = qs.filter(value_date__gte=start_date)
         if end_date:
             qs = qs.filter(value_date__lte=end_date)
         return qs
 
+    def get_series(self, key: str = None, base_currency: str = None,
+                   start_date: date = None,
+                   end_date: date = None) -> (np.ndarray, np.ndarray):
+        """
+        Dates and values of the rates of this currency in a base currency,
+        read from the history store of rates if enabled,
+        with a single query otherwise
+        :params key: user defined key of the rates
+        :params base_currency: code of the base currency
+        :params start_date: rates from that date included
+        :params end_date: rates to that date included
+        :return: arrays of datetime64[D] dates and float64 values
+        """
+        from geocurrency.rates.models import Rate
+        return Rate.objects.series(
+            currency=self.code,
+            base_currency=base_currency or getattr(
+                settings, 'BASE_CURRENCY', BASE_CURRENCY),
+            key=key,
+            date_obj=start_date,
+            to_obj=end_date)
+
     @property
     def symbol(self):
         """
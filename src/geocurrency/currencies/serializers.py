@@ -48,3 +48,43 @@ class CurrencySerializer(serializers.Serializer):
         No update
         """
         return instance
+
+
+class CurrencySeriesSerializer(serializers.Serializer):
+    """
+    Series of rates of a currency with statistics
+    """
+    currency = serializers.CharField(
+        label="Currency to convert from",
+        read_only=True)
+    base_currency = serializers.CharField(
+        label="Currency to convert to",
+        read_only=True)
+    key = serializers.CharField(
+        label="User defined categorization key",
+        read_only=True)
+    interval = serializers.CharField(
+        label="Interval of values, day, week or month",
+        read_only=True)
+    window = serializers.IntegerField(
+        label="Number of values of rolling statistics",
+        read_only=True)
+    dates = serializers.ListField(
+        label="Dates of values, first days of intervals",
+        child=serializers.DateField(),
+        read_only=True)
+    values = serializers.ListField(
+        label="Rates, averaged over intervals",
+        child=serializers.FloatField(),
+        read_only=True)
+    rolling_avg = serializers.ListField(
+        label="Rolling average of values",
+        child=serializers.FloatField(allow_null=True),
+        read_only=True)
+    rolling_std_dev = serializers.ListField(
+        label="Rolling standard deviation of values",
+        child=serializers.FloatField(allow_null=True),
+        read_only=True)
+    stats = serializers.DictField(
+        label="Statistics of the rates of the range",
+        read_only=True)
@@ -2,12 +2,13 @@
 Currencies tests
 """
 
-from datetime import date
-from django.test import TestCase
+from datetime import date, timedelta
+from django.test import TestCase, override_settings
 from iso4217 import Currency as Iso4217
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from geocurrency.rates.models import Rate
 from .models import Currency
 
 
@@ -180,3 +181,105 @@ class CurrencyAPITestCase(TestCase):
             },
             format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class CurrencySeriesAPITestCase(TestCase):
+    """
+    Tests for series of rates of a currency
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.start = date(2021, 1, 1)
+        Rate.objects.bulk_sync_rates(rates=[
+            {'currency': 'USD', 'base_currency': 'EUR',
+             'date': self.start + timedelta(i), 'value': 1 + i / 100}
+            for i in range(90)
+        ])
+
+    def test_get_rates_pages(self):
+        """
+        Test rates of a currency are paginated
+        """
+        client = APIClient()
+        response = client.get(
+            '/currencies/USD/rates/',
+            data={'base_currency': 'EUR', 'from_date': '2021-02-01',
+                  'page_size': 10},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 59)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_series(self):
+        """
+        Test series with statistics and rolling window
+        """
+        client = APIClient()
+        response = client.get(
+            '/currencies/USD/series/',
+            data={'base_currency': 'EUR', 'to_date': '2021-01-10',
+                  'window': 3},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(len(data['dates']), 10)
+        self.assertEqual(data['dates'][0], '2021-01-01')
+        self.assertAlmostEqual(data['values'][9], 1.09)
+        self.assertAlmostEqual(data['stats']['median'], 1.045)
+        self.assertEqual(data['rolling_avg'][:2], [None, None])
+        self.assertAlmostEqual(data['rolling_avg'][2], 1.01)
+
+    def test_series_base_currency(self):
+        """
+        Test base currency of series defaults to BASE_CURRENCY
+        and is case insensitive
+        """
+        client = APIClient()
+        response = client.get(
+            '/currencies/USD/series/',
+            data={'base_currency': 'eur', 'to_date': '2021-01-10'},
+            format='json')
+        self.assertEqual(response.json()['base_currency'], 'EUR')
+        self.assertEqual(len(response.json()['dates']), 10)
+        with override_settings(BASE_CURRENCY='USD'):
+            response = client.get(
+                '/currencies/EUR/series/',
+                data={'to_date': '2021-01-10'},
+                format='json')
+        self.assertEqual(response.json()['base_currency'], 'USD')
+        self.assertEqual(len(response.json()['dates']), 10)
+
+    def test_downsampled_series(self):
+        """
+        Test series averaged by month
+        """
+        client = APIClient()
+        response = client.get(
+            '/currencies/USD/series/',
+            data={'base_currency': 'EUR', 'interval': 'month'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['dates'],
+                         ['2021-01-01', '2021-02-01', '2021-03-01'])
+        self.assertAlmostEqual(data['values'][0], 1.15)
+        self.assertEqual(data['stats']['count'], 90)
+
+    def test_invalid_series(self):
+        """
+        Test series with invalid parameters
+        """
+        client = APIClient()
+        response = client.get(
+            '/currencies/USD/series/',
+            data={'interval': 'hour'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = client.get(
+            '/currencies/USD/series/',
+            data={'key': 'private'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
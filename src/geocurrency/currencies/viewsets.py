@@ -3,9 +3,11 @@ Viewsets for currencies module APIs
 """
 
 import logging
-import statistics
-from datetime import date, timedelta
+from datetime import date, datetime
 
+import numpy as np
+from django.conf import settings
+from django.http import HttpResponseForbidden
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_cookie
@@ -16,10 +18,14 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
+from geocurrency.core.pagination import PageNumberPagination
 from geocurrency.countries.serializers import CountrySerializer
+from geocurrency.rates.history import RateHistoryStore
+from geocurrency.rates.models import Rate
 from geocurrency.rates.serializers import RateSerializer
 from .models import Currency, CurrencyNotFoundError
-from .serializers import CurrencySerializer
+from .serializers import CurrencySerializer, CurrencySeriesSerializer
+from .settings import BASE_CURRENCY
 
 
 class CurrencyViewset(ReadOnlyModelViewSet):
@@ -104,20 +110,39 @@ class CurrencyViewset(ReadOnlyModelViewSet):
         'to_date', openapi.IN_QUERY, description="To date (YYYY-MM-DD)",
         type=openapi.TYPE_STRING)
     base_currency = openapi.Parameter(
-        'base',
-        openapi.IN_QUERY,
-        description="Base currency (defaults to EUR)",
-        type=openapi.TYPE_STRING)
-    currency = openapi.Parameter(
         'base_currency',
         openapi.IN_QUERY,
-        description="currency",
+        description="Base currency (defaults to BASE_CURRENCY setting)",
         type=openapi.TYPE_STRING)
     key = openapi.Parameter(
         'key',
         openapi.IN_QUERY,
         description="custom key",
         type=openapi.TYPE_STRING)
+    interval = openapi.Parameter(
+        'interval',
+        openapi.IN_QUERY,
+        description="Average values by day, week or month "
+                    "(defaults to day)",
+        type=openapi.TYPE_STRING)
+    window = openapi.Parameter(
+        'window',
+        openapi.IN_QUERY,
+        description="Number of values of rolling statistics",
+        type=openapi.TYPE_INTEGER)
+
+    @staticmethod
+    def _get_dates(request) -> (date, date):
+        """
+        Range of dates of a request
+        :param request: HTTP request
+        :return: tuple of dates, None if not set
+        :raises ValueError: invalid date
+        """
+        return tuple(
+            datetime.strptime(request.GET[name], '%Y-%m-%d').date()
+            if request.GET.get(name) else None
+            for name in ('from_date', 'to_date'))
 
     @swagger_auto_schema(
         method='get',
@@ -129,78 +154,110 @@ class CurrencyViewset(ReadOnlyModelViewSet):
         url_path='rates',
         url_name="get_currency_rates"
     )
-    def get_rates(
-            self, request, code: str,
-            key: str = None, base_currency: str = 'EUR',
-            from_date: date = date.today(), to_date: date = date.today()
-    ) -> Response:
+    def get_rates(self, request, code: str) -> Response:
         """
-        Get conversion rates for the currency
+        Get conversion rates for the currency, by pages
         :param request: HTTP request
         :param code: Currency id
-        :param key: optional custom key
-        :param base_currency: optional base currency, defaults to EUR
-        :param from_date: optional limit results to rates range in time
-        :param to_date: optional limit results to rates range in time
         :return: List of rates
         """
         try:
             c = Currency(code)
-            user = None
-            if request.user and request.user.is_authenticated:
-                user = request.user
-            rates = c.get_rates(
-                user=user,
-                key=key,
-                base_currency=base_currency,
-                start_date=from_date,
-                end_date=to_date)
-            serializer = RateSerializer(
-                rates,
-                many=True,
-                context={'request': request})
-            return Response(serializer.data)
         except CurrencyNotFoundError:
             return Response('Currency not found',
                             status=status.HTTP_404_NOT_FOUND)
+        try:
+            from_date, to_date = self._get_dates(request)
+        except ValueError:
+            return Response('Invalid date',
+                            status=status.HTTP_400_BAD_REQUEST)
+        user = None
+        if request.user and request.user.is_authenticated:
+            user = request.user
+        rates = c.get_rates(
+            user=user,
+            key=request.GET.get('key'),
+            base_currency=request.GET.get('base_currency'),
+            start_date=from_date,
+            end_date=to_date)
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(rates, request, view=self)
+        serializer = RateSerializer(
+            rates if page is None else page,
+            many=True,
+            context={'request': request, 'currency': c.code})
+        if page is None:
+            return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
-    @staticmethod
-    def _get_rates(
-            base_currency: str,
-            target_currency: str,
-            from_date: date,
-            to_date: date) -> dict:
+    @swagger_auto_schema(
+        method='get',
+        manual_parameters=[from_date, to_date, base_currency, key,
+                           interval, window],
+        responses={200: CurrencySeriesSerializer})
+    @action(
+        ['GET'],
+        detail=True,
+        url_path='series',
+        url_name="get_currency_series"
+    )
+    def get_series(self, request, code: str) -> Response:
         """
-        Generates list of rates and stats
-        :param base_currency: rate to currency
-        :param target_currency: rate from currency
-        :param from_date: lower date range
-        :param to_date: higher date range
+        Get the series of rates of the currency with statistics,
+        averaged by day, week or month
+        :param request: HTTP request
+        :param code: Currency id
+        :return: Dates and values of rates with statistics
         """
-        rates = []
-        dates = []
-        for i in range((to_date - from_date).days + 1):
-            d = from_date + timedelta(i)
-            cd, reference, rate = base_currency.convert(
-                target_currency=target_currency,
-                conversion_date=d
-            )
-            rates.append(rate)
-            dates.append(
-                {
-                    'conversion_date': cd.strftime('%Y-%m-%d'),
-                    'currency': base_currency,
-                    'reference': target_currency,
-                    'rate': rate
-                }
-            )
-        stat = {}
-        if len(rates) > 1:
-            stat = {
-                'avg': statistics.mean(rates),
-                'median': statistics.median(rates),
-                'max': max(rates),
-                'min': min(rates),
-                'std_deviation': statistics.stdev(rates)
-            }
-        return {'rates': dates, 'statistics': stat}
+        try:
+            c = Currency(code)
+        except CurrencyNotFoundError:
+            return Response('Currency not found',
+                            status=status.HTTP_404_NOT_FOUND)
+        interval = request.GET.get('interval', 'day')
+        if interval not in ['day', 'week', 'month']:
+            return Response('Invalid interval',
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            from_date, to_date = self._get_dates(request)
+            window = int(request.GET.get('window') or 0)
+        except ValueError:
+            return Response('Invalid date or window',
+                            status=status.HTTP_400_BAD_REQUEST)
+        if window < 0:
+            return Response('Invalid window',
+                            status=status.HTTP_400_BAD_REQUEST)
+        key = request.GET.get('key') or None
+        if key and not (
+                request.user and request.user.is_authenticated and
+                Rate.objects.filter(user=request.user, key=key).exists()):
+            return HttpResponseForbidden()
+        base_currency = (request.GET.get('base_currency') or getattr(
+            settings, 'BASE_CURRENCY', BASE_CURRENCY)).upper()
+        dates, values = c.get_series(
+            key=key,
+            base_currency=base_currency,
+            start_date=from_date,
+            end_date=to_date)
+        stats = RateHistoryStore.statistics(values)
+        dates, values = RateHistoryStore.downsample(
+            dates, values, interval=interval)
+        rolling_avg, rolling_std_dev = RateHistoryStore.rolling(
+            values, window)
+        data = {
+            'currency': c.code,
+            'base_currency': base_currency,
+            'key': key,
+            'interval': interval,
+            'window': window,
+            'dates': dates.tolist(),
+            'values': values.tolist(),
+            'rolling_avg': [
+                None if np.isnan(v) else v for v in rolling_avg.tolist()],
+            'rolling_std_dev': [
+                None if np.isnan(v) else v
+                for v in rolling_std_dev.tolist()],
+            'stats': stats,
+        }
+        serializer = CurrencySeriesSerializer(data)
+        return Response(serializer.data)
@@ -12,3 +12,13 @@ class RatesConfig(AppConfig):
 
     name = "geocurrency.rates"
     verbose_name = "Rates"
+
+    def ready(self):
+        """
+        Listen to changes of rates made by other processes,
+        once requests are served
+        """
+        from django.core.signals import request_started
+        from .bus import rate_invalidation_bus
+        request_started.connect(rate_invalidation_bus.serve,
+                                dispatch_uid='rate_invalidation_bus')
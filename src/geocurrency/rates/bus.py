@@ -0,0 +1,202 @@
+"""
+Invalidation of in-process rate caches across processes
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+
+from .settings import RATE_INVALIDATION_BUS, RATE_INVALIDATION_CHANNEL
+
+
+class RateInvalidationBus:
+    """
+    Publishes changes of rates to every process
+    Changes are (date, key, currency, base currency) events.
+    They are handled at once by the process writing the rates, and again
+    once the transaction is committed, as caches may have been filled
+    meanwhile from rows read before the commit. They are then sent
+    to other processes through the pub/sub of the Redis server of the
+    default cache.
+    Without a django_redis cache, events are only handled in process.
+    """
+    channel = 'geocurrency:rates:invalidation'
+    # Time in seconds before subscribing again after a Redis error,
+    # doubled after each error up to max_retry_interval
+    retry_interval = 1
+    max_retry_interval = 60
+
+    def __init__(self, channel: str = 'geocurrency:rates:invalidation'):
+        """
+        Initialize bus
+        :param channel: name of the Redis channel
+        """
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._serving = False
+        if hasattr(os, 'register_at_fork'):
+            # Threads do not survive a fork, workers listen on their own
+            os.register_at_fork(after_in_child=self._forked)
+
+    @staticmethod
+    def connection():
+        """
+        Redis connection of the default cache, None if not available
+        """
+        if not getattr(settings, 'RATE_INVALIDATION_BUS',
+                       RATE_INVALIDATION_BUS):
+            return None
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    def subscribe(self, handler):
+        """
+        Add a handler of events
+        :param handler: callable receiving a list of events,
+        or None if events may have been lost
+        """
+        with self._lock:
+            self._handlers.append(handler)
+
+    def handle(self, events: [tuple] = None):
+        """
+        Call handlers with events, errors are logged
+        :param events: list of (date, key, currency, base currency) tuples,
+        None if events may have been lost
+        """
+        for handler in list(self._handlers):
+            try:
+                handler(events)
+            except Exception as e:
+                logging.error(f'rate invalidation: {e!r}')
+
+    def publish(self, events: [tuple]):
+        """
+        Handle events in process and send them to other processes
+        :param events: list of (date, key, currency, base currency) tuples
+        """
+        events = sorted(set(events), key=repr)
+        if not events:
+            return
+        self.handle(events)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self.handle(events))
+        if self.connection() is not None:
+            transaction.on_commit(lambda: self._send(events))
+
+    def _send(self, events: [tuple]):
+        """
+        Send events to other processes, errors are logged
+        :param events: list of (date, key, currency, base currency) tuples
+        """
+        try:
+            self.connection().publish(self.channel, self.dumps(events))
+        except Exception as e:
+            logging.error(f'rate invalidation: {e!r}')
+
+    def dumps(self, events: [tuple]) -> str:
+        """
+        Message of events
+        :param events: list of (date, key, currency, base currency) tuples
+        """
+        return json.dumps({
+            'origin': self.origin,
+            'events': [[date_obj.isoformat(), key, currency, base_currency]
+                       for date_obj, key, currency, base_currency in events]
+        })
+
+    def receive(self, message):
+        """
+        Handle a message of another process,
+        messages of this process are ignored
+        :param message: JSON message, str or bytes
+        """
+        try:
+            data = json.loads(message)
+            if data.get('origin') == self.origin:
+                return
+            events = [
+                (date.fromisoformat(date_obj), key, currency, base_currency)
+                for date_obj, key, currency, base_currency in data['events']]
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f'rate invalidation: invalid message {e!r}')
+            return
+        self.handle(events)
+
+    def start(self) -> bool:
+        """
+        Listen to events of other processes in a daemon thread
+        :return: True if listening
+        """
+        if self.connection() is None:
+            return False
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._listen, name='rate-invalidation',
+                    daemon=True)
+                self._thread.start()
+        return True
+
+    def serve(self, **kwargs):
+        """
+        Listen once the process serves requests,
+        receiver of the request_started signal
+        """
+        if not self._serving:
+            self._serving = True
+            self.start()
+
+    def _listen(self):
+        """
+        Receive messages, subscribing again after errors
+        Caches are cleared when subscribing again,
+        as messages may have been lost meanwhile
+        """
+        subscribed = False
+        delay = self.retry_interval
+        while True:
+            try:
+                pubsub = self.connection().pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if subscribed:
+                    self.handle(None)
+                subscribed = True
+                delay = self.retry_interval
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.receive(message['data'])
+            except Exception as e:
+                logging.error(f'rate invalidation: {e!r}, '
+                              f'subscribing again in {delay}s')
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_retry_interval)
+
+    def _forked(self):
+        """
+        Listen again in a forked process
+        """
+        self._lock = threading.Lock()
+        listening = self._thread is not None
+        self._thread = None
+        self.origin = uuid.uuid4().hex
+        if listening:
+            self.start()
+
+
+rate_invalidation_bus = RateInvalidationBus(
+    channel=getattr(settings, 'RATE_INVALIDATION_CHANNEL',
+                    RATE_INVALIDATION_CHANNEL))
@@ -0,0 +1,569 @@
+"""
+In-process caches for the Rates module
+"""
+import abc
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from django.conf import settings
+from geocurrency.core.singleflight import SingleFlight
+
+from .settings import RATE_GRAPH_CACHE_SIZE, RATE_AS_OF_INDEX_SIZE, \
+    RATE_FETCH_FAILURE_CACHE_SIZE, RATE_FETCH_FAILURE_TTL, \
+    RATE_SINGLE_FLIGHT_LOCK_TIMEOUT, RATE_SINGLE_FLIGHT_RESULT_TIMEOUT, \
+    RATE_DERIVED_CACHE_SIZE, RATE_DERIVED_CACHE_TTL, \
+    RATE_CONVERTER_CACHE_SIZE, RATE_CONVERTER_CACHE_TODAY_TTL
+
+
+class LRUCache:
+    """
+    Thread safe cache bounded in size,
+    evicts the least recently used entries first
+    """
+    max_size = 128
+
+    def __init__(self, max_size: int = 128):
+        """
+        Initialize cache
+        :param max_size: maximum number of entries
+        """
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        """
+        Number of entries in the cache
+        """
+        return len(self._data)
+
+    def __contains__(self, key):
+        """
+        Checks presence of a key without touching its recency
+        """
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache and mark it as recently used
+        :param key: key of the entry
+        :param default: value returned if the key is not cached
+        """
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        """
+        Add or replace an entry, evicting old entries if needed
+        :param key: key of the entry
+        :param value: value to cache
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry from the cache
+        :param key: key of the entry
+        :param default: value returned if the key is not cached
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def keys(self) -> []:
+        """
+        Snapshot of the keys of the cache, least recently used first
+        """
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        with self._lock:
+            self._data.clear()
+
+
+class ScopedLRUCache(LRUCache, abc.ABC):
+    """
+    LRU cache whose entries are invalidated by scope,
+    a scope being shared by many entries
+    Subclasses define the scope of their entries.
+    Keys are indexed by scope so that invalidating a scope
+    does not scan the cache.
+    """
+
+    def __init__(self, max_size: int = 128):
+        """
+        Initialize cache
+        :param max_size: maximum number of entries
+        """
+        super(ScopedLRUCache, self).__init__(max_size=max_size)
+        self._generations = {}
+        self._scopes = {}
+
+    @staticmethod
+    @abc.abstractmethod
+    def scope(key):
+        """
+        Scope of an entry
+        :param key: key of the entry
+        """
+
+    def get_or_build(self, key, builder):
+        """
+        Get a value from the cache, builds it if missing.
+        A value built while its scope is invalidated
+        is returned but not cached.
+        :param key: key of the entry
+        :param builder: callable building the value
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        scope = self.scope(key)
+        generation = self._generations.get(scope, 0)
+        value = builder()
+        with self._lock:
+            if self._generations.get(scope, 0) == generation:
+                self.set(key, value)
+        return value
+
+    def _unindex(self, key):
+        """
+        Remove an entry from the index of scopes
+        :param key: key of the entry
+        """
+        scope = self.scope(key)
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+    def set(self, key, value):
+        """
+        Add or replace an entry, evicting old entries if needed
+        :param key: key of the entry
+        :param value: value to cache
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._scopes.setdefault(self.scope(key), set()).add(key)
+            while len(self._data) > self.max_size:
+                evicted, _ = self._data.popitem(last=False)
+                self._unindex(evicted)
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry from the cache
+        :param key: key of the entry
+        :param default: value returned if the key is not cached
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._unindex(key)
+            return self._data.pop(key)
+
+    def invalidate_scope(self, scope):
+        """
+        Remove entries of a scope
+        :param scope: scope of the entries
+        """
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+            for key in list(self._scopes.get(scope, ())):
+                self.pop(key)
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        with self._lock:
+            super(ScopedLRUCache, self).clear()
+            self._generations.clear()
+            self._scopes.clear()
+
+
+class RateGraphCache(ScopedLRUCache):
+    """
+    Cache of rate graphs indexed by (date, key)
+    Graphs are invalidated per date, as a standard rate
+    without key is part of the graph of every key
+    """
+
+    def __init__(self, max_size: int = RATE_GRAPH_CACHE_SIZE):
+        """
+        Initialize cache
+        :param max_size: maximum number of graphs kept in memory
+        """
+        super(RateGraphCache, self).__init__(max_size=max_size)
+
+    @staticmethod
+    def scope(key):
+        """
+        Graphs are scoped by date
+        :param key: (date, key) tuple
+        """
+        return key[0]
+
+    def invalidate(self, date_obj: date):
+        """
+        Remove graphs of a date, whatever their key
+        :param date_obj: date of the rates that changed
+        """
+        self.invalidate_scope(date_obj)
+
+
+class RateAsOfIndex(ScopedLRUCache):
+    """
+    Sorted arrays of dates and values of rates
+    indexed by (key, base currency, currency)
+    Series are invalidated per pair of currencies
+    """
+
+    def __init__(self, max_size: int = RATE_AS_OF_INDEX_SIZE):
+        """
+        Initialize index
+        :param max_size: maximum number of series kept in memory
+        """
+        super(RateAsOfIndex, self).__init__(max_size=max_size)
+
+    @staticmethod
+    def scope(key):
+        """
+        Series are scoped by pair of currencies, in any direction
+        :param key: (key, base currency, currency) tuple
+        """
+        return frozenset(key[1:])
+
+    def invalidate(self, currency: str, base_currency: str):
+        """
+        Remove series of a pair of currencies, whatever their key
+        :param currency: currency of the rates that changed
+        :param base_currency: base currency of the rates that changed
+        """
+        self.invalidate_scope(frozenset([currency, base_currency]))
+
+
+class ConverterRateCache(ScopedLRUCache):
+    """
+    Rates resolved by converters
+    indexed by (key, base currency, currency, date)
+    Rates are invalidated per date, rates of today expire
+    after a time to live as they may still change
+    """
+    today_ttl = 300
+
+    def __init__(self, max_size: int = RATE_CONVERTER_CACHE_SIZE,
+                 today_ttl: int = RATE_CONVERTER_CACHE_TODAY_TTL):
+        """
+        Initialize cache
+        :param max_size: maximum number of rates kept in memory
+        :param today_ttl: time to live in seconds of rates of today,
+        None to keep them until evicted
+        """
+        super(ConverterRateCache, self).__init__(max_size=max_size)
+        self.today_ttl = today_ttl
+
+    @staticmethod
+    def scope(key):
+        """
+        Rates are scoped by date
+        :param key: (key, base currency, currency, date) tuple
+        """
+        return key[3]
+
+    def generation(self, date_obj: date) -> int:
+        """
+        Generation of the rates of a date, incremented on invalidation
+        :param date_obj: date of the rates
+        """
+        return self._generations.get(date_obj, 0)
+
+    def rates(self, key: str, base_currency: str, currencies: [str],
+              date_obj: date) -> {str: float}:
+        """
+        Cached rates of currencies
+        :param key: user defined key
+        :param base_currency: base currency
+        :param currencies: currency codes
+        :param date_obj: date of the rates
+        :return: dict of rates by currency code, without missing rates
+        """
+        now = time.monotonic()
+        rates = {}
+        for currency in currencies:
+            cache_key = (key, base_currency, currency, date_obj)
+            entry = self.get(cache_key)
+            if entry is None:
+                continue
+            value, expires = entry
+            if expires is not None and expires <= now:
+                self.pop(cache_key)
+                continue
+            rates[currency] = value
+        return rates
+
+    def add(self, key: str, base_currency: str, rates: {str: float},
+            date_obj: date, generation: int):
+        """
+        Cache rates, unless rates of their date changed
+        since they were resolved
+        :param key: user defined key
+        :param base_currency: base currency
+        :param rates: dict of rates by currency code
+        :param date_obj: date of the rates
+        :param generation: generation read before resolving the rates
+        """
+        expires = None
+        if self.today_ttl is not None and date_obj >= date.today():
+            expires = time.monotonic() + self.today_ttl
+        with self._lock:
+            if self.generation(date_obj) != generation:
+                return
+            for currency, value in rates.items():
+                self.set((key, base_currency, currency, date_obj),
+                         (value, expires))
+
+    def invalidate(self, date_obj: date):
+        """
+        Remove rates of a date, whatever their key and currencies
+        :param date_obj: date of the rates that changed
+        """
+        self.invalidate_scope(date_obj)
+
+
+class NegativeCache(LRUCache):
+    """
+    Cache of recently failed lookups
+    Entries expire after a time to live, hits and misses are counted
+    """
+    ttl = 3600
+    hits = 0
+    misses = 0
+
+    def __init__(self, max_size: int = 128, ttl: int = 3600):
+        """
+        Initialize cache
+        :param max_size: maximum number of failures kept in memory
+        :param ttl: time to live of a failure in seconds
+        """
+        super(NegativeCache, self).__init__(max_size=max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, key):
+        """
+        Record a failure
+        :param key: key of the failed lookup
+        """
+        self.set(key, time.monotonic() + self.ttl)
+
+    def failed(self, key) -> bool:
+        """
+        Checks if a lookup recently failed
+        :param key: key of the lookup
+        """
+        expires = self.get(key)
+        with self._lock:
+            if expires is not None and expires > time.monotonic():
+                self.hits += 1
+                return True
+            if expires is not None:
+                self.pop(key)
+            self.misses += 1
+            return False
+
+    def stats(self) -> {str: int}:
+        """
+        Counters of the cache
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self),
+        }
+
+    def clear(self):
+        """
+        Empty the cache and reset counters
+        """
+        with self._lock:
+            super(NegativeCache, self).clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class DerivedRateCache(LRUCache):
+    """
+    Cache of rates derived from paths of rates,
+    indexed by (key, base currency, currency, date)
+    Entries expire after a time to live and are invalidated
+    when a rate of their path changes
+    """
+    ttl = 3600
+    generation = 0
+
+    def __init__(self, max_size: int = RATE_DERIVED_CACHE_SIZE,
+                 ttl: int = RATE_DERIVED_CACHE_TTL):
+        """
+        Initialize cache
+        :param max_size: maximum number of derived rates kept in memory
+        :param ttl: time to live of a derived rate in seconds
+        """
+        super(DerivedRateCache, self).__init__(max_size=max_size)
+        self.ttl = ttl
+        self.generation = 0
+        self._legs = {}
+
+    @staticmethod
+    def legs(path: [str], date_obj: date) -> [tuple]:
+        """
+        Rates a path is made of
+        :param path: currency codes from currency to base currency
+        :param date_obj: date of the rates
+        :return: list of (date, pair of currencies) tuples
+        """
+        return [(date_obj, frozenset(pair))
+                for pair in zip(path[:-1], path[1:])]
+
+    def _unindex(self, key, path: [str]):
+        """
+        Remove an entry from the index of rates of paths
+        :param key: key of the entry
+        :param path: path of the entry
+        """
+        for leg in self.legs(path, key[3]):
+            keys = self._legs.get(leg)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._legs[leg]
+
+    def set(self, key, value):
+        """
+        Add or replace an entry, evicting old entries if needed
+        :param key: (key, base currency, currency, date) tuple
+        :param value: (value, path, expiration time) tuple
+        """
+        with self._lock:
+            self.pop(key)
+            self._data[key] = value
+            for leg in self.legs(value[1], key[3]):
+                self._legs.setdefault(leg, set()).add(key)
+            while len(self._data) > self.max_size:
+                evicted, (_, path, _) = self._data.popitem(last=False)
+                self._unindex(evicted, path)
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry from the cache
+        :param key: key of the entry
+        :param default: value returned if the key is not cached
+        """
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is None:
+                return default
+            self._unindex(key, value[1])
+            return value
+
+    def add(self, key, value: float, path: [str], generation: int):
+        """
+        Cache a derived rate, unless a rate changed since its computation
+        :param key: (key, base currency, currency, date) tuple
+        :param value: value of the rate
+        :param path: currency codes from currency to base currency
+        :param generation: generation read before computing the rate
+        """
+        with self._lock:
+            if generation == self.generation:
+                self.set(key, (value, tuple(path),
+                               time.monotonic() + self.ttl))
+
+    def value(self, key) -> float:
+        """
+        Value of a derived rate
+        :param key: (key, base currency, currency, date) tuple
+        :return: value, None if not cached or expired
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        value, path, expires = entry
+        if expires <= time.monotonic():
+            self.pop(key)
+            return None
+        return value
+
+    def invalidate(self, currency: str, base_currency: str,
+                   date_obj: date):
+        """
+        Remove derived rates whose path uses a rate
+        :param currency: currency of the rate that changed
+        :param base_currency: base currency of the rate that changed
+        :param date_obj: date of the rate that changed
+        """
+        with self._lock:
+            self.generation += 1
+            for key in list(self._legs.get(
+                    (date_obj, frozenset([currency, base_currency])), ())):
+                self.pop(key)
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        with self._lock:
+            super(DerivedRateCache, self).clear()
+            self._legs.clear()
+            self.generation += 1
+
+
+rate_graph_cache = RateGraphCache(
+    max_size=getattr(settings, 'RATE_GRAPH_CACHE_SIZE',
+                     RATE_GRAPH_CACHE_SIZE))
+rate_as_of_index = RateAsOfIndex(
+    max_size=getattr(settings, 'RATE_AS_OF_INDEX_SIZE',
+                     RATE_AS_OF_INDEX_SIZE))
+rate_fetch_failures = NegativeCache(
+    max_size=getattr(settings, 'RATE_FETCH_FAILURE_CACHE_SIZE',
+                     RATE_FETCH_FAILURE_CACHE_SIZE),
+    ttl=getattr(settings, 'RATE_FETCH_FAILURE_TTL',
+                RATE_FETCH_FAILURE_TTL))
+rate_fetches = SingleFlight(
+    prefix='rates:fetch',
+    lock_timeout=getattr(settings, 'RATE_SINGLE_FLIGHT_LOCK_TIMEOUT',
+                         RATE_SINGLE_FLIGHT_LOCK_TIMEOUT),
+    result_timeout=getattr(settings, 'RATE_SINGLE_FLIGHT_RESULT_TIMEOUT',
+                           RATE_SINGLE_FLIGHT_RESULT_TIMEOUT))
+rate_lookups = SingleFlight(
+    prefix='rates:find',
+    lock_timeout=getattr(settings, 'RATE_SINGLE_FLIGHT_LOCK_TIMEOUT',
+                         RATE_SINGLE_FLIGHT_LOCK_TIMEOUT),
+    result_timeout=getattr(settings, 'RATE_SINGLE_FLIGHT_RESULT_TIMEOUT',
+                           RATE_SINGLE_FLIGHT_RESULT_TIMEOUT))
+derived_rates = DerivedRateCache(
+    max_size=getattr(settings, 'RATE_DERIVED_CACHE_SIZE',
+                     RATE_DERIVED_CACHE_SIZE),
+    ttl=getattr(settings, 'RATE_DERIVED_CACHE_TTL',
+                RATE_DERIVED_CACHE_TTL))
+converter_rates = ConverterRateCache(
+    max_size=getattr(settings, 'RATE_CONVERTER_CACHE_SIZE',
+                     RATE_CONVERTER_CACHE_SIZE),
+    today_ttl=getattr(settings, 'RATE_CONVERTER_CACHE_TODAY_TTL',
+                      RATE_CONVERTER_CACHE_TODAY_TTL))
@@ -3,10 +3,10 @@ REST filters for Rate APIs
 """
 
 from django.db import models
-from django.db.models import OuterRef, Subquery, QuerySet
+from django.db.models import QuerySet
 from django_filters import rest_framework as filters
 
-from .models import Rate
+from .models import Rate, RateRollup, LatestRate
 
 
 class RateFilter(filters.FilterSet):
@@ -51,11 +51,11 @@ class RateFilter(filters.FilterSet):
     currency = filters.CharFilter(
         label="filter by target currency",
         field_name='currency',
-        lookup_expr='iexact')
+        method='currency_filter')
     base_currency = filters.CharFilter(
         label="filter by base currency",
         field_name='base_currency',
-        lookup_expr='iexact')
+        method='currency_filter')
     currency_latest_values = filters.CharFilter(
         label="Only output latest rates for currency",
         method='currency_latest_values_filter')
@@ -126,30 +126,80 @@ class RateFilter(filters.FilterSet):
         """
         return queryset.filter(key__isnull=True)
 
+    @staticmethod
+    def currency_filter(queryset: QuerySet,
+                        name: str, value: str) -> QuerySet:
+        """
+        Filter on currency or base currency, on both if rates are
+        stored in a single direction as the rates of the other direction
+        are derived from them
+        """
+        if Rate.objects.canonical_storage():
+            return queryset.filter(
+                models.Q(currency__iexact=value) |
+                models.Q(base_currency__iexact=value))
+        return queryset.filter(**{f'{name}__iexact': value})
+
     @staticmethod
     def currency_latest_values_filter(queryset: QuerySet,
                                       name: str, value: str) -> QuerySet:
         """
-        Returns a queryset of latest values fos a currency
+        Returns a queryset of latest values fos a currency,
+        read from the index of latest rates
         """
-        queryset = queryset.filter(currency=value)
-        latest = queryset.filter(
-            currency=OuterRef('currency')
-        ).order_by('-value_date')
-        return queryset.annotate(
-            currency_latest=Subquery(latest.values('value_date')[:1])
-        ).filter(value_date=models.F('currency_latest'))
+        latest = LatestRate.objects.filter(currency=value)
+        if Rate.objects.canonical_storage():
+            latest = LatestRate.objects.filter(
+                models.Q(currency=value) | models.Q(base_currency=value))
+        return queryset.filter(pk__in=latest.values('rate'))
 
     @staticmethod
     def base_currency_latest_values_filter(queryset: QuerySet,
                                            name: str, value: str) -> QuerySet:
         """
-        Returns a queryset of latest valeus for a base currency
+        Returns a queryset of latest valeus for a base currency,
+        read from the index of latest rates
+        """
+        latest = LatestRate.objects.filter(base_currency=value)
+        if Rate.objects.canonical_storage():
+            latest = LatestRate.objects.filter(
+                models.Q(currency=value) | models.Q(base_currency=value))
+        return queryset.filter(pk__in=latest.values('rate'))
+
+
+class RateRollupFilter(filters.FilterSet):
+    """
+    Rate rollup object filter, with the filters of rates
+    that rollups can answer
+    """
+    user = filters.BooleanFilter(
+        label="filter rollups associated to connected user",
+        method='user_filter')
+    key = filters.CharFilter(
+        label="filter rollups with key",
+        method='key_filter')
+    key_or_null = filters.CharFilter(
+        label="filter rollups with key or without key",
+        method='key_or_null_filter')
+    key_isnull = filters.CharFilter(
+        label="filter rollups without key", method='key_isnull_filter')
+    currency = filters.CharFilter(
+        label="filter by target currency",
+        field_name='currency',
+        lookup_expr='iexact')
+    base_currency = filters.CharFilter(
+        label="filter by base currency",
+        field_name='base_currency',
+        lookup_expr='iexact')
+
+    class Meta:
+        """
+        Meta
         """
-        queryset = queryset.filter(base_currency=value)
-        latest = queryset.filter(
-            base_currency=OuterRef('base_currency')
-        ).order_by('-value_date')
-        return queryset.annotate(
-            base_currency_latest=Subquery(latest.values('value_date')[:1])
-        ).filter(value_date=models.F('base_currency_latest'))
+        model = RateRollup
+        fields = []
+
+    user_filter = RateFilter.user_filter
+    key_filter = RateFilter.key_filter
+    key_or_null_filter = RateFilter.key_or_null_filter
+    key_isnull_filter = staticmethod(RateFilter.key_isnull_filter)
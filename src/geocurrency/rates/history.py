@@ -0,0 +1,308 @@
+"""
+Columnar history of rates in memory-mapped files
+"""
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from geocurrency.core.batches import CommitBatch
+
+from .settings import RATE_HISTORY_STORE_PATH
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Rates of a series, sorted by date
+SERIES_DTYPE = np.dtype([('date', 'datetime64[D]'), ('value', np.float64)])
+
+
+class RateHistoryStore:
+    """
+    History of rates stored as one file per (key, base currency, currency)
+    Each file is a NumPy array of (date, value) records sorted by date,
+    read as a memory map so that ranges are sliced without copy.
+    Files are replaced atomically when rates are written, writers of
+    a series being serialized by a lock file, so that processes do not
+    lose updates of each other. Rates written in a transaction are
+    written together once it is committed, each series being
+    rewritten once.
+    """
+    path = None
+
+    def __init__(self, path: str):
+        """
+        Initialize store
+        :param path: directory of the files
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._changes = CommitBatch(self.apply)
+
+    def _file(self, base_currency: str, currency: str,
+              key: str = None) -> str:
+        """
+        Path of the file of a series
+        :param base_currency: base currency code
+        :param currency: currency code
+        :param key: user defined key
+        """
+        directory = '_' if key is None else 'key-' + quote(key, safe='')
+        return os.path.join(self.path, directory,
+                            f'{base_currency}-{currency}.npy')
+
+    def series(self, base_currency: str, currency: str,
+               key: str = None) -> np.ndarray:
+        """
+        Rates of a pair of currencies, empty if unknown
+        :param base_currency: base currency code
+        :param currency: currency code
+        :param key: user defined key
+        :return: read only array of (date, value) records sorted by date
+        """
+        try:
+            return np.load(self._file(base_currency, currency, key),
+                           mmap_mode='r')
+        except FileNotFoundError:
+            return np.empty(0, dtype=SERIES_DTYPE)
+
+    def range(self, base_currency: str, currency: str, key: str = None,
+              date_obj: date = None,
+              to_obj: date = None) -> (np.ndarray, np.ndarray):
+        """
+        Dates and values of a pair of currencies in a range of dates,
+        views on the memory-mapped file
+        :param base_currency: base currency code
+        :param currency: currency code
+        :param key: user defined key
+        :param date_obj: beginning of range, included
+        :param to_obj: end of range, included
+        :return: arrays of datetime64[D] dates and float64 values
+        """
+        series = self.series(base_currency, currency, key)
+        dates = series['date']
+        start = np.searchsorted(
+            dates, np.datetime64(date_obj, 'D'), side='left') \
+            if date_obj else 0
+        end = np.searchsorted(
+            dates, np.datetime64(to_obj, 'D'), side='right') \
+            if to_obj else len(dates)
+        return dates[start:end], series['value'][start:end]
+
+    @staticmethod
+    def statistics(values: np.ndarray) -> {str: float}:
+        """
+        Statistics of values
+        :param values: array of values
+        """
+        if not len(values):
+            return {'count': 0, 'avg': None, 'median': None, 'min': None,
+                    'max': None, 'std_dev': None}
+        return {
+            'count': int(len(values)),
+            'avg': float(values.mean()),
+            'median': float(np.median(values)),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'std_dev': float(values.std()),
+        }
+
+    @staticmethod
+    def downsample(dates: np.ndarray, values: np.ndarray,
+                   interval: str = 'day') -> (np.ndarray, np.ndarray):
+        """
+        Average values by week or month
+        :param dates: sorted array of datetime64[D] dates
+        :param values: array of values
+        :param interval: 'day', 'week' or 'month'
+        :return: arrays of first days of periods and average values
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        if interval == 'week':
+            # 1970-01-01 being a thursday, weeks start 3 days before
+            weekdays = (dates.astype(np.int64) + 3) % 7
+            periods = dates - weekdays.astype('timedelta64[D]')
+        elif interval == 'month':
+            periods = dates.astype('datetime64[M]').astype('datetime64[D]')
+        else:
+            return dates, np.asarray(values, dtype=np.float64)
+        starts, inverse, counts = np.unique(
+            periods, return_inverse=True, return_counts=True)
+        sums = np.bincount(inverse, weights=values, minlength=len(starts))
+        return starts, sums / counts
+
+    @staticmethod
+    def rolling(values: np.ndarray,
+                window: int) -> (np.ndarray, np.ndarray):
+        """
+        Rolling average and standard deviation of values
+        :param values: array of values
+        :param window: number of values in the window
+        :return: arrays aligned with values, NaN until the window is full
+        """
+        means = np.full(len(values), np.nan)
+        std_devs = np.full(len(values), np.nan)
+        if 0 < window <= len(values):
+            windows = np.lib.stride_tricks.sliding_window_view(
+                np.asarray(values, dtype=np.float64), window)
+            means[window - 1:] = windows.mean(axis=1)
+            std_devs[window - 1:] = windows.std(axis=1)
+        return means, std_devs
+
+    def _write(self, base_currency: str, currency: str, key: str,
+               series: np.ndarray):
+        """
+        Replace the file of a series
+        :param base_currency: base currency code
+        :param currency: currency code
+        :param key: user defined key
+        :param series: array of (date, value) records sorted by date
+        :return: path of the file
+        """
+        file_path = self._file(base_currency, currency, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, series)
+        os.replace(tmp_path, file_path)
+        return file_path
+
+    @contextmanager
+    def _locked(self, file_path: str):
+        """
+        Lock a series against writers of this and other processes
+        :param file_path: path of the file of the series
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with self._lock, open(f'{file_path}.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def changed(self, rates, deleted: bool = False):
+        """
+        Write rates once the transaction is committed
+        :param rates: Rate objects written or deleted
+        :param deleted: rates were deleted
+        """
+        self._changes.add(
+            (rate.key, rate.base_currency, rate.currency, rate.value_date,
+             None if deleted else rate.value) for rate in rates)
+
+    def apply(self, changes: [tuple]):
+        """
+        Write changes of rates, rewriting each series once
+        :param changes: list of (key, base currency, currency,
+        date, value) tuples, value being None for removed rates,
+        last changes of a date winning
+        """
+        series = {}
+        for key, base_currency, currency, value_date, value in changes:
+            series.setdefault((key, base_currency, currency), {})[
+                np.datetime64(value_date, 'D')] = value
+        for (key, base_currency, currency), values in series.items():
+            with self._locked(self._file(base_currency, currency, key)):
+                existing = np.array(
+                    self.series(base_currency, currency, key))
+                dates = np.array(list(values), dtype='datetime64[D]')
+                kept = existing[~np.isin(existing['date'], dates)]
+                new = np.array(
+                    [(value_date, value)
+                     for value_date, value in values.items()
+                     if value is not None], dtype=SERIES_DTYPE)
+                merged = np.concatenate([kept, new])
+                self._write(base_currency, currency, key,
+                            merged[np.argsort(merged['date'],
+                                              kind='stable')])
+
+    def update(self, rates):
+        """
+        Add or replace rates in their series
+        :param rates: Rate objects
+        """
+        self.apply([(rate.key, rate.base_currency, rate.currency,
+                     rate.value_date, rate.value) for rate in rates])
+
+    def remove(self, rates):
+        """
+        Remove rates from their series
+        :param rates: Rate objects
+        """
+        self.apply([(rate.key, rate.base_currency, rate.currency,
+                     rate.value_date, None) for rate in rates])
+
+    def rebuild(self, queryset) -> int:
+        """
+        Replace the history with rates of a queryset,
+        files of other series are removed
+        :param queryset: Rate queryset
+        :return: number of series written
+        """
+        written = set()
+        current = None
+        dates, values = [], []
+        for key, base_currency, currency, value_date, value in \
+                queryset.order_by(
+                    'key', 'base_currency', 'currency', 'value_date'
+                ).values_list(
+                    'key', 'base_currency', 'currency',
+                    'value_date', 'value'
+                ).iterator():
+            if (key, base_currency, currency) != current:
+                if current:
+                    written.add(self._write_lists(*current, dates, values))
+                current = (key, base_currency, currency)
+                dates, values = [], []
+            dates.append(value_date)
+            values.append(value)
+        if current:
+            written.add(self._write_lists(*current, dates, values))
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                file_path = os.path.join(directory, name)
+                if name.endswith('.npy') and file_path not in written:
+                    with self._locked(file_path):
+                        os.remove(file_path)
+        return len(written)
+
+    def _write_lists(self, key: str, base_currency: str, currency: str,
+                     dates: [date], values: [float]):
+        """
+        Replace the file of a series from sorted lists
+        :param key: user defined key
+        :param base_currency: base currency code
+        :param currency: currency code
+        :param dates: sorted dates
+        :param values: values of the dates
+        :return: path of the file
+        """
+        series = np.empty(len(dates), dtype=SERIES_DTYPE)
+        series['date'] = np.array(dates, dtype='datetime64[D]')
+        series['value'] = values
+        with self._locked(self._file(base_currency, currency, key)):
+            return self._write(base_currency, currency, key, series)
+
+
+_stores = {}
+
+
+def rate_history_store():
+    """
+    History store of RATE_HISTORY_STORE_PATH, None if not configured
+    """
+    path = getattr(settings, 'RATE_HISTORY_STORE_PATH',
+                   RATE_HISTORY_STORE_PATH)
+    if not path:
+        return None
+    if path not in _stores:
+        _stores[path] = RateHistoryStore(path)
+    return _stores[path]
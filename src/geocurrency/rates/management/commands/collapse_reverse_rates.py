@@ -0,0 +1,89 @@
+"""
+Command to store rates in a single direction
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+
+class Command(BaseCommand):
+    """
+    Collapse reverse rates command
+    """
+    help = 'Delete reverse rates and invert rates stored in the other ' \
+           'direction, for RATE_CANONICAL_STORAGE'
+
+    def add_arguments(self, parser):
+        """
+        Add batch arguments to the command
+        """
+        parser.add_argument(
+            "-b",
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Number of rates processed per transaction")
+
+    def handle(self, *args, **options):
+        """
+        Handle call
+        """
+        from geocurrency.rates.history import rate_history_store
+        from geocurrency.rates.models import Rate, RateRollup, \
+            LatestRate, rates_changed
+        if not Rate.objects.canonical_storage():
+            raise CommandError("RATE_CANONICAL_STORAGE is not set")
+        batch_size = options.get('batch_size') or 10000
+        deleted, inverted = 0, 0
+        # The base currency of rates stored in the other direction
+        # comes after their currency in alphabetical order
+        reverse_rates = Rate.objects.filter(
+            base_currency__gt=F('currency')).order_by('pk')
+        while True:
+            with transaction.atomic():
+                rows = list(reverse_rates.values_list(
+                    'pk', 'key', 'currency', 'base_currency',
+                    'value_date', 'value')[:batch_size])
+                if not rows:
+                    break
+                canonical = set(Rate.objects.filter(
+                    currency__in={row[3] for row in rows},
+                    base_currency__in={row[2] for row in rows},
+                    value_date__in={row[4] for row in rows},
+                ).values_list('key', 'currency', 'base_currency',
+                              'value_date'))
+                duplicates, to_invert = [], []
+                for pk, key, currency, base_currency, value_date, value \
+                        in rows:
+                    if (key, base_currency, currency, value_date) \
+                            in canonical:
+                        duplicates.append(pk)
+                    else:
+                        to_invert.append(Rate(
+                            pk=pk,
+                            currency=base_currency,
+                            base_currency=currency,
+                            value=1 / value if value else 0))
+                # Signals are not sent for each rate, caches are
+                # invalidated per batch and indexes rebuilt at the end
+                LatestRate.objects.filter(rate__in=duplicates).delete()
+                Rate.objects.filter(pk__in=duplicates)._raw_delete(
+                    Rate.objects.db)
+                Rate.objects.get_queryset().bulk_update(
+                    to_invert, ['currency', 'base_currency', 'value'],
+                    batch_size=batch_size)
+                rates_changed([
+                    Rate(key=key, currency=currency,
+                         base_currency=base_currency, value_date=value_date)
+                    for _, key, currency, base_currency, value_date, _
+                    in rows])
+                deleted += len(duplicates)
+                inverted += len(to_invert)
+        self.stdout.write('{} reverse rates deleted, {} rates inverted.'
+                          .format(deleted, inverted))
+        LatestRate.objects.rebuild(Rate.objects.all())
+        RateRollup.objects.rebuild(Rate.objects.all())
+        store = rate_history_store()
+        if store:
+            store.rebuild(Rate.objects.all())
+        self.stdout.write('Rate indexes rebuilt.')
@@ -1,8 +1,14 @@
 """
 Command to fetch rates for all currencies
 """
-from datetime import datetime, date
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timedelta
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
 
@@ -34,6 +40,39 @@ class Command(BaseCommand):
             type=str,
             help="Rate service name. (forex, currencylayer, or other)"
                  "Defaults to forex. See SERVICES in settings")
+        parser.add_argument(
+            "-w",
+            '--workers',
+            type=int,
+            default=1,
+            help="Number of concurrent fetches, limited by "
+                 "RATE_SERVICE_CONCURRENCY for the service. Defaults to 1")
+        parser.add_argument(
+            "-m",
+            '--mode',
+            type=str,
+            choices=['per-base', 'single-base'],
+            default='per-base',
+            help="per-base fetches rates of every base currency, "
+                 "single-base fetches rates of the pivot currency "
+                 "and derives the other rates. Defaults to per-base")
+        parser.add_argument(
+            "-p",
+            '--pivot',
+            type=str,
+            help="Pivot currency of the single-base mode. "
+                 "Defaults to BASE_CURRENCY")
+        parser.add_argument(
+            "-i",
+            '--incremental',
+            action='store_true',
+            help="Only fetch dates without rates, "
+                 "skipping dates recorded in the state file")
+        parser.add_argument(
+            '--state-file',
+            type=str,
+            help="State file of the incremental mode. "
+                 "Defaults to RATE_FETCH_STATE_FILE")
 
     def handle(self, *args, **options):
         """
@@ -41,6 +80,7 @@ class Command(BaseCommand):
         """
         from geocurrency.currencies.models import Currency
         from geocurrency.rates.models import Rate
+        from geocurrency.rates.settings import RATE_FETCH_STATE_FILE
         today = date.today().strftime('%Y-%m-%d')
         try:
             from_date = datetime.strptime(
@@ -51,13 +91,312 @@ class Command(BaseCommand):
             print("invalid dates")
             exit(-1)
         rate_service = options.get('service') or 'forex'
+        currencies = self.available_currencies(
+            [c.code for c in Currency.all_currencies()], rate_service)
+
+        if options.get('incremental'):
+            self.fetch_incremental(
+                currencies=currencies,
+                rate_service=rate_service,
+                from_date=from_date.date(),
+                to_date=to_date.date(),
+                pivot=(options.get('pivot') or settings.BASE_CURRENCY)
+                if options.get('mode') == 'single-base' else None,
+                state_file=options.get('state_file') or getattr(
+                    settings, 'RATE_FETCH_STATE_FILE', RATE_FETCH_STATE_FILE))
+            return
+
+        if options.get('mode') == 'single-base':
+            self.fetch_single_base(
+                currencies=currencies,
+                rate_service=rate_service,
+                from_date=from_date,
+                to_date=to_date,
+                pivot=options.get('pivot') or settings.BASE_CURRENCY)
+            return
+
+        if options.get('workers', 1) > 1:
+            self.fetch_concurrently(
+                currencies=currencies,
+                rate_service=rate_service,
+                from_date=from_date,
+                to_date=to_date,
+                workers=options['workers'])
+            return
 
-        for currency in Currency.all_currencies():
+        for currency in currencies:
             self.stdout.write(
-                'fetching rates for currency {}.'.format(currency.code))
-            Rate.objects.fetch_rates(
-                base_currency=currency.code,
+                'fetching rates for currency {}.'.format(currency))
+            counts = Rate.objects.fetch_rates(
+                base_currency=currency,
                 date_obj=from_date,
                 to_obj=to_date,
-                rate_service=rate_service
+                rate_service=rate_service,
+                bulk=True
             )
+            if counts:
+                self.stdout.write(
+                    '{inserted} inserted, {updated} updated, '
+                    '{unchanged} unchanged.'.format(**counts))
+
+    def available_currencies(self, currencies: [str],
+                             rate_service: str) -> [str]:
+        """
+        Currencies available from the rate service, every currency
+        if the service does not list them or lists none
+        :param currencies: currency codes
+        :param rate_service: name of the rate service
+        """
+        from geocurrency.core.helpers import service
+        from geocurrency.rates.services import RatesNotAvailableError
+        try:
+            available = service(
+                service_type='rates', service_name=rate_service
+            ).cached_available_currencies()
+        except (NotImplementedError, RatesNotAvailableError):
+            return currencies
+        if not available:
+            self.stderr.write(
+                'no available currencies from {}, '
+                'fetching every currency.'.format(rate_service))
+            return currencies
+        return [c for c in currencies if c in available]
+
+    def fetch_concurrently(self, currencies: [str], rate_service: str,
+                           from_date: date, to_date: date, workers: int):
+        """
+        Fetch rates of base currencies in a pool of threads,
+        rates are written by batches from the main thread only
+        :param currencies: base currencies to fetch rates for
+        :param rate_service: name of the rate service
+        :param from_date: start of the range
+        :param to_date: end of the range
+        :param workers: number of threads
+        """
+        from geocurrency.core.helpers import service
+        from geocurrency.rates.models import Rate, RateFetch
+        from geocurrency.rates.services import RatesNotAvailableError
+        from geocurrency.rates.settings import RATE_BULK_BATCH_SIZE, \
+            RATE_SERVICE_CONCURRENCY
+        limits = getattr(settings, 'RATE_SERVICE_CONCURRENCY',
+                         RATE_SERVICE_CONCURRENCY)
+        semaphore = threading.BoundedSemaphore(
+            min(workers, limits.get(rate_service, workers)))
+        batch_size = getattr(
+            settings, 'RATE_BULK_BATCH_SIZE', RATE_BULK_BATCH_SIZE)
+        rate_service_obj = service(
+            service_type='rates', service_name=rate_service)
+
+        def fetch(base_currency: str) -> []:
+            with semaphore:
+                try:
+                    # Ranges iterated from the service are fetched
+                    # by the thread, not by the main thread
+                    return list(rate_service_obj.fetch_rates(
+                        base_currency=base_currency,
+                        date_obj=from_date,
+                        to_obj=to_date) or [])
+                except RatesNotAvailableError:
+                    return []
+
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                  'conflicts': 0}
+        pending = []
+        fetched = errors = 0
+        start = time.monotonic()
+
+        def flush():
+            RateFetch.objects.record(pending)
+            for k, v in Rate.objects.bulk_sync_rates(rates=pending).items():
+                counts[k] += v
+            pending.clear()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch, currency): currency
+                       for currency in currencies}
+            for done, future in enumerate(as_completed(futures), 1):
+                rates = self.future_rates(
+                    future, progress='[{}/{}] {}'.format(
+                        done, len(futures), futures[future]))
+                if rates is None:
+                    errors += 1
+                    continue
+                fetched += len(rates)
+                pending.extend(rates)
+                if len(pending) >= batch_size:
+                    flush()
+            if pending:
+                flush()
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            '{inserted} inserted, {updated} updated, '
+            '{unchanged} unchanged.'.format(**counts))
+        self.stdout.write(
+            '{} currencies, {} rates, {} errors in {:.1f}s: '
+            '{:.1f} currencies/s, {:.1f} rates/s.'.format(
+                len(currencies), fetched, errors, elapsed,
+                len(currencies) / elapsed if elapsed else 0,
+                fetched / elapsed if elapsed else 0))
+
+    def future_rates(self, future, progress: str) -> []:
+        """
+        Rates fetched by a future, reporting its progress
+        :param future: future of a fetch
+        :param progress: prefix of the messages
+        :return: list of rates, None if the fetch failed
+        """
+        try:
+            rates = future.result()
+        except Exception as e:
+            self.stderr.write('{}: {}'.format(progress, e))
+            return None
+        self.stdout.write('{}: {} rates fetched.'.format(
+            progress, len(rates)))
+        return rates
+
+    def fetch_single_base(self, currencies: [str], rate_service: str,
+                          from_date: date, to_date: date, pivot: str):
+        """
+        Fetch rates of the pivot currency for the range
+        and derive the rates between every pair of currencies
+        :param currencies: currencies to store rates for
+        :param rate_service: name of the rate service
+        :param from_date: start of the range
+        :param to_date: end of the range
+        :param pivot: base currency of the fetched rates
+        :return: counts of rates written, False if the service has no rates
+        """
+        from geocurrency.core.helpers import service, to_date as to_date_obj
+        from geocurrency.rates.models import Rate, RateFetch
+        from geocurrency.rates.services import RatesNotAvailableError
+        rate_service_obj = service(
+            service_type='rates', service_name=rate_service)
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                  'conflicts': 0}
+        start = time.monotonic()
+        rates_by_date = {}
+        try:
+            for rate in rate_service_obj.fetch_rates(
+                    base_currency=pivot, date_obj=from_date, to_obj=to_date):
+                rates_by_date.setdefault(
+                    to_date_obj(rate['date']), []).append(rate)
+        except RatesNotAvailableError:
+            self.stderr.write('no rates for {}.'.format(pivot))
+            return False
+        for date_obj, date_rates in sorted(rates_by_date.items()):
+            cross_rates = Rate.objects.cross_rates(
+                rates=date_rates, pivot=pivot, currencies=currencies)
+            RateFetch.objects.record(cross_rates)
+            for k, v in Rate.objects.bulk_sync_rates(
+                    rates=cross_rates).items():
+                counts[k] += v
+            self.stdout.write('{}: {} rates derived from {} {} rates.'.format(
+                date_obj.strftime('%Y-%m-%d'), len(cross_rates),
+                len(date_rates), pivot))
+        self.stdout.write(
+            '{inserted} inserted, {updated} updated, '
+            '{unchanged} unchanged in {elapsed:.1f}s.'.format(
+                elapsed=time.monotonic() - start, **counts))
+        return counts if rates_by_date else False
+
+    @staticmethod
+    def date_ranges(dates: [date]) -> [(date, date)]:
+        """
+        Group sorted dates in ranges of consecutive days
+        :param dates: sorted dates
+        :return: list of (beginning, end) of ranges
+        """
+        ranges = []
+        for date_obj in dates:
+            if ranges and (date_obj - ranges[-1][1]).days == 1:
+                ranges[-1] = (ranges[-1][0], date_obj)
+            else:
+                ranges.append((date_obj, date_obj))
+        return ranges
+
+    @staticmethod
+    def load_state(state_file: str) -> {}:
+        """
+        Load state of the incremental mode
+        :param state_file: path of the state file
+        :return: dict of fetched ranges by service and base currency
+        """
+        try:
+            with open(state_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def save_state(state_file: str, state: {}):
+        """
+        Save state of the incremental mode, replacing the file atomically
+        :param state_file: path of the state file
+        :param state: dict of fetched ranges by service and base currency
+        """
+        with open(state_file + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(state_file + '.tmp', state_file)
+
+    def fetch_incremental(self, currencies: [str], rate_service: str,
+                          from_date: date, to_date: date, pivot: str,
+                          state_file: str):
+        """
+        Fetch dates without rates only. Fetched ranges are recorded
+        in a state file after each fetch, so that an interrupted run
+        resumes where it stopped and dates without rates from the service,
+        like week-ends, are not fetched again.
+        :param currencies: base currencies to fetch rates for
+        :param rate_service: name of the rate service
+        :param from_date: start of the range
+        :param to_date: end of the range
+        :param pivot: base currency of the single-base mode,
+        None to fetch every base currency
+        :param state_file: path of the state file
+        """
+        from geocurrency.rates.models import Rate
+        state = self.load_state(state_file)
+        fetched = state.setdefault(rate_service, {})
+        missing = Rate.objects.missing_dates(
+            base_currencies=[pivot] if pivot else currencies,
+            date_obj=from_date,
+            to_obj=to_date)
+        for base_currency, dates in missing.items():
+            done = set()
+            for start, end in fetched.get(base_currency, []):
+                start, end = date.fromisoformat(start), date.fromisoformat(end)
+                done.update(start + timedelta(i)
+                            for i in range((end - start).days + 1))
+            for start, end in self.date_ranges(
+                    [d for d in dates if d not in done]):
+                self.stdout.write(
+                    'fetching rates for {} from {} to {}.'.format(
+                        base_currency, start, end))
+                if pivot:
+                    counts = self.fetch_single_base(
+                        currencies=currencies,
+                        rate_service=rate_service,
+                        from_date=start,
+                        to_date=end,
+                        pivot=pivot)
+                else:
+                    counts = Rate.objects.fetch_rates(
+                        base_currency=base_currency,
+                        date_obj=start,
+                        to_obj=end,
+                        rate_service=rate_service,
+                        bulk=True
+                    )
+                    if counts:
+                        self.stdout.write(
+                            '{inserted} inserted, {updated} updated, '
+                            '{unchanged} unchanged.'.format(**counts))
+                if not counts:
+                    # Service not available, try again on next run
+                    continue
+                done.update(start + timedelta(i)
+                            for i in range((end - start).days + 1))
+                fetched[base_currency] = [
+                    [s.isoformat(), e.isoformat()]
+                    for s, e in self.date_ranges(sorted(done))]
+                self.save_state(state_file, state)
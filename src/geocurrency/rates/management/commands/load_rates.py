@@ -0,0 +1,76 @@
+"""
+Command to load rates from a file
+"""
+import csv
+import time
+from itertools import islice
+from xml.etree.ElementTree import ParseError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Load rates command
+    """
+    help = 'Load rates from a CSV or ECB XML file'
+
+    def add_arguments(self, parser):
+        """
+        Add file arguments to the command
+        """
+        parser.add_argument(
+            'path',
+            type=str,
+            help="Path of the file, CSV or ECB XML, optionally gzipped")
+        parser.add_argument(
+            "-b",
+            '--base',
+            type=str,
+            help="Base currency of files without base currency column. "
+                 "Defaults to RATE_FILE_BASE_CURRENCY")
+        parser.add_argument(
+            "-c",
+            '--chunk-size',
+            type=int,
+            help="Number of rates written at once. "
+                 "Defaults to RATE_FILE_LOAD_CHUNK_SIZE")
+
+    def handle(self, *args, **options):
+        """
+        Handle call
+        """
+        from geocurrency.rates.models import Rate
+        from geocurrency.rates.services import RatesNotAvailableError
+        from geocurrency.rates.services.file import FileRateService
+        from geocurrency.rates.settings import RATE_FILE_LOAD_CHUNK_SIZE
+        chunk_size = options.get('chunk_size') or getattr(
+            settings, 'RATE_FILE_LOAD_CHUNK_SIZE', RATE_FILE_LOAD_CHUNK_SIZE)
+        rate_file = FileRateService(
+            path=options['path'], base_currency=options.get('base'))
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                  'conflicts': 0}
+        read = 0
+        start = time.monotonic()
+        try:
+            rates = rate_file.iter_rates()
+            chunk = list(islice(rates, chunk_size))
+            while chunk:
+                for k, v in Rate.objects.bulk_sync_rates(
+                        rates=chunk).items():
+                    counts[k] += v
+                read += len(chunk)
+                self.stdout.write('{} rates read.'.format(read))
+                chunk = list(islice(rates, chunk_size))
+        except RatesNotAvailableError as e:
+            raise CommandError(str(e))
+        except (ValueError, ParseError, csv.Error) as e:
+            raise CommandError('Invalid file: {}'.format(e))
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            '{inserted} inserted, {updated} updated, '
+            '{unchanged} unchanged, {conflicts} owned by another user.'
+            .format(**counts))
+        self.stdout.write('{} rates in {:.1f}s: {:.1f} rates/s.'.format(
+            read, elapsed, read / elapsed if elapsed else 0))
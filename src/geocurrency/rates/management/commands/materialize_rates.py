@@ -0,0 +1,64 @@
+"""
+Command to materialize rate matrices
+"""
+from datetime import datetime, date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Materialize rates command
+    """
+    help = 'Compute the rates between every pair of currencies for dates'
+
+    def add_arguments(self, parser):
+        """
+        Add date arguments to the command
+        """
+        parser.add_argument(
+            "-f",
+            '--from_date',
+            type=str,
+            help="Date in YYYY-MM-DD format."
+                 "Start of the range, defaults to today")
+        parser.add_argument(
+            "-t",
+            '--to_date',
+            type=str,
+            help="Date in YYYY-MM-DD format."
+                 "End of the range, defaults to from_date")
+        parser.add_argument(
+            "-p",
+            '--pivot',
+            type=str,
+            help="Currency the rates are resolved to. "
+                 "Defaults to BASE_CURRENCY")
+
+    def handle(self, *args, **options):
+        """
+        Handle call
+        """
+        from geocurrency.rates.models import RateMatrix
+        today = date.today().strftime('%Y-%m-%d')
+        try:
+            from_date = datetime.strptime(
+                options.get('from_date') or today, '%Y-%m-%d').date()
+            to_date = datetime.strptime(
+                options.get('to_date') or options.get('from_date') or today,
+                '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError("invalid dates")
+        pivot = options.get('pivot') or settings.BASE_CURRENCY
+        for i in range((to_date - from_date).days + 1):
+            date_obj = from_date + timedelta(i)
+            rate_matrix = RateMatrix.objects.materialize(
+                date_obj=date_obj, pivot=pivot)
+            if rate_matrix:
+                self.stdout.write('{}: {} currencies.'.format(
+                    date_obj.strftime('%Y-%m-%d'),
+                    len(rate_matrix.currencies)))
+            else:
+                self.stdout.write('{}: no rates.'.format(
+                    date_obj.strftime('%Y-%m-%d')))
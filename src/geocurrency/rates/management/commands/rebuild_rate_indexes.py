@@ -0,0 +1,47 @@
+"""
+Command to rebuild indexes of rates
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Rebuild rate indexes command
+    """
+    help = 'Rebuild indexes of rates from the database'
+
+    def add_arguments(self, parser):
+        """
+        Add index arguments to the command
+        """
+        parser.add_argument(
+            '--history',
+            action='store_true',
+            help="Rebuild the history store of RATE_HISTORY_STORE_PATH")
+        parser.add_argument(
+            '--rollups',
+            action='store_true',
+            help="Rebuild the weekly, monthly and yearly rollups of rates")
+        parser.add_argument(
+            '--latest',
+            action='store_true',
+            help="Rebuild the index of latest rates")
+
+    def handle(self, *args, **options):
+        """
+        Handle call
+        """
+        from geocurrency.rates.history import rate_history_store
+        from geocurrency.rates.models import Rate, RateRollup, LatestRate
+        if options.get('history'):
+            store = rate_history_store()
+            if not store:
+                raise CommandError("RATE_HISTORY_STORE_PATH is not set")
+            count = store.rebuild(Rate.objects.all())
+            self.stdout.write('{} rate series written.'.format(count))
+        if options.get('rollups'):
+            count = RateRollup.objects.rebuild(Rate.objects.all())
+            self.stdout.write('{} rate rollups written.'.format(count))
+        if options.get('latest'):
+            count = LatestRate.objects.rebuild(Rate.objects.all())
+            self.stdout.write('{} latest rates written.'.format(count))
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rates', '0005_auto_20210419_1548'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateMatrix',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value_date', models.DateField(unique=True, verbose_name='Date of value')),
+                ('currencies', models.JSONField(verbose_name='Currencies of rows and columns')),
+                ('values', models.BinaryField(verbose_name='Values of the rates')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Date of computation')),
+            ],
+        ),
+    ]
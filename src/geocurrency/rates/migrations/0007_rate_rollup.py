@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rates', '0006_rate_matrix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(default=None, max_length=255, null=True, verbose_name='User defined categorization key')),
+                ('base_currency', models.CharField(max_length=3, verbose_name='Currency to convert to')),
+                ('currency', models.CharField(max_length=3, verbose_name='Currency to convert from')),
+                ('period', models.CharField(choices=[('week', 'Week'), ('month', 'Month'), ('year', 'Year')], max_length=5, verbose_name='Period')),
+                ('year', models.IntegerField(verbose_name='Year')),
+                ('number', models.IntegerField(verbose_name='Week or month in the year, 0 for years')),
+                ('count', models.IntegerField(default=0, verbose_name='Number of rates')),
+                ('sum', models.FloatField(default=0, verbose_name='Sum of values')),
+                ('sumsq', models.FloatField(default=0, verbose_name='Sum of squares of values')),
+                ('min', models.FloatField(null=True, verbose_name='Minimum value')),
+                ('max', models.FloatField(null=True, verbose_name='Maximum value')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rate_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='raterollup',
+            index=models.Index(fields=['base_currency', 'currency', 'period', 'year', 'number'], name='rates_rater_base_cu_47ae51_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_latest_rates(apps, schema_editor):
+    """
+    Index the latest rate of each series of existing rates
+    """
+    Rate = apps.get_model('rates', 'Rate')
+    LatestRate = apps.get_model('rates', 'LatestRate')
+    latest_rates = []
+    current = None
+    for pk, user_id, key, base_currency, currency, value_date, value in \
+            Rate.objects.order_by(
+                'key', 'base_currency', 'currency', '-value_date'
+            ).values_list(
+                'pk', 'user', 'key', 'base_currency', 'currency',
+                'value_date', 'value').iterator():
+        if (key, base_currency, currency) == current:
+            continue
+        current = (key, base_currency, currency)
+        latest_rates.append(LatestRate(
+            rate_id=pk, user_id=user_id, key=key,
+            base_currency=base_currency, currency=currency,
+            value_date=value_date, value=value))
+    LatestRate.objects.bulk_create(latest_rates, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('rates', '0007_rate_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestRate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(default=None, max_length=255, null=True, verbose_name='User defined categorization key')),
+                ('base_currency', models.CharField(db_index=True, max_length=3, verbose_name='Currency to convert to')),
+                ('currency', models.CharField(db_index=True, max_length=3, verbose_name='Currency to convert from')),
+                ('value_date', models.DateField(verbose_name='Date of value')),
+                ('value', models.FloatField(verbose_name='Rate conversion factor')),
+                ('rate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='latest', to='rates.rate')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='latest_rates', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(index_latest_rates,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rates', '0008_latest_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateFetch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_currency', models.CharField(max_length=3, verbose_name='Base currency of fetched rates')),
+                ('value_date', models.DateField(verbose_name='Date of value')),
+            ],
+            options={
+                'unique_together': {('base_currency', 'value_date')},
+            },
+        ),
+    ]
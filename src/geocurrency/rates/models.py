@@ -2,25 +2,35 @@
 Models for Rates module
 """
 from datetime import date, timedelta
+from itertools import islice
 
 import networkx as nx
+import numpy as np
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from geocurrency.converters.models import BaseConverter, \
     ConverterResult, ConverterResultDetail, \
     ConverterResultError
-from geocurrency.core.helpers import service
+from geocurrency.core.helpers import service, to_date
 
 try:
     RATE_SERVICE = settings.RATE_SERVICE
 except AttributeError:
     pass
 
-from .services import RatesNotAvailableError
+from .bus import rate_invalidation_bus
+from .caches import rate_graph_cache, rate_as_of_index, \
+    rate_fetch_failures, rate_fetches, rate_lookups, derived_rates, \
+    converter_rates
+from .history import rate_history_store
+from .results import rate_results
+from .services import RatesNotAvailableError, RateService
+from .settings import RATE_BULK_BATCH_SIZE, RATE_AS_OF_MAX_STALENESS, \
+    RATE_CANONICAL_STORAGE, RATE_FETCH_CHUNK_SIZE
 
 
 class NoRateFound(Exception):
@@ -48,6 +58,50 @@ class RateManager(models.Manager):
     Manager for Rate model
     """
 
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Bulk insert rates, invalidating in-process caches
+        as bulk inserts do not send post_save signals
+        """
+        objs = super(RateManager, self).bulk_create(objs, *args, **kwargs)
+        rates_changed(objs)
+        history_changed(objs)
+        rollups_changed(objs, inserted=True)
+        LatestRate.objects.add(objs)
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        """
+        Bulk update rates, invalidating in-process caches
+        as bulk updates do not send post_save signals
+        Rates must have their key, currencies, value date and value set
+        """
+        updated = super(RateManager, self).bulk_update(objs, *args, **kwargs)
+        rates_changed(objs)
+        history_changed(objs)
+        rollups_changed(objs)
+        LatestRate.objects.add(objs)
+        return updated
+
+    @staticmethod
+    def canonical_storage() -> bool:
+        """
+        Rates are stored in a single direction, see RATE_CANONICAL_STORAGE
+        """
+        return getattr(settings, 'RATE_CANONICAL_STORAGE',
+                       RATE_CANONICAL_STORAGE)
+
+    @staticmethod
+    def is_canonical(currency: str, base_currency: str) -> bool:
+        """
+        Direction in which rates of a pair are stored with
+        RATE_CANONICAL_STORAGE, the base currency being first
+        in alphabetical order
+        :param currency: source currency code
+        :param base_currency: base currency code
+        """
+        return base_currency <= currency
+
     @staticmethod
     def __sync_rates__(rates: [], base_currency: str):
         """
@@ -57,24 +111,139 @@ class RateManager(models.Manager):
         """
         output = []
         for rate in rates:
-            _rate, created = Rate.objects.get_or_create(
+            stored = Rate(
                 base_currency=base_currency,
                 currency=rate.get('currency'),
                 value_date=rate.get('date'),
+                value=rate.get('value')
+            ).canonical()
+            _rate, created = Rate.objects.get_or_create(
+                base_currency=stored.base_currency,
+                currency=stored.currency,
+                value_date=stored.value_date,
                 user=None,
-                key=None
+                key=None,
+                defaults={'value': stored.value}
             )
-            _rate.value = rate.get('value')
-            _rate.save()
+            if not created and _rate.value != stored.value:
+                _rate.value = stored.value
+                _rate.save()
             output.append(_rate)
         return output
 
+    def bulk_sync_rates(self, rates: [],
+                        user: User = None,
+                        key: str = None,
+                        batch_size: int = None,
+                        update_inverses: bool = False) -> {str: int}:
+        """
+        Upsert rates to the database by batches in a single transaction.
+        Inverse rates are inserted in the same batches if they
+        do not exist yet, rates whose value did not change are not written.
+        With RATE_CANONICAL_STORAGE, only rates of the canonical direction
+        are written, rates of the other direction being inverted.
+        :param rates: array of dict of rates from service
+        :param user: owner of the rates
+        :param key: user defined key
+        :param batch_size: number of rates written per query
+        :param update_inverses: also update existing inverse rates
+        :return: dict with counts of inserted, updated and unchanged rates,
+        and of rates not written as they belong to another user
+        """
+        batch_size = batch_size or getattr(
+            settings, 'RATE_BULK_BATCH_SIZE', RATE_BULK_BATCH_SIZE)
+        values = {}
+        for rate in rates:
+            if rate.get('value') is None:
+                continue
+            values[(rate.get('currency'),
+                    rate.get('base_currency'),
+                    to_date(rate.get('date')))] = rate.get('value')
+        inverses = {
+            (base_currency, currency, date_obj): 1 / value
+            for (currency, base_currency, date_obj), value in values.items()
+            if value and (base_currency, currency, date_obj) not in values
+        }
+        if self.canonical_storage():
+            # Rates are stored in a single direction, without inverses
+            values = {
+                rate_key: value
+                for rate_key, value in list(values.items()) +
+                list(inverses.items())
+                if self.is_canonical(rate_key[0], rate_key[1])
+            }
+            inverses = {}
+        else:
+            values.update(inverses)
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                  'conflicts': 0}
+        user_id = user.pk if user else None
+        # Rates with a key are unique by key, currencies and date,
+        # whatever their owner, NULL keys never conflict
+        owner = models.Q(key=key) if key is not None else \
+            models.Q(key__isnull=True, user=user)
+        rate_keys = sorted(values.keys(), key=lambda k: (k[2], k[1], k[0]))
+        with transaction.atomic():
+            for i in range(0, len(rate_keys), batch_size):
+                batch = rate_keys[i:i + batch_size]
+                existing = {
+                    (currency, base_currency, value_date):
+                        (pk, value, owner_id)
+                    for pk, currency, base_currency, value_date, value,
+                    owner_id in self.filter(
+                        owner,
+                        value_date__in={k[2] for k in batch},
+                        currency__in={k[0] for k in batch},
+                        base_currency__in={k[1] for k in batch}
+                    ).values_list(
+                        'pk', 'currency', 'base_currency',
+                        'value_date', 'value', 'user')
+                }
+                to_create = []
+                to_update = []
+                for rate_key in batch:
+                    currency, base_currency, date_obj = rate_key
+                    if rate_key not in existing:
+                        to_create.append(Rate(
+                            user=user,
+                            key=key,
+                            currency=currency,
+                            base_currency=base_currency,
+                            value_date=date_obj,
+                            value=values[rate_key]))
+                    elif existing[rate_key][2] != user_id:
+                        # Rates of other users are not overwritten
+                        counts['conflicts'] += 1
+                    elif (rate_key in inverses and not update_inverses) or \
+                            existing[rate_key][1] == values[rate_key]:
+                        counts['unchanged'] += 1
+                    else:
+                        rate = Rate(
+                            pk=existing[rate_key][0],
+                            user=user,
+                            key=key,
+                            currency=currency,
+                            base_currency=base_currency,
+                            value_date=date_obj,
+                            value=values[rate_key])
+                        rate.stored_value = existing[rate_key][1]
+                        to_update.append(rate)
+                # Conflicts with concurrent writes raise IntegrityError
+                # instead of silently dropping rates
+                self.bulk_create(to_create, batch_size=batch_size)
+                self.bulk_update(
+                    to_update, ['value'], batch_size=batch_size)
+                counts['inserted'] += len(to_create)
+                counts['updated'] += len(to_update)
+        return counts
+
     def fetch_rates(self,
                     base_currency: str,
                     currency: str = None,
                     rate_service: str = None,
                     date_obj: date = date.today(),
-                    to_obj: date = None) -> []:
+                    to_obj: date = None,
+                    bulk: bool = False) -> []:
         """
         Get rates from a service for a base currency
         and stores them in the database
@@ -83,23 +252,158 @@ class RateManager(models.Manager):
         :param base_currency: base currency to get rate from
         :param date_obj: date to fetch rates at
         :param to_obj: end of range
-        :return: QuerySet of Rate
+        :param bulk: store rates with bulk_sync_rates
+        :return: QuerySet of Rate, or counts of rates
+        written if bulk is True, False if the service has no rates.
+        Failed fetches are not retried before RATE_FETCH_FAILURE_TTL,
+        concurrent fetches of the same rates are done once.
         """
         service_name = rate_service or settings.RATE_SERVICE
-        try:
-            rates = service(
-                service_type='rates',
-                service_name=service_name
-            ).fetch_rates(
-                base_currency=base_currency,
-                currency=currency,
-                date_obj=date_obj,
-                to_obj=to_obj)
-            if not rates:
-                return False
-        except RatesNotAvailableError:
+        failure_key = (
+            service_name, base_currency, currency, to_date(date_obj),
+            to_date(to_obj) if to_obj else None)
+        if rate_fetch_failures.failed(failure_key):
             return False
-        return self.__sync_rates__(rates=rates, base_currency=base_currency)
+
+        def fetch():
+            try:
+                rates = service(
+                    service_type='rates',
+                    service_name=service_name
+                ).fetch_rates(
+                    base_currency=base_currency,
+                    currency=currency,
+                    date_obj=date_obj,
+                    to_obj=to_obj)
+                with transaction.atomic():
+                    stored = self._store_fetched(
+                        rates, base_currency=base_currency, bulk=bulk)
+            except RatesNotAvailableError:
+                stored = None
+            if stored is None:
+                rate_fetch_failures.add(failure_key)
+                return False
+            return stored
+
+        # Concurrent fetches of the same rates wait for the first one
+        return rate_fetches.do(key=failure_key + (bulk,), fn=fetch)
+
+    def _store_fetched(self, rates, base_currency: str,
+                       bulk: bool = False):
+        """
+        Store rates fetched from a rate service by chunks of
+        RATE_FETCH_CHUNK_SIZE, so that rates of ranges iterated from
+        the service are not held in memory
+        :param rates: iterable of dict of rates from service
+        :param base_currency: base currency of the fetch
+        :param bulk: store rates with bulk_sync_rates
+        :return: list of Rate, or counts of rates written if bulk is True,
+        None if there are no rates
+        """
+        chunk_size = getattr(
+            settings, 'RATE_FETCH_CHUNK_SIZE', RATE_FETCH_CHUNK_SIZE)
+        rates = iter(rates or [])
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                  'conflicts': 0}
+        output = []
+        chunk = list(islice(rates, chunk_size))
+        if not chunk:
+            return None
+        while chunk:
+            RateFetch.objects.record(chunk, base_currency=base_currency)
+            if bulk:
+                for k, v in self.bulk_sync_rates(rates=chunk).items():
+                    counts[k] += v
+            else:
+                output.extend(self.__sync_rates__(
+                    rates=chunk, base_currency=base_currency))
+            chunk = list(islice(rates, chunk_size))
+        return counts if bulk else output
+
+    def missing_dates(self, base_currencies: [str],
+                      date_obj: date, to_obj: date) -> {str: [date]}:
+        """
+        Dates of a range without rates from the rate service
+        for base currencies. Rates of a base currency are present
+        if they were fetched for this base currency, inverse rates
+        written by fetches of other base currencies do not count,
+        and if they were not deleted since.
+        :param base_currencies: base currencies to check
+        :param date_obj: beginning of range
+        :param to_obj: end of range
+        :return: dict of sorted missing dates by base currency
+        """
+        fetched = set(RateFetch.objects.filter(
+            base_currency__in=base_currencies,
+            value_date__range=(date_obj, to_obj)
+        ).values_list('base_currency', 'value_date'))
+        rates = self.filter(
+            key__isnull=True,
+            value_date__range=(date_obj, to_obj)
+        ).order_by()
+        stored = set(rates.filter(
+            base_currency__in=base_currencies
+        ).values_list('base_currency', 'value_date').distinct())
+        if self.canonical_storage():
+            # Rates of a base currency may be stored inverted
+            stored.update(rates.filter(
+                currency__in=base_currencies
+            ).values_list('currency', 'value_date').distinct())
+        existing = fetched & stored
+        dates = [date_obj + timedelta(i)
+                 for i in range((to_obj - date_obj).days + 1)]
+        return {
+            base_currency: [d for d in dates
+                            if (base_currency, d) not in existing]
+            for base_currency in base_currencies
+        }
+
+    @staticmethod
+    def cross_rates(rates: [], pivot: str,
+                    currencies: [str] = None) -> []:
+        """
+        Derive the rates between every pair of currencies
+        from the rates of a pivot currency
+        :param rates: array of dict of rates from service,
+        with pivot as base currency
+        :param pivot: base currency of the rates
+        :param currencies: restrict the result to these currencies
+        :return: array of dict of rates, one per pair and date
+        """
+        quotes = {}
+        for rate in rates:
+            if rate.get('base_currency') != pivot or not rate.get('value'):
+                continue
+            if currencies and rate.get('currency') not in currencies:
+                continue
+            quotes.setdefault(to_date(rate.get('date')), {})[
+                rate.get('currency')] = rate.get('value')
+        cross = []
+        for date_obj, date_quotes in quotes.items():
+            date_quotes[pivot] = 1
+            codes = np.array(sorted(date_quotes))
+            values = np.array([date_quotes[c] for c in codes], dtype=float)
+            # matrix[i, j] is the value of 1 codes[i] in codes[j]
+            matrix = values[np.newaxis, :] / values[:, np.newaxis]
+            bases, targets = np.nonzero(~np.eye(len(codes), dtype=bool))
+            cross.extend(
+                RateService.serializer(
+                    base_currency=base_currency,
+                    currency=currency,
+                    date=date_obj,
+                    value=value)
+                for base_currency, currency, value in zip(
+                    codes[bases].tolist(),
+                    codes[targets].tolist(),
+                    matrix[bases, targets].tolist()))
+        return cross
+
+    @staticmethod
+    def fetch_failures_stats() -> {str: int}:
+        """
+        Hits, misses and size of the cache of failed fetches
+        """
+        return rate_fetch_failures.stats()
 
     def rate_at_date(self,
                      currency: str,
@@ -118,10 +422,79 @@ class RateManager(models.Manager):
             key=key,
             base_currency=base_currency,
             date_obj=date_obj)
-        if rate.pk:
+        # Derived rates and inverses of stored rates are not saved
+        if rate.pk or rate.value:
             return rate
         return Rate()
 
+    @staticmethod
+    def build_rate_graph(key: str = None,
+                         date_obj: date = date.today()) -> nx.Graph:
+        """
+        Build the graph of rates available at a given date
+        :param key: Key specific to a client
+        :param date_obj: Date of the rates
+        :return: Graph of currencies weighted by the kind of rate,
+        each edge holds the values of the rates between its currencies
+        """
+        rates = Rate.objects.filter(value_date=date_obj).filter(
+            models.Q(user=None) | models.Q(key=key))
+        rates_couples = rates.values(
+            'currency', 'base_currency', 'value', 'key')
+        graph = nx.Graph()
+        # Rates with a key come last to override standard rates
+        for k in sorted(rates_couples, key=lambda r: r['key'] is not None):
+            weight = 0.5 if k['base_currency'] == 'EUR' or \
+                            k['currency'] == 'EUR' else 1
+            weight *= (0.5 if k['key'] else 1)
+            if graph.has_edge(k['currency'], k['base_currency']):
+                edge = graph[k['currency']][k['base_currency']]
+                edge['weight'] = min(weight, edge['weight'])
+            else:
+                graph.add_edge(
+                    u_of_edge=k['currency'],
+                    v_of_edge=k['base_currency'], weight=weight, rates={})
+                edge = graph[k['currency']][k['base_currency']]
+            edge['rates'][(k['currency'], k['base_currency'])] = k['value']
+        return graph
+
+    @staticmethod
+    def path_rate(graph: nx.Graph, path: [str]) -> float:
+        """
+        Multiply the values of the rates along a path of the graph
+        :param graph: graph from build_rate_graph
+        :param path: List of currency codes
+        to go from currency to base currency
+        :return: conversion rate, None if a rate is missing
+        """
+        value = 1
+        for from_cur, to_cur in zip(path[:-1], path[1:]):
+            rates = graph[from_cur][to_cur]['rates']
+            if rates.get((from_cur, to_cur)):
+                value *= rates[(from_cur, to_cur)]
+            elif rates.get((to_cur, from_cur)):
+                value /= rates[(to_cur, from_cur)]
+            else:
+                return None
+        return value
+
+    @classmethod
+    def rate_graph(cls, key: str = None,
+                   date_obj: date = date.today()) -> nx.Graph:
+        """
+        Return the graph of rates for a date and a key.
+        The graph is shared by the process until a rate
+        of the same date is written, it must not be modified.
+        :param key: Key specific to a client
+        :param date_obj: Date of the rates
+        """
+        date_obj = to_date(date_obj)
+        key = str(key) if key is not None else None
+        return rate_graph_cache.get_or_build(
+            key=(date_obj, key),
+            builder=lambda: cls.build_rate_graph(
+                key=key, date_obj=date_obj))
+
     @classmethod
     def currency_shortest_path(
             cls, currency: str, base_currency: str, key: str = None,
@@ -134,22 +507,12 @@ class RateManager(models.Manager):
         :param date_obj: Date to obtain the conversion rate for
         :return List of currency codes to go from currency to base currency
         """
-        rates = Rate.objects.filter(value_date=date_obj).filter(
-            models.Q(user=None) | models.Q(key=key))
-        rates_couples = rates.values(
-            'currency', 'base_currency', 'value', 'key')
-        graph = nx.Graph()
-        for k in rates_couples:
-            weight = 0.5 if k['base_currency'] == 'EUR' or \
-                            k['currency'] == 'EUR' else 1
-            weight *= (0.5 if k['key'] else 1)
-            graph.add_edge(
-                u_of_edge=k['currency'],
-                v_of_edge=k['base_currency'], weight=weight)
+        graph = cls.rate_graph(key=key, date_obj=date_obj)
         try:
             return nx.shortest_path(
                 graph, currency, base_currency, weight='weight')
-        except nx.exception.NetworkXNoPath as exc:
+        except (nx.exception.NetworkXNoPath,
+                nx.exception.NodeNotFound) as exc:
             raise NoRateFound(
                 f"Rate {currency} to {base_currency} on "
                 f"key {key} at date {date_obj} does not exist") \
@@ -168,14 +531,43 @@ class RateManager(models.Manager):
         :param key: Key specific to a client
         :param date_obj: Date to obtain the conversion rate for
         :param rate_service: Rate service to use
-        :param use_forex: use rate service to fill the gaps
+        :param use_forex: use rate service to fill the gaps,
+        concurrent lookups of the same rate are done once
+        """
+        if use_forex:
+            return rate_lookups.do(
+                key=(rate_service or settings.RATE_SERVICE, key,
+                     base_currency, currency, to_date(date_obj)),
+                fn=lambda: self._find_rate(
+                    currency=currency,
+                    rate_service=rate_service,
+                    key=key,
+                    base_currency=base_currency,
+                    date_obj=date_obj,
+                    use_forex=True))
+        return self._find_rate(
+            currency=currency,
+            rate_service=rate_service,
+            key=key,
+            base_currency=base_currency,
+            date_obj=date_obj)
+
+    def _find_rate(self, currency: str,
+                   rate_service: str = None,
+                   key: str = None,
+                   base_currency: str = settings.BASE_CURRENCY,
+                   date_obj: date = date.today(),
+                   use_forex: bool = False) -> BaseRate:
+        """
+        Find rate, see find_rate
         """
         if use_forex:
             if not self.fetch_rates(
                     base_currency=base_currency,
                     currency=currency,
                     rate_service=rate_service,
-                    date_obj=date_obj):
+                    date_obj=date_obj,
+                    bulk=True):
                 return Rate()
         try:
             rates = self.currency_shortest_path(
@@ -185,6 +577,9 @@ class RateManager(models.Manager):
                 date_obj=date_obj
             )
         except NoRateFound:
+            if use_forex:
+                # Fetched rates do not link the currencies
+                return Rate()
             # No relation found, try fetching rate
             return self.find_rate(
                 currency=currency,
@@ -196,37 +591,220 @@ class RateManager(models.Manager):
             )
         # Direct connection between rates
         if len(rates) == 2:
-            return Rate.objects.filter(
-                currency=currency,
-                base_currency=base_currency,
+            stored = Rate(currency=currency,
+                          base_currency=base_currency).canonical()
+            rate = Rate.objects.filter(
+                currency=stored.currency,
+                base_currency=stored.base_currency,
                 value_date=date_obj
             ).filter(
                 models.Q(key=key) | models.Q(user__isnull=True)
             ).order_by('-key').first()
         else:
-            conv_value = 1
-            for i in range(len(rates) - 1):
-                from_cur, to_cur = rates[i:i + 2]
-                rate = self.find_rate(
-                        currency=from_cur,
-                        base_currency=to_cur,
-                        key=key,
-                        date_obj=date_obj,
-                        use_forex=False)
-                if rate:
-                    conv_value *= rate.value
-                else:
+            # Derived rates are cached in memory, not stored
+            date_obj = to_date(date_obj)
+            cache_key = (key, base_currency, currency, date_obj)
+            conv_value = derived_rates.value(cache_key)
+            if conv_value is None:
+                generation = derived_rates.generation
+                conv_value = self.path_rate(
+                    graph=self.rate_graph(key=key, date_obj=date_obj),
+                    path=rates)
+                if conv_value is None:
                     raise NoRateFound(
-                        f"rate {from_cur} -> {to_cur} for key {key} "
+                        f"rate {currency} -> {base_currency} for key {key} "
                         f"does not exist at date {date_obj}")
-            rate = Rate.objects.create(
+                derived_rates.add(cache_key, conv_value, rates, generation)
+            return Rate(
                 key=key,
                 value_date=date_obj,
                 currency=currency,
                 base_currency=base_currency,
-                value=conv_value
-            )
-            return rate
+                value=conv_value)
+        if rate and rate.currency != currency:
+            return rate.inverse()
+        return rate
+
+    def resolve_rates(self, currencies: [str],
+                      rate_service: str = None,
+                      key: str = None,
+                      base_currency: str = settings.BASE_CURRENCY,
+                      date_obj: date = date.today(),
+                      use_forex: bool = True) -> {str: float}:
+        """
+        Resolve the rates of many currencies to a base currency at once.
+        Rates are computed in memory from the paths of a single
+        shortest path search from the base currency.
+        :param currencies: source currency codes
+        :param rate_service: Rate service to use
+        :param key: Key specific to a client
+        :param base_currency: base currency code
+        :param date_obj: Date to obtain the conversion rates for
+        :param use_forex: fetch rates of the base currency
+        from the rate service once if some currencies are missing
+        :return: dict of rates by currency code, without missing rates
+        """
+        date_obj = to_date(date_obj)
+        currencies = set(currencies)
+        output = {}
+        if base_currency in currencies:
+            output[base_currency] = 1
+        graph = self.rate_graph(key=key, date_obj=date_obj)
+        if base_currency in graph:
+            paths = nx.single_source_dijkstra_path(
+                graph, base_currency, weight='weight')
+            for currency in currencies - output.keys():
+                if currency not in paths:
+                    continue
+                value = self.path_rate(
+                    graph=graph, path=paths[currency][::-1])
+                if value:
+                    output[currency] = value
+        if use_forex and currencies - output.keys() and self.fetch_rates(
+                base_currency=base_currency,
+                rate_service=rate_service,
+                date_obj=date_obj,
+                bulk=True):
+            output.update(self.resolve_rates(
+                currencies=currencies - output.keys(),
+                key=key,
+                base_currency=base_currency,
+                date_obj=date_obj,
+                use_forex=False))
+        return output
+
+    def _as_of_series(self, currency: str, base_currency: str,
+                      key: str = None) -> (np.ndarray, np.ndarray):
+        """
+        Sorted dates and values of the rates of a pair of currencies
+        Rates with a key override standard rates of the same date
+        :param currency: source currency code
+        :param base_currency: base currency code
+        :param key: Key specific to a client
+        """
+        def build():
+            series = {}
+            for value_date, value, rate_key in self.filter(
+                    currency=currency,
+                    base_currency=base_currency
+            ).filter(
+                models.Q(user=None) | models.Q(key=key)
+            ).order_by('value_date').values_list(
+                    'value_date', 'value', 'key'):
+                if rate_key is not None or value_date not in series:
+                    series[value_date] = value
+            return (np.array(list(series.keys()), dtype='datetime64[D]'),
+                    np.array(list(series.values()), dtype=float))
+        return rate_as_of_index.get_or_build(
+            key=(key, base_currency, currency), builder=build)
+
+    def series(self, currency: str, base_currency: str, key: str = None,
+               date_obj: date = None,
+               to_obj: date = None) -> (np.ndarray, np.ndarray):
+        """
+        Dates and values of the rates of a pair of currencies,
+        read from the history store if enabled, with a single query
+        otherwise. Rates stored in the other direction are inverted.
+        :param currency: source currency code
+        :param base_currency: base currency code
+        :param key: user defined key
+        :param date_obj: beginning of range, included
+        :param to_obj: end of range, included
+        :return: arrays of datetime64[D] dates and float64 values
+        """
+        stored = Rate(currency=currency,
+                      base_currency=base_currency).canonical()
+        store = rate_history_store()
+        if store:
+            dates, values = store.range(
+                base_currency=stored.base_currency,
+                currency=stored.currency, key=key,
+                date_obj=date_obj, to_obj=to_obj)
+        else:
+            qs = self.filter(
+                currency=stored.currency,
+                base_currency=stored.base_currency,
+                key=key)
+            if date_obj:
+                qs = qs.filter(value_date__gte=date_obj)
+            if to_obj:
+                qs = qs.filter(value_date__lte=to_obj)
+            rows = list(qs.order_by('value_date').values_list(
+                'value_date', 'value'))
+            dates = np.array([r[0] for r in rows], dtype='datetime64[D]')
+            values = np.array([r[1] for r in rows], dtype=np.float64)
+        if stored.currency != currency:
+            with np.errstate(divide='ignore'):
+                values = 1 / values
+        return dates, values
+
+    def _value_as_of(self, currency: str, base_currency: str,
+                     key: str, date_obj: date) -> (date, float):
+        """
+        Most recent value of a pair of currencies, in any direction
+        :return: tuple of date of value and value, (None, None) if missing
+        """
+        found_date, found_value = None, None
+        for from_cur, to_cur, inverse in [
+                (currency, base_currency, False),
+                (base_currency, currency, True)]:
+            dates, values = self._as_of_series(
+                currency=from_cur, base_currency=to_cur, key=key)
+            i = np.searchsorted(
+                dates, np.datetime64(date_obj, 'D'), side='right') - 1
+            if i < 0 or not values[i]:
+                continue
+            value_date = dates[i].astype(date)
+            if found_date is None or value_date > found_date:
+                found_date = value_date
+                found_value = 1 / values[i] if inverse else values[i]
+        return found_date, found_value
+
+    def rate_as_of(self, currency: str,
+                   key: str = None,
+                   base_currency: str = settings.BASE_CURRENCY,
+                   date_obj: date = date.today(),
+                   max_staleness: int = None) -> BaseRate:
+        """
+        Find the last known rate on or before a date
+        Looks up the rates between the currencies, then
+        through BASE_CURRENCY, with a binary search in sorted
+        series kept in memory, without fetching missing rates.
+        :param currency: source currency code
+        :param key: Key specific to a client
+        :param base_currency: base currency code
+        :param date_obj: Date to obtain the conversion rate for
+        :param max_staleness: maximum age of the rate in days
+        :return: Unsaved Rate with the date of the value used,
+        Rate without value if no rate is found
+        """
+        date_obj = to_date(date_obj)
+        key = str(key) if key is not None else None
+        if max_staleness is None:
+            max_staleness = getattr(settings, 'RATE_AS_OF_MAX_STALENESS',
+                                    RATE_AS_OF_MAX_STALENESS)
+        value_date, value = self._value_as_of(
+            currency=currency, base_currency=base_currency,
+            key=key, date_obj=date_obj)
+        pivot = settings.BASE_CURRENCY
+        if value is None and pivot not in [currency, base_currency]:
+            from_date, from_value = self._value_as_of(
+                currency=currency, base_currency=pivot,
+                key=key, date_obj=date_obj)
+            to_date_obj, to_value = self._value_as_of(
+                currency=pivot, base_currency=base_currency,
+                key=key, date_obj=date_obj)
+            if from_value is not None and to_value is not None:
+                value_date = min(from_date, to_date_obj)
+                value = from_value * to_value
+        if value is None or (date_obj - value_date).days > max_staleness:
+            return Rate()
+        return Rate(
+            key=key,
+            currency=currency,
+            base_currency=base_currency,
+            value_date=value_date,
+            value=float(value))
 
 
 class Rate(BaseRate):
@@ -246,6 +824,8 @@ class Rate(BaseRate):
                                      max_length=3, db_index=True,
                                      default='EUR')
     objects = RateManager()
+    # Value of the rate in the database, None if not known
+    stored_value = None
 
     class Meta:
         """
@@ -261,13 +841,25 @@ class Rate(BaseRate):
         ]
         unique_together = [['key', 'currency', 'base_currency', 'value_date']]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Rate loaded from the database, with its stored value
+        so that rollups are updated without reading its period again
+        """
+        instance = super(Rate, cls).from_db(db, field_names, values)
+        instance.stored_value = dict(zip(field_names, values)).get('value')
+        return instance
+
     @classmethod
     def convert(cls, currency: str,
                 user: User = None,
                 key: str = None,
                 base_currency: str = 'EUR',
                 date_obj: date = date.today(),
-                amount: float = 0) -> ConverterResult:
+                amount: float = 0,
+                as_of: bool = False,
+                max_staleness: int = None) -> ConverterResult:
         """
         Convert rate
         :param user: Django User
@@ -276,25 +868,54 @@ class Rate(BaseRate):
         :param currency: source currency
         :param date_obj: date of the rate
         :param amount: amount to convert
+        :param as_of: use the last known rate if no rate exists at date
+        :param max_staleness: maximum age in days of an "as of" rate
         """
         converter = RateConverter(user=user, key=key,
-                                  base_currency=base_currency)
+                                  base_currency=base_currency,
+                                  as_of=as_of,
+                                  max_staleness=max_staleness)
         converter.add_data(
-            {
+            [{
                 'currency': currency,
                 'amount': amount,
-                'date': date_obj
-            }
+                'date_obj': date_obj
+            }]
         )
         result = converter.convert()
         return result
 
+    def inverse(self) -> BaseRate:
+        """
+        Unsaved rate of the other direction
+        """
+        return Rate(
+            user_id=self.user_id,
+            key=self.key,
+            value_date=self.value_date,
+            currency=self.base_currency,
+            base_currency=self.currency,
+            value=1 / self.value if self.value else 0)
+
+    def canonical(self) -> BaseRate:
+        """
+        Rate in the direction it is stored, the rate itself
+        or its unsaved inverse with RATE_CANONICAL_STORAGE
+        """
+        if not Rate.objects.canonical_storage() or Rate.objects.is_canonical(
+                currency=self.currency, base_currency=self.base_currency):
+            return self
+        return self.inverse()
+
 
 @receiver(post_save, sender=Rate)
 def create_reverse_rate(sender, instance, created, **kwargs):
     """
-    Create the rate object to revert rate when create a rate
+    Create the rate object to revert rate when create a rate,
+    unless rates are stored in a single direction
     """
+    if Rate.objects.canonical_storage():
+        return
     if created and not Rate.objects.filter(
             user=instance.user,
             key=instance.key,
@@ -312,6 +933,972 @@ def create_reverse_rate(sender, instance, created, **kwargs):
         )
 
 
+def evict_rate_caches(events: [tuple] = None):
+    """
+    Drop in-process caches and derived rates depending on changed rates
+    :param events: list of (date, key, currency, base currency) tuples,
+    None to drop every cache
+    """
+    if events is None:
+        for cache in (rate_graph_cache, converter_rates, rate_as_of_index,
+                      derived_rates):
+            cache.clear()
+        return
+    for date_obj in {event[0] for event in events}:
+        rate_graph_cache.invalidate(date_obj)
+        converter_rates.invalidate(date_obj)
+    for currency, base_currency in {event[2:] for event in events}:
+        rate_as_of_index.invalidate(
+            currency=currency, base_currency=base_currency)
+    for date_obj, _key, currency, base_currency in events:
+        derived_rates.invalidate(
+            currency=currency, base_currency=base_currency,
+            date_obj=date_obj)
+
+
+rate_invalidation_bus.subscribe(evict_rate_caches)
+
+
+def rates_changed(rates: [BaseRate]):
+    """
+    Invalidate caches of every process, results of queries
+    and rate matrices depending on written rates
+    :param rates: rates created, updated or deleted
+    """
+    events = [(to_date(rate.value_date), rate.key, rate.currency,
+               rate.base_currency) for rate in rates]
+    rate_invalidation_bus.publish(events)
+    rate_results.changed(events)
+    matrix_dates = {to_date(rate.value_date) for rate in rates
+                    if rate.key is None}
+    if matrix_dates:
+        RateMatrix.objects.filter(value_date__in=matrix_dates).delete()
+
+
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+def invalidate_rate_caches(sender, instance, **kwargs):
+    """
+    Drop in-process caches depending on a modified rate
+    """
+    rates_changed([instance])
+
+
+def history_changed(rates: [BaseRate], deleted: bool = False):
+    """
+    Write rates to the history store, if enabled,
+    once the transaction is committed
+    :param rates: rates created, updated or deleted
+    :param deleted: rates were deleted
+    """
+    store = rate_history_store()
+    if not store or not rates:
+        return
+    store.changed(rates, deleted=deleted)
+
+
+@receiver(post_save, sender=Rate)
+def update_rate_history(sender, instance, **kwargs):
+    """
+    Write a saved rate to the history store
+    """
+    history_changed([instance])
+
+
+@receiver(post_delete, sender=Rate)
+def remove_rate_history(sender, instance, **kwargs):
+    """
+    Remove a deleted rate from the history store
+    """
+    history_changed([instance], deleted=True)
+
+
+def rollups_changed(rates: [BaseRate], inserted: bool = False,
+                    deleted: bool = False):
+    """
+    Update the rollups of written rates
+    Inserted rates are added to their rollups, values of updated
+    or deleted rates are replaced in their rollups
+    :param rates: rates created, updated or deleted
+    :param inserted: rates were inserted
+    :param deleted: rates were deleted
+    """
+    rates = list(rates)
+    if inserted:
+        RateRollup.objects.add(rates)
+    else:
+        RateRollup.objects.refresh(rates, deleted=deleted)
+    for rate in rates:
+        rate.stored_value = None if deleted else rate.value
+
+
+@receiver(post_save, sender=Rate)
+def update_rate_rollups(sender, instance, created, **kwargs):
+    """
+    Update the rollups of a saved rate
+    """
+    rollups_changed([instance], inserted=created)
+
+
+@receiver(post_delete, sender=Rate)
+def remove_rate_rollups(sender, instance, **kwargs):
+    """
+    Update the rollups of a deleted rate
+    """
+    rollups_changed([instance], deleted=True)
+
+
+@receiver(post_save, sender=Rate)
+def update_latest_rate(sender, instance, created, **kwargs):
+    """
+    Update the latest rate of the series of a saved rate
+    """
+    if created:
+        LatestRate.objects.add([instance])
+    else:
+        LatestRate.objects.refresh([instance])
+
+
+@receiver(post_delete, sender=Rate)
+def remove_latest_rate(sender, instance, **kwargs):
+    """
+    Look up again the latest rate of the series of a deleted rate
+    """
+    LatestRate.objects.refresh([instance])
+
+
+class RateMatrixManager(models.Manager):
+    """
+    Manager for RateMatrix model
+    """
+
+    def materialize(self, date_obj: date,
+                    pivot: str = settings.BASE_CURRENCY):
+        """
+        Compute and store the rates between every pair of currencies
+        of the rates without key at a date. Rates are resolved
+        to the pivot currency with a single shortest path search,
+        cross rates are divided in one pass.
+        Currencies not linked to the pivot currency have no rates.
+        :param date_obj: date of the rates
+        :param pivot: currency the rates are resolved to
+        :return: RateMatrix, None if there are no rates at this date
+        """
+        date_obj = to_date(date_obj)
+        graph = Rate.objects.rate_graph(key=None, date_obj=date_obj)
+        if not graph.number_of_nodes():
+            return None
+        currencies = sorted(graph.nodes)
+        if pivot not in graph:
+            pivot = max(graph.degree, key=lambda node: node[1])[0]
+        resolved = Rate.objects.resolve_rates(
+            currencies=currencies,
+            base_currency=pivot,
+            date_obj=date_obj,
+            use_forex=False)
+        quotes = np.array([resolved.get(c, np.nan) for c in currencies],
+                          dtype=np.float64)
+        # matrix[i, j] is the value of 1 currencies[i] in currencies[j]
+        matrix = quotes[np.newaxis, :] / quotes[:, np.newaxis]
+        rate_matrix, created = self.update_or_create(
+            value_date=date_obj,
+            defaults={
+                'currencies': currencies,
+                'values': matrix.tobytes(),
+            })
+        return rate_matrix
+
+    def at_date(self, date_obj: date):
+        """
+        Rate matrix of a date, materialized if missing
+        :param date_obj: date of the rates
+        :return: RateMatrix, None if there are no rates at this date
+        """
+        return self.filter(value_date=to_date(date_obj)).first() or \
+            self.materialize(date_obj=date_obj)
+
+
+class RateMatrix(models.Model):
+    """
+    Rates without key between every pair of currencies at a date,
+    stored as a matrix of float64 values.
+    Matrices are deleted when rates of their date change.
+    """
+    value_date = models.DateField("Date of value", unique=True)
+    currencies = models.JSONField("Currencies of rows and columns")
+    values = models.BinaryField("Values of the rates")
+    updated = models.DateTimeField("Date of computation", auto_now=True)
+    objects = RateMatrixManager()
+
+    def matrix(self) -> np.ndarray:
+        """
+        Matrix of rates, the value of 1 currencies[i]
+        in currencies[j] being matrix[i, j], NaN if unknown
+        """
+        size = len(self.currencies)
+        return np.frombuffer(
+            bytes(self.values), dtype=np.float64).reshape(size, size)
+
+    def row(self, base_currency: str) -> {str: float}:
+        """
+        Rates of every currency in a base currency
+        :param base_currency: base currency code
+        :return: dict of known rates by currency code
+        """
+        try:
+            index = self.currencies.index(base_currency)
+        except ValueError:
+            return {}
+        values = self.matrix()[index]
+        return {currency: value
+                for currency, value in zip(self.currencies, values.tolist())
+                if currency != base_currency and not np.isnan(value)}
+
+
+class RateRollupManager(models.Manager):
+    """
+    Manager for RateRollup model
+    """
+    periods = ('week', 'month', 'year')
+
+    @staticmethod
+    def buckets(dates: np.ndarray, period: str) -> (np.ndarray, np.ndarray):
+        """
+        Periods of dates, weeks being ISO weeks of the calendar year
+        :param dates: array of dates
+        :param period: 'week', 'month' or 'year'
+        :return: arrays of years and of week or month numbers,
+        0 for years
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        years = dates.astype('datetime64[Y]')
+        if period == 'month':
+            numbers = (dates.astype('datetime64[M]') -
+                       years.astype('datetime64[M]')).astype(np.int64) + 1
+        elif period == 'week':
+            # ISO weeks are numbered after their thursday,
+            # 1970-01-01 being a thursday
+            weekdays = (dates.astype(np.int64) + 3) % 7
+            thursdays = dates + (3 - weekdays).astype('timedelta64[D]')
+            starts = thursdays.astype('datetime64[Y]').astype('datetime64[D]')
+            numbers = (thursdays - starts).astype(np.int64) // 7 + 1
+        else:
+            numbers = np.zeros(len(dates), dtype=np.int64)
+        return years.astype(np.int64) + 1970, numbers
+
+    @staticmethod
+    def aggregate(labels: [np.ndarray], values: np.ndarray) -> {tuple: []}:
+        """
+        Count, sum, sum of squares, min and max of values by labels
+        :param labels: arrays of labels of the values
+        :param values: array of values
+        :return: dict of [count, sum, sumsq, min, max] by tuple of labels
+        """
+        values = np.asarray(values, dtype=np.float64)
+        groups = {}
+        inverse = np.fromiter(
+            (groups.setdefault(group, len(groups))
+             for group in zip(*[np.asarray(label).tolist()
+                                for label in labels])),
+            dtype=np.int64, count=len(values))
+        size = len(groups)
+        counts = np.bincount(inverse, minlength=size)
+        sums = np.bincount(inverse, weights=values, minlength=size)
+        sumsqs = np.bincount(inverse, weights=values * values,
+                             minlength=size)
+        mins = np.full(size, np.inf)
+        np.minimum.at(mins, inverse, values)
+        maxs = np.full(size, -np.inf)
+        np.maximum.at(maxs, inverse, values)
+        return {
+            group: [int(counts[i]), float(sums[i]), float(sumsqs[i]),
+                    float(mins[i]), float(maxs[i])]
+            for group, i in groups.items()
+        }
+
+    @staticmethod
+    def merge(aggregates: {tuple: []}, other: {tuple: []}) -> {tuple: []}:
+        """
+        Merge aggregates of the same labels
+        :param aggregates: dict of [count, sum, sumsq, min, max], updated
+        :param other: dict of [count, sum, sumsq, min, max]
+        """
+        for group, (count, total, sumsq, minimum, maximum) in other.items():
+            if group in aggregates:
+                current = aggregates[group]
+                current[0] += count
+                current[1] += total
+                current[2] += sumsq
+                current[3] = min(current[3], minimum)
+                current[4] = max(current[4], maximum)
+            else:
+                aggregates[group] = [count, total, sumsq, minimum, maximum]
+        return aggregates
+
+    def _aggregates(self, rows) -> {tuple: []}:
+        """
+        Aggregates of rates by series and period
+        :param rows: tuples of user id, key, base currency, currency,
+        value date and value
+        :return: dict of [count, sum, sumsq, min, max] by tuple of
+        user id, key, base currency, currency, period, year and number
+        """
+        rows = list(rows)
+        if not rows:
+            return {}
+        users, keys, base_currencies, currencies, dates, values = \
+            zip(*rows)
+        aggregates = {}
+        for period in self.periods:
+            years, numbers = self.buckets(dates, period)
+            self.merge(aggregates, self.aggregate(
+                [users, keys, base_currencies, currencies,
+                 [period] * len(rows), years, numbers], values))
+        return aggregates
+
+    @staticmethod
+    def _rows(rates: [BaseRate]) -> []:
+        """
+        Rows of rates for aggregation
+        :param rates: Rate objects
+        """
+        return [(rate.user_id, rate.key, rate.base_currency, rate.currency,
+                 to_date(rate.value_date), rate.value) for rate in rates]
+
+    def _matching(self, groups) -> {tuple: []}:
+        """
+        Rollups of groups by group
+        :param groups: tuples of user id, key, base currency, currency,
+        period, year and number
+        :return: dict of lists of RateRollup by group
+        """
+        groups = set(groups)
+        users, keys, base_currencies, currencies, periods, years, _ = \
+            zip(*groups)
+        rollups = {}
+        for rollup in self.filter(
+                base_currency__in=set(base_currencies),
+                currency__in=set(currencies),
+                period__in=set(periods),
+                year__in=set(years)):
+            if rollup.group in groups:
+                rollups.setdefault(rollup.group, []).append(rollup)
+        return rollups
+
+    def add(self, rates: [BaseRate]):
+        """
+        Add inserted rates to their rollups
+        :param rates: Rate objects inserted
+        """
+        aggregates = self._aggregates(self._rows(rates))
+        if not aggregates:
+            return
+        with transaction.atomic():
+            existing = self._matching(aggregates)
+            to_create, to_update = [], []
+            for group, values in aggregates.items():
+                if group in existing:
+                    rollup = existing[group][0]
+                    rollup.merge(values)
+                    to_update.append(rollup)
+                else:
+                    to_create.append(self.model.from_aggregate(group, values))
+            self.bulk_create(to_create)
+            self.bulk_update(
+                to_update, fields=['count', 'sum', 'sumsq', 'min', 'max'])
+
+    def refresh(self, rates: [BaseRate], deleted: bool = False):
+        """
+        Replace the values of updated or deleted rates in their rollups
+        Rollups are computed again from the rates of their periods
+        only when a previous value is not known, or was their min or max,
+        as it can not be taken out of them
+        :param rates: Rate objects updated or deleted, with the value
+        previously stored as stored_value, if known
+        :param deleted: rates were deleted
+        """
+        removed, added, stale = self._changes(rates, deleted=deleted)
+        groups = set(removed) | set(added) | stale
+        if not groups:
+            return
+        with transaction.atomic():
+            existing = self._matching(groups)
+            to_create, to_update = [], []
+            for group in groups - stale:
+                rollup = existing.get(group, [None])[0]
+                if group in removed and not (
+                        rollup and rollup.count > removed[group][0] and
+                        rollup.min < removed[group][3] and
+                        rollup.max > removed[group][4]):
+                    stale.add(group)
+                    continue
+                if rollup is None:
+                    to_create.append(
+                        self.model.from_aggregate(group, added[group]))
+                    continue
+                if group in removed:
+                    rollup.remove(removed[group])
+                if group in added:
+                    rollup.merge(added[group])
+                to_update.append(rollup)
+            self.bulk_create(to_create)
+            self.bulk_update(
+                to_update, fields=['count', 'sum', 'sumsq', 'min', 'max'])
+            self._recompute(stale, existing)
+
+    def _changes(self, rates: [BaseRate],
+                 deleted: bool = False) -> ({tuple: []}, {tuple: []}, set):
+        """
+        Aggregates of previous and new values of updated or deleted rates
+        :param rates: Rate objects updated or deleted
+        :param deleted: rates were deleted
+        :return: aggregates of removed values, aggregates of added values,
+        groups of rates whose previous value is not known
+        """
+        removed, added, unknown = [], [], []
+        for row, rate in zip(self._rows(rates), rates):
+            previous = rate.stored_value
+            if deleted:
+                removed.append(
+                    row[:5] + (row[5] if previous is None else previous,))
+            elif previous is None:
+                unknown.append(row)
+            elif previous != rate.value:
+                removed.append(row[:5] + (previous,))
+                added.append(row)
+        return self._aggregates(removed), self._aggregates(added), \
+            set(self._aggregates(unknown))
+
+    def _recompute(self, groups: {tuple}, existing: {tuple: []},
+                   chunk_size: int = 100):
+        """
+        Compute again rollups from the rates of their periods
+        :param groups: tuples of user id, key, base currency, currency,
+        period, year and number
+        :param existing: dict of lists of RateRollup by group
+        :param chunk_size: number of groups read per query
+        """
+        groups = sorted(groups, key=repr)
+        aggregates = {}
+        for i in range(0, len(groups), chunk_size):
+            chunk = groups[i:i + chunk_size]
+            rates_filter = models.Q()
+            for group in chunk:
+                rates_filter |= self._group_filter(group)
+            chunk_aggregates = self._aggregates(
+                Rate.objects.filter(rates_filter).order_by().values_list(
+                    'user', 'key', 'base_currency', 'currency',
+                    'value_date', 'value'))
+            aggregates.update({group: chunk_aggregates[group]
+                               for group in chunk
+                               if group in chunk_aggregates})
+        self.filter(pk__in=[
+            rollup.pk
+            for group in groups
+            for rollup in existing.get(group, [])]).delete()
+        self.bulk_create([
+            self.model.from_aggregate(group, values)
+            for group, values in aggregates.items()])
+
+    def _group_filter(self, group: tuple) -> models.Q:
+        """
+        Filter of the rates of a rollup
+        :param group: tuple of user id, key, base currency, currency,
+        period, year and number
+        """
+        user_id, key, base_currency, currency, period, year, number = group
+        dates_filter = models.Q()
+        for start, end in self._period_ranges(period, year, number):
+            dates_filter |= models.Q(value_date__range=(start, end))
+        return models.Q(dates_filter, user=user_id, key=key,
+                        base_currency=base_currency, currency=currency)
+
+    def _period_ranges(self, period: str, year: int,
+                       number: int) -> [(date, date)]:
+        """
+        Ranges of dates of a period, the last and first days of a year
+        can be in the same week
+        :param period: 'week', 'month' or 'year'
+        :param year: year of the period
+        :param number: week or month number, 0 for years
+        """
+        days = np.arange(np.datetime64(f'{year:04d}-01-01'),
+                         np.datetime64(f'{year + 1:04d}-01-01'))
+        _, numbers = self.buckets(days, period)
+        return self._date_ranges(days[numbers == number].tolist())
+
+    def rebuild(self, queryset: models.QuerySet,
+                chunk_size: int = 100000) -> int:
+        """
+        Replace rollups with the aggregates of the rates of a queryset
+        :param queryset: Rate queryset
+        :param chunk_size: number of rates aggregated at once
+        :return: number of rollups written
+        """
+        aggregates = {}
+        rows = queryset.order_by().values_list(
+            'user', 'key', 'base_currency', 'currency',
+            'value_date', 'value').iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            self.merge(aggregates, self._aggregates(chunk))
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                self.model.from_aggregate(group, values)
+                for group, values in aggregates.items()
+            ], batch_size=chunk_size)
+        return len(aggregates)
+
+    def _year_buckets(self, year: int, period: str, from_obj: date,
+                      to_obj: date) -> ([int], [date]):
+        """
+        Periods of a year entirely covered by a range of dates,
+        and days of the range in periods partially covered
+        :param year: year of the periods
+        :param period: 'week', 'month' or 'year'
+        :param from_obj: beginning of range, included, None if open
+        :param to_obj: end of range, included, None if open
+        :return: numbers of covered periods, days of partial periods
+        """
+        days = np.arange(np.datetime64(f'{year:04d}-01-01'),
+                         np.datetime64(f'{year + 1:04d}-01-01'))
+        in_range = np.ones(len(days), dtype=bool)
+        if from_obj:
+            in_range &= days >= np.datetime64(from_obj, 'D')
+        if to_obj:
+            in_range &= days <= np.datetime64(to_obj, 'D')
+        _, numbers = self.buckets(days, period)
+        full, partial_dates = [], []
+        for number in np.unique(numbers).tolist():
+            inside = in_range[numbers == number]
+            if inside.all():
+                full.append(number)
+            elif inside.any():
+                partial_dates.extend(
+                    days[(numbers == number) & in_range].tolist())
+        return full, partial_dates
+
+    @staticmethod
+    def _date_ranges(dates: [date]) -> [(date, date)]:
+        """
+        Group dates in ranges of consecutive days
+        :param dates: dates
+        :return: sorted list of (beginning, end) of ranges
+        """
+        ranges = []
+        for day in sorted(dates):
+            if ranges and (day - ranges[-1][1]).days == 1:
+                ranges[-1][1] = day
+            else:
+                ranges.append([day, day])
+        return [tuple(r) for r in ranges]
+
+    def _bucket_ranges(self, period: str, from_obj: date,
+                       to_obj: date) -> (models.Q, [(date, date)]):
+        """
+        Periods of a range of dates entirely covered by the range,
+        and ranges of dates of the periods partially covered.
+        Only periods of the first and last years can be partial.
+        :param period: 'week', 'month' or 'year'
+        :param from_obj: beginning of range, included, None if open
+        :param to_obj: end of range, included, None if open
+        :return: filter of rollups of covered periods,
+        list of date ranges of partially covered periods
+        """
+        covered = models.Q()
+        if from_obj:
+            covered &= models.Q(year__gt=from_obj.year)
+        if to_obj:
+            covered &= models.Q(year__lt=to_obj.year)
+        partial_dates = []
+        for year in sorted({d.year for d in (from_obj, to_obj) if d}):
+            full, dates = self._year_buckets(year, period, from_obj, to_obj)
+            covered |= models.Q(year=year, number__in=full)
+            partial_dates.extend(dates)
+        return covered, self._date_ranges(partial_dates)
+
+    def rate_statistics(self, rates: models.QuerySet, period: str,
+                        currency: str = None,
+                        base_currency: str = None) -> {tuple: []}:
+        """
+        Aggregates of rates by currencies and period
+        :param rates: Rate queryset
+        :param period: 'week', 'month' or 'year'
+        :param currency: rates with this currency as base currency
+        are inverted
+        :param base_currency: rates with this base currency as currency
+        are inverted
+        :return: dict of [count, sum, sumsq, min, max] by tuple of
+        currency, base currency, year and number
+        """
+        rows = [
+            (base, cur, value_date, 1 / value if value else 0)
+            if (currency and base == currency and cur != currency) or
+            (base_currency and cur == base_currency and
+             base != base_currency)
+            else (cur, base, value_date, value)
+            for cur, base, value_date, value in rates.order_by().values_list(
+                'currency', 'base_currency', 'value_date', 'value')
+        ]
+        if not rows:
+            return {}
+        currencies, base_currencies, dates, values = zip(*rows)
+        years, numbers = self.buckets(dates, period)
+        return self.aggregate(
+            [currencies, base_currencies, years, numbers], values)
+
+    def statistics(self, rollups: models.QuerySet, rates: models.QuerySet,
+                   period: str, from_obj: date = None,
+                   to_obj: date = None) -> {tuple: []}:
+        """
+        Aggregates of rates by currencies and period
+        Periods covered by the range of dates are read from rollups,
+        rates of periods partially covered are aggregated.
+        :param rollups: RateRollup queryset, filtered like rates
+        except on dates
+        :param rates: Rate queryset, filtered on the range of dates
+        :param period: 'week', 'month' or 'year'
+        :param from_obj: beginning of range, included
+        :param to_obj: end of range, included
+        :return: dict of [count, sum, sumsq, min, max] by tuple of
+        currency, base currency, year and number
+        """
+        covered, partial_ranges = self._bucket_ranges(
+            period, from_obj, to_obj)
+        aggregates = {}
+        for rollup in rollups.filter(covered, period=period):
+            self.merge(aggregates, {
+                (rollup.currency, rollup.base_currency,
+                 rollup.year, rollup.number): rollup.values})
+        if partial_ranges:
+            dates_filter = models.Q()
+            for start, end in partial_ranges:
+                dates_filter |= models.Q(value_date__range=(start, end))
+            self.merge(aggregates, self.rate_statistics(
+                rates.filter(dates_filter), period))
+        return aggregates
+
+
+class RateRollup(models.Model):
+    """
+    Count, sum, sum of squares, min and max of the rates of a series
+    over a week, a month or a year, so that statistics of rates
+    are computed by merging a few rollups
+    Rollups are updated when rates are written
+    """
+    PERIODS = (
+        ('week', _('Week')),
+        ('month', _('Month')),
+        ('year', _('Year')),
+    )
+    user = models.ForeignKey(User, related_name='rate_rollups',
+                             on_delete=models.CASCADE, null=True)
+    key = models.CharField("User defined categorization key",
+                           max_length=255, default=None, null=True)
+    base_currency = models.CharField("Currency to convert to",
+                                     max_length=3)
+    currency = models.CharField("Currency to convert from", max_length=3)
+    period = models.CharField("Period", max_length=5, choices=PERIODS)
+    year = models.IntegerField("Year")
+    number = models.IntegerField("Week or month in the year, 0 for years")
+    count = models.IntegerField("Number of rates", default=0)
+    sum = models.FloatField("Sum of values", default=0)
+    sumsq = models.FloatField("Sum of squares of values", default=0)
+    min = models.FloatField("Minimum value", null=True)
+    max = models.FloatField("Maximum value", null=True)
+    objects = RateRollupManager()
+
+    class Meta:
+        """
+        Meta
+        """
+        indexes = [
+            models.Index(fields=['base_currency', 'currency',
+                                 'period', 'year', 'number']),
+        ]
+
+    @classmethod
+    def from_aggregate(cls, group: tuple, values: []):
+        """
+        Unsaved rollup of an aggregate
+        :param group: tuple of user id, key, base currency, currency,
+        period, year and number
+        :param values: list of count, sum, sumsq, min and max
+        """
+        user_id, key, base_currency, currency, period, year, number = group
+        rollup = cls(user_id=user_id, key=key, base_currency=base_currency,
+                     currency=currency, period=period, year=year,
+                     number=number)
+        rollup.count, rollup.sum, rollup.sumsq, rollup.min, rollup.max = \
+            values
+        return rollup
+
+    @property
+    def group(self) -> tuple:
+        """
+        Series and period of the rollup
+        """
+        return (self.user_id, self.key, self.base_currency, self.currency,
+                self.period, self.year, self.number)
+
+    @property
+    def values(self) -> []:
+        """
+        Count, sum, sum of squares, min and max
+        """
+        return [self.count, self.sum, self.sumsq, self.min, self.max]
+
+    def merge(self, values: []):
+        """
+        Add aggregated values to the rollup
+        :param values: list of count, sum, sumsq, min and max
+        """
+        count, total, sumsq, minimum, maximum = values
+        self.count += count
+        self.sum += total
+        self.sumsq += sumsq
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def remove(self, values: []):
+        """
+        Take aggregated values out of the rollup,
+        they must not include its min or max
+        :param values: list of count, sum, sumsq, min and max
+        """
+        count, total, sumsq, _, _ = values
+        self.count -= count
+        self.sum -= total
+        self.sumsq -= sumsq
+
+    @staticmethod
+    def statistics(values: []) -> {str: float}:
+        """
+        Average, min, max and standard deviation of aggregated values
+        :param values: list of count, sum, sumsq, min and max
+        """
+        count, total, sumsq, minimum, maximum = values
+        avg = total / count
+        return {
+            'avg': avg,
+            'max': maximum,
+            'min': minimum,
+            'std_dev': float(np.sqrt(max(sumsq / count - avg * avg, 0))),
+        }
+
+
+class LatestRateManager(models.Manager):
+    """
+    Manager for LatestRate model
+    """
+
+    def _matching(self, series) -> {tuple: models.Model}:
+        """
+        Latest rates of series by series
+        :param series: tuples of key, base currency and currency
+        """
+        series = set(series)
+        _, base_currencies, currencies = zip(*series)
+        return {
+            latest.series: latest for latest in self.filter(
+                base_currency__in=set(base_currencies),
+                currency__in=set(currencies))
+            if latest.series in series
+        }
+
+    def add(self, rates: [BaseRate]):
+        """
+        Replace latest rates with written rates of the same date or newer
+        :param rates: Rate objects inserted or updated
+        """
+        newest = {}
+        for rate in rates:
+            series = (rate.key, rate.base_currency, rate.currency)
+            if series not in newest or to_date(rate.value_date) >= \
+                    to_date(newest[series].value_date):
+                newest[series] = rate
+        if not newest:
+            return
+        with transaction.atomic():
+            existing = self._matching(newest)
+            winners = {
+                series: rate for series, rate in newest.items()
+                if series not in existing or
+                to_date(rate.value_date) >= existing[series].value_date
+            }
+            # Rates inserted in bulk have no primary key
+            ids = {}
+            if any(not rate.pk for rate in winners.values()):
+                for pk, key, base_currency, currency, value_date in \
+                        Rate.objects.filter(
+                            base_currency__in={
+                                r.base_currency for r in winners.values()},
+                            currency__in={
+                                r.currency for r in winners.values()},
+                            value_date__in={
+                                to_date(r.value_date)
+                                for r in winners.values()},
+                        ).order_by().values_list(
+                            'pk', 'key', 'base_currency', 'currency',
+                            'value_date'):
+                    ids[(key, base_currency, currency, value_date)] = pk
+            to_create, to_update = [], []
+            for series, rate in winners.items():
+                rate_id = rate.pk or ids.get(
+                    series + (to_date(rate.value_date),))
+                if rate_id is None:
+                    continue
+                latest = existing.get(series) or self.model(
+                    key=rate.key,
+                    base_currency=rate.base_currency,
+                    currency=rate.currency)
+                latest.rate_id = rate_id
+                latest.user_id = rate.user_id
+                latest.value_date = to_date(rate.value_date)
+                latest.value = rate.value
+                if latest.pk:
+                    to_update.append(latest)
+                else:
+                    to_create.append(latest)
+            self.bulk_create(to_create)
+            self.bulk_update(
+                to_update, fields=['rate', 'user', 'value_date', 'value'])
+
+    def refresh(self, rates: [BaseRate]):
+        """
+        Look up again the latest rates of the series of rates,
+        when rates are deleted or their date changed
+        :param rates: Rate objects saved or deleted
+        """
+        series = {(rate.key, rate.base_currency, rate.currency)
+                  for rate in rates}
+        if not series:
+            return
+        with transaction.atomic():
+            existing = self._matching(series)
+            for key, base_currency, currency in series:
+                rate = Rate.objects.filter(
+                    key=key, base_currency=base_currency, currency=currency
+                ).order_by('-value_date').first()
+                latest = existing.get((key, base_currency, currency))
+                if rate is None:
+                    if latest:
+                        latest.delete()
+                    continue
+                if latest is None:
+                    latest = self.model(
+                        key=key,
+                        base_currency=base_currency,
+                        currency=currency)
+                latest.rate = rate
+                latest.user_id = rate.user_id
+                latest.value_date = rate.value_date
+                latest.value = rate.value
+                latest.save()
+
+    def rebuild(self, queryset: models.QuerySet) -> int:
+        """
+        Replace latest rates with the latest rates of a queryset
+        :param queryset: Rate queryset
+        :return: number of latest rates written
+        """
+        latest_rates = []
+        current = None
+        with transaction.atomic():
+            self.all().delete()
+            for pk, user_id, key, base_currency, currency, value_date, \
+                    value in queryset.order_by(
+                        'key', 'base_currency', 'currency', '-value_date'
+                    ).values_list(
+                        'pk', 'user', 'key', 'base_currency', 'currency',
+                        'value_date', 'value').iterator():
+                if (key, base_currency, currency) == current:
+                    continue
+                current = (key, base_currency, currency)
+                latest_rates.append(self.model(
+                    rate_id=pk, user_id=user_id, key=key,
+                    base_currency=base_currency, currency=currency,
+                    value_date=value_date, value=value))
+            self.bulk_create(latest_rates, batch_size=1000)
+        return len(latest_rates)
+
+
+class LatestRate(models.Model):
+    """
+    Latest rate of each series of rates, a series being
+    the rates of a key and a pair of currencies,
+    so that current rates are read without scanning history
+    Latest rates are updated when rates are written
+    """
+    rate = models.OneToOneField(Rate, related_name='latest',
+                                on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='latest_rates',
+                             on_delete=models.CASCADE, null=True)
+    key = models.CharField("User defined categorization key",
+                           max_length=255, default=None, null=True)
+    base_currency = models.CharField("Currency to convert to",
+                                     max_length=3, db_index=True)
+    currency = models.CharField("Currency to convert from",
+                                max_length=3, db_index=True)
+    value_date = models.DateField("Date of value")
+    value = models.FloatField("Rate conversion factor")
+    objects = LatestRateManager()
+
+    @property
+    def series(self) -> tuple:
+        """
+        Key and currencies of the rate
+        """
+        return self.key, self.base_currency, self.currency
+
+
+class RateFetchManager(models.Manager):
+    """
+    Manager for RateFetch model
+    """
+
+    def record(self, rates: [], base_currency: str = None):
+        """
+        Record base currencies and dates of rates from a rate service
+        :param rates: array of dict of rates from service
+        :param base_currency: base currency of rates without one
+        """
+        fetched = {
+            (rate.get('base_currency') or base_currency,
+             to_date(rate.get('date')))
+            for rate in rates if rate.get('value') is not None}
+        if not fetched:
+            return
+        existing = set(self.filter(
+            base_currency__in={f[0] for f in fetched},
+            value_date__in={f[1] for f in fetched}
+        ).values_list('base_currency', 'value_date'))
+        self.bulk_create([
+            self.model(base_currency=base_currency, value_date=value_date)
+            for base_currency, value_date in sorted(fetched - existing)])
+
+
+class RateFetch(models.Model):
+    """
+    Base currency and date whose rates were fetched from a rate service,
+    to tell them from inverse rates written by fetches
+    of other base currencies
+    """
+    base_currency = models.CharField("Base currency of fetched rates",
+                                     max_length=3)
+    value_date = models.DateField("Date of value")
+    objects = RateFetchManager()
+
+    class Meta:
+        """
+        Meta
+        """
+        unique_together = ('base_currency', 'value_date')
+
+
 class Amount:
     """
     Amount with a currency, a value and a date
@@ -344,8 +1931,12 @@ class RateConversionPayload:
     key = ''
     batch_id = ''
     eob = False
+    details = True
+    as_of = False
+    max_staleness = None
 
-    def __init__(self, target, data=None, key=None, batch_id=None, eob=False):
+    def __init__(self, target, data=None, key=None, batch_id=None,
+                 eob=False, details=True, as_of=False, max_staleness=None):
         """
         Representation of the payload
         """
@@ -354,6 +1945,9 @@ class RateConversionPayload:
         self.key = key
         self.batch_id = batch_id
         self.eob = eob
+        self.details = details
+        self.as_of = as_of
+        self.max_staleness = max_staleness
 
 
 class BulkRate:
@@ -388,25 +1982,44 @@ class BulkRate:
         self.from_date = from_date
         self.to_date = to_date
 
-    def to_rates(self, user):
+    def to_rates(self, user: User) -> {str: int}:
         """
         Create rates in the database
+        Rates and their inverse are built in memory and upserted by batches
+        :param user: owner of the rates
+        :return: dict with counts of inserted, updated and unchanged rates
         """
         if not self.to_date:
             self.to_date = date.today()
-        rates = []
-        for i in range((self.to_date - self.from_date).days + 1):
-            rate, created = Rate.objects.get_or_create(
-                user=user,
-                key=self.key,
+        rates = [
+            RateService.serializer(
                 base_currency=self.base_currency,
                 currency=self.currency,
-                value_date=self.from_date + timedelta(i)
-            )
-            rate.value = self.value
-            rate.save()
-            rates.append(rate)
-        return rates
+                date=self.from_date + timedelta(i),
+                value=self.value)
+            for i in range((self.to_date - self.from_date).days + 1)
+        ]
+        return Rate.objects.bulk_sync_rates(
+            rates=rates,
+            user=user,
+            key=self.key,
+            update_inverses=True)
+
+    def get_rates(self, user: User) -> models.QuerySet:
+        """
+        Rates of the range in the database, in the direction
+        they are stored
+        :param user: owner of the rates
+        """
+        stored = Rate(currency=self.currency,
+                      base_currency=self.base_currency).canonical()
+        return Rate.objects.filter(
+            user=user,
+            key=self.key,
+            base_currency=stored.base_currency,
+            currency=stored.currency,
+            value_date__gte=self.from_date,
+            value_date__lte=self.to_date or date.today())
 
 
 class RateConverter(BaseConverter):
@@ -414,22 +2027,29 @@ class RateConverter(BaseConverter):
     Converter of rates
     """
     base_currency = settings.BASE_CURRENCY
-    cached_currencies = {}
     user = None
     key = None
+    as_of = False
+    max_staleness = None
 
     def __init__(self, user: User, id: str = None, key: str = None,
-                 base_currency: str = settings.BASE_CURRENCY):
+                 base_currency: str = settings.BASE_CURRENCY,
+                 as_of: bool = False, max_staleness: int = None):
         """
         Initialize
         :param user: Django User
         :param key: key for user
         :param base_currency: destination currency
+        :param as_of: use the last known rate if no rate exists at date,
+        instead of fetching it from the rate service
+        :param max_staleness: maximum age in days of an "as of" rate
         """
         super(RateConverter, self).__init__(id=id)
         self.base_currency = base_currency
         self.user = user
         self.key = key
+        self.as_of = as_of
+        self.max_staleness = max_staleness
 
     def add_data(self, data: [Amount]) -> []:
         """
@@ -460,44 +2080,110 @@ class RateConverter(BaseConverter):
     def cache_currencies(self):
         """
         Reads currencies in data and fetches rates, put them in memory
+        Rates are resolved in one pass per date of the data
+        """
+        for date_obj, currencies in self.currencies_by_date().items():
+            self.rates(date_obj=date_obj, currencies=currencies)
+
+    def currencies_by_date(self) -> {date: {str}}:
         """
+        Currencies of the data by date
+        """
+        currencies_by_date = {}
         for line in self.data:
-            self.cached_currencies[line.date_obj] = \
-                self.cached_currencies.get(line.date_obj) or {}
-            rate = Rate.objects.rate_at_date(
-                key=self.key,
-                base_currency=self.base_currency,
-                currency=line.currency,
-                date_obj=line.date_obj)
-            if rate.pk:
-                self.cached_currencies[line.date_obj][line.currency] = \
-                    rate.value
+            currencies_by_date.setdefault(
+                line.date_obj, set()).add(line.currency)
+        return currencies_by_date
+
+    def rates(self, date_obj: date, currencies: {str}) -> {str: float}:
+        """
+        Rates of currencies at a date, from the rate cache of the process
+        Missing rates are resolved and cached, rates are not kept
+        by the converter so that they are not saved with it
+        :param date_obj: date of the rates
+        :param currencies: currency codes
+        :return: dict of rates by currency code, without missing rates
+        """
+        rates = converter_rates.rates(
+            key=self.key,
+            base_currency=self.base_currency,
+            currencies=currencies,
+            date_obj=date_obj)
+        missing = set(currencies) - rates.keys()
+        if not missing:
+            return rates
+        generation = converter_rates.generation(date_obj)
+        resolved = Rate.objects.resolve_rates(
+            currencies=missing,
+            key=self.key,
+            base_currency=self.base_currency,
+            date_obj=date_obj,
+            use_forex=not self.as_of)
+        converter_rates.add(
+            key=self.key,
+            base_currency=self.base_currency,
+            rates=resolved,
+            date_obj=date_obj,
+            generation=generation)
+        rates.update(resolved)
+        if self.as_of:
+            # Rates of previous dates are not cached as rates of the date
+            for currency in missing - resolved.keys():
+                rate = Rate.objects.rate_as_of(
+                    currency=currency,
+                    key=self.key,
+                    base_currency=self.base_currency,
+                    date_obj=date_obj,
+                    max_staleness=self.max_staleness)
+                if rate.value:
+                    rates[currency] = rate.value
+        return rates
 
-    def convert(self) -> ConverterResult:
+    def convert(self, details: bool = True) -> ConverterResult:
         """
         Converts data to base currency
+        Amounts, currencies and dates are converted as columns,
+        details of each conversion are only created if requested
+        :param details: add the detail of each conversion to the result
         """
         result = ConverterResult(id=self.id, target=self.base_currency)
-        for amount in self.data:
-            rate = self.cached_currencies[amount.date_obj][amount.currency]
-            if rate:
-                value = float(amount.amount) / rate
-                result.increment_sum(value)
-                detail = ConverterResultDetail(
-                    unit=amount.currency,
-                    original_value=amount.amount,
-                    date=amount.date_obj,
-                    conversion_rate=rate,
-                    converted_value=value
-                )
-                result.detail.append(detail)
-            else:
-                error = ConverterResultError(
+        if self.data:
+            amounts = np.array(
+                [float(amount.amount) for amount in self.data])
+            currencies, currency_index = np.unique(
+                [amount.currency for amount in self.data],
+                return_inverse=True)
+            dates, date_index = np.unique(
+                [amount.date_obj for amount in self.data],
+                return_inverse=True)
+            currencies_by_date = self.currencies_by_date()
+            rate_matrix = np.array([
+                [rates.get(currency) or np.nan for currency in currencies]
+                for rates in (
+                    self.rates(date_obj=date_obj,
+                               currencies=currencies_by_date[date_obj])
+                    for date_obj in dates)], dtype=float)
+            rates = rate_matrix[date_index, currency_index]
+            errors = np.isnan(rates)
+            values = amounts / np.where(errors, 1, rates)
+            result.sum = float(values.sum(where=~errors))
+            if details:
+                for i in np.flatnonzero(~errors):
+                    amount = self.data[i]
+                    result.detail.append(ConverterResultDetail(
+                        unit=amount.currency,
+                        original_value=amount.amount,
+                        date=amount.date_obj,
+                        conversion_rate=float(rates[i]),
+                        converted_value=float(values[i])
+                    ))
+            for i in np.flatnonzero(errors):
+                amount = self.data[i]
+                result.errors.append(ConverterResultError(
                     unit=amount.currency,
                     original_value=amount.amount,
                     date=amount.date_obj,
                     error=_('Rate could not be found')
-                )
-                result.errors.append(error)
+                ))
         self.end_batch(result.end_batch())
         return result
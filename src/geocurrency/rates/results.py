@@ -0,0 +1,216 @@
+"""
+Cache of results of rate queries, versioned by the rates they read
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from geocurrency.core.batches import CommitBatch
+from rest_framework import status
+from rest_framework.response import Response
+
+from .settings import RATE_RESULT_CACHE_TIMEOUT
+
+
+class RateResultCache:
+    """
+    Results of rate queries stored in the Django cache
+    Results are indexed by the query and the data versions of the rates
+    it reads, one per (key, base currency, currency) and a global one.
+    Versions are incremented when rates are written, so that results
+    are never invalidated but no longer read.
+    Pairs of currencies are unordered, as rates stored in a direction
+    answer queries in both directions.
+    """
+    prefix = 'rates'
+    timeout = 86400
+    # Key of the versions of rates of any key
+    ANY_KEY = '*'
+
+    def __init__(self, prefix: str = 'rates', timeout: int = 86400):
+        """
+        Initialize cache
+        :param prefix: prefix of the cache keys
+        :param timeout: time in seconds a result is kept
+        """
+        self.prefix = prefix
+        self.timeout = timeout
+        self._changes = CommitBatch(self.bump)
+
+    def version_key(self, key: str = None, currency: str = None,
+                    base_currency: str = None) -> str:
+        """
+        Cache key of a data version, global without pair of currencies
+        :param key: user defined key, ANY_KEY for rates of any key
+        :param currency: currency code
+        :param base_currency: base currency code
+        """
+        if not currency or not base_currency:
+            return f'{self.prefix}:version'
+        first, second = sorted([currency, base_currency])
+        return f'{self.prefix}:version:{key}:{first}:{second}'
+
+    def versions(self, version_keys: [str]) -> [int]:
+        """
+        Data versions, created if missing
+        Versions start at the current time so that a version
+        evicted from the cache does not take an older value again
+        :param version_keys: cache keys of the versions
+        """
+        versions = cache.get_many(version_keys)
+        for version_key in version_keys:
+            if version_key not in versions:
+                cache.add(version_key, time.time_ns(), timeout=None)
+                versions[version_key] = cache.get(version_key)
+        return [versions[version_key] for version_key in version_keys]
+
+    def version_keys(self, events: [tuple]) -> {str}:
+        """
+        Cache keys of the versions of written rates
+        :param events: list of (date, key, currency, base currency) tuples
+        """
+        version_keys = {self.version_key()}
+        for _, key, currency, base_currency in events:
+            version_keys.add(self.version_key(key, currency, base_currency))
+            version_keys.add(self.version_key(
+                self.ANY_KEY, currency, base_currency))
+        return version_keys
+
+    @staticmethod
+    def connection():
+        """
+        Redis connection of the default cache, None if not available
+        """
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    def bump(self, version_keys: {str}):
+        """
+        Increment versions, in a single round trip with Redis
+        :param version_keys: cache keys of the versions
+        """
+        version_keys = sorted(set(version_keys))
+        if not version_keys:
+            return
+        connection = self.connection()
+        if connection is None:
+            for version_key in version_keys:
+                try:
+                    cache.incr(version_key)
+                except ValueError:
+                    cache.add(version_key, time.time_ns(), timeout=None)
+            return
+        now = time.time_ns()
+        pipeline = connection.pipeline(transaction=False)
+        for version_key in version_keys:
+            redis_key = cache.make_key(version_key)
+            # Missing versions start at the current time, see versions
+            pipeline.set(redis_key, now, nx=True)
+            pipeline.incr(redis_key)
+        pipeline.execute()
+
+    def changed(self, events: [tuple]):
+        """
+        Increment the versions of written rates
+        In a transaction, versions are collected and incremented once
+        it is committed, as results computed meanwhile do not read
+        the written rates
+        :param events: list of (date, key, currency, base currency) tuples
+        """
+        events = list(events)
+        if events:
+            self._changes.add(self.version_keys(events))
+
+    def scope(self, params) -> [str]:
+        """
+        Cache keys of the versions of rates read by a query
+        Queries without both currencies read every rate
+        :param params: query parameters
+        """
+        currency = params.get('currency') or \
+            params.get('currency_latest_values')
+        base_currency = params.get('base_currency') or \
+            params.get('base_currency_latest_values')
+        if not currency or not base_currency:
+            return [self.version_key()]
+        currency, base_currency = currency.upper(), base_currency.upper()
+        if params.get('key_isnull'):
+            keys = [None]
+        elif params.get('key_or_null'):
+            keys = [params.get('key_or_null'), None]
+        elif params.get('key'):
+            keys = [params.get('key')]
+        else:
+            keys = [self.ANY_KEY]
+        return [self.version_key(key, currency, base_currency)
+                for key in keys]
+
+    def cache_key(self, request, name: str) -> str:
+        """
+        Key of the result of a query, depending on the user,
+        the parameters and the versions of the rates it reads
+        :param request: HTTP request
+        :param name: name of the query
+        """
+        user = request.user.pk if request.user and \
+            request.user.is_authenticated else None
+        params = sorted(
+            (param, sorted(request.GET.getlist(param)))
+            for param in request.GET)
+        versions = self.versions(self.scope(request.GET))
+        digest = hashlib.md5(
+            repr((name, user, params, versions)).encode('utf-8'))
+        return f'{self.prefix}:result:{digest.hexdigest()}'
+
+    def get(self, cache_key: str):
+        """
+        Cached result, None if missing
+        :param cache_key: key of the result
+        """
+        return cache.get(cache_key)
+
+    def set(self, cache_key: str, data):
+        """
+        Cache a result
+        :param cache_key: key of the result
+        :param data: data of the response
+        """
+        cache.set(cache_key, data, timeout=self.timeout)
+
+
+rate_results = RateResultCache(
+    timeout=getattr(settings, 'RATE_RESULT_CACHE_TIMEOUT',
+                    RATE_RESULT_CACHE_TIMEOUT))
+
+
+def versioned_result(view):
+    """
+    Serve the result of a view from the result cache,
+    with its key as ETag. Requests with a matching If-None-Match
+    header get a 304 response.
+    :param view: view method returning a Response
+    """
+
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        cache_key = rate_results.cache_key(request, view.__name__)
+        etag = '"{}"'.format(cache_key.rsplit(':', 1)[-1])
+        if etag in [tag.strip().replace('W/', '', 1) for tag in
+                    request.headers.get('If-None-Match', '').split(',')]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED,
+                            headers={'ETag': etag})
+        data = rate_results.get(cache_key)
+        if data is not None:
+            return Response(data, headers={'ETag': etag})
+        response = view(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            rate_results.set(cache_key, response.data)
+            response['ETag'] = etag
+        return response
+
+    return wrapper
@@ -6,7 +6,8 @@ from datetime import datetime, date
 from rest_framework import serializers
 
 from geocurrency.core.serializers import UserSerializer
-from .models import Rate, Amount, BulkRate, RateConversionPayload
+from .models import Rate, Amount, BulkRate, RateConversionPayload, \
+    LatestRate
 
 
 class BulkSerializer(serializers.Serializer):
@@ -99,6 +100,22 @@ class BulkSerializer(serializers.Serializer):
         return value
 
 
+class BulkResultSerializer(serializers.Serializer):
+    """
+    Serializer for the result of a bulk creation
+    """
+    inserted = serializers.IntegerField(label="Number of rates inserted",
+                                        read_only=True)
+    updated = serializers.IntegerField(label="Number of rates updated",
+                                       read_only=True)
+    unchanged = serializers.IntegerField(label="Number of rates unchanged",
+                                         read_only=True)
+    conflicts = serializers.IntegerField(
+        label="Number of rates not written, "
+              "the key being used by another user",
+        read_only=True)
+
+
 class RateSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(label="ID of the rate")
     user = UserSerializer(label="Owner of the rate", read_only=True)
@@ -115,6 +132,58 @@ class RateSerializer(serializers.ModelSerializer):
             'value',
         ]
 
+    def to_representation(self, instance):
+        """
+        Rates stored in the other direction than the currency
+        or base currency requested are output inverted
+        """
+        data = super().to_representation(instance)
+        if self.is_inverted(instance):
+            data.update(
+                currency=instance.base_currency,
+                base_currency=instance.currency,
+                value=1 / instance.value if instance.value else 0)
+        return data
+
+    def is_inverted(self, instance: Rate) -> bool:
+        """
+        Rate is stored in the other direction than requested,
+        with RATE_CANONICAL_STORAGE
+        The direction is read from the currency and base_currency
+        of the context, or from the query of the request
+        :param instance: Rate
+        """
+        if not Rate.objects.canonical_storage():
+            return False
+        request = self.context.get('request')
+        query = request.GET if request is not None else {}
+        currency = (self.context.get('currency') or
+                    query.get('currency') or '').upper()
+        base_currency = (self.context.get('base_currency') or
+                         query.get('base_currency') or '').upper()
+        return bool(
+            (currency and instance.base_currency == currency and
+             instance.currency != currency) or
+            (base_currency and instance.currency == base_currency and
+             instance.base_currency != base_currency))
+
+
+class LatestRateSerializer(serializers.ModelSerializer):
+    id = serializers.ReadOnlyField(label="ID of the rate", source='rate_id')
+    user = UserSerializer(label="Owner of the rate", read_only=True)
+
+    class Meta:
+        model = LatestRate
+        fields = [
+            'id',
+            'user',
+            'key',
+            'currency',
+            'base_currency',
+            'value_date',
+            'value',
+        ]
+
 
 class RateStatItemSerializer(serializers.Serializer):
     """
@@ -149,6 +218,41 @@ class RateStatSerializer(serializers.Serializer):
                                      read_only=True)
 
 
+class RateMatrixSerializer(serializers.Serializer):
+    """
+    Rates between currencies at a date
+    """
+    value_date = serializers.DateField(label="Date of value",
+                                       read_only=True)
+    currencies = serializers.ListField(
+        label="Currencies of the matrix",
+        child=serializers.CharField(), read_only=True)
+    rates = serializers.DictField(
+        label="Rates of currencies by base currency",
+        child=serializers.DictField(child=serializers.FloatField()),
+        read_only=True)
+
+
+class RateHistorySerializer(serializers.Serializer):
+    """
+    Series of rates of a pair of currencies
+    """
+    currency = serializers.CharField(label="Currency to convert from",
+                                     read_only=True)
+    base_currency = serializers.CharField(label="Currency to convert to",
+                                          read_only=True)
+    key = serializers.CharField(label="User defined categorization key",
+                                read_only=True)
+    dates = serializers.ListField(label="Dates of value",
+                                  child=serializers.DateField(),
+                                  read_only=True)
+    values = serializers.ListField(label="Rate conversion factors",
+                                   child=serializers.FloatField(),
+                                   read_only=True)
+    stats = serializers.DictField(label="Statistics of the values",
+                                  read_only=True)
+
+
 class RateAmountSerializer(serializers.Serializer):
     """
     Rate amount used in conversion
@@ -227,6 +331,15 @@ class RateConversionPayloadSerializer(serializers.Serializer):
                                 required=False)
     eob = serializers.BooleanField(
         label="End of batch? Triggers the conversion", default=False)
+    details = serializers.BooleanField(
+        label="Include the detail of each conversion in the result",
+        default=True)
+    as_of = serializers.BooleanField(
+        label="Use the last known rate if no rate exists at date",
+        default=False)
+    max_staleness = serializers.IntegerField(
+        label="Maximum age in days of a last known rate",
+        min_value=0, required=False)
 
     def is_valid(self, raise_exception=False):
         """
@@ -271,4 +384,8 @@ class RateConversionPayloadSerializer(serializers.Serializer):
         self.batch_id = validated_data.get('batch_id', instance.batch_id)
         self.key = validated_data.get('key', instance.key)
         self.eob = validated_data.get('eob', instance.eob)
+        self.details = validated_data.get('details', instance.details)
+        self.as_of = validated_data.get('as_of', instance.as_of)
+        self.max_staleness = validated_data.get(
+            'max_staleness', instance.max_staleness)
         return instance
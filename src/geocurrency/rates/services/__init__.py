@@ -3,8 +3,11 @@ Rates services
 """
 from collections import Iterator
 
-from datetime import date as dt
+from datetime import date as dt, timedelta
 from django.conf import settings
+from django.core.cache import cache
+
+from ..settings import RATE_AVAILABLE_CURRENCIES_TIMEOUT
 
 
 class RateNotAvailableError(Exception):
@@ -21,6 +24,14 @@ class RatesNotAvailableError(Exception):
     pass
 
 
+class UnusableResponseError(RatesNotAvailableError):
+    """
+    Rates service answered, but does not support the request
+    or its response can not be used
+    """
+    pass
+
+
 class RateService:
     """
     Rate service
@@ -43,6 +54,38 @@ class RateService:
         """
         raise NotImplementedError
 
+    def cached_available_currencies(self) -> [str]:
+        """
+        Return list of available currencies,
+        kept in the cache for RATE_AVAILABLE_CURRENCIES_TIMEOUT.
+        Empty lists, as returned for error payloads, are not cached.
+        """
+        cache_key = 'rates:available_currencies:{}'.format(
+            self.__class__.__name__)
+        currencies = cache.get(cache_key)
+        if currencies is None:
+            currencies = list(self.available_currencies())
+            if currencies:
+                cache.set(cache_key, currencies, getattr(
+                    settings, 'RATE_AVAILABLE_CURRENCIES_TIMEOUT',
+                    RATE_AVAILABLE_CURRENCIES_TIMEOUT))
+        return currencies
+
+    @staticmethod
+    def date_chunks(date_obj: dt, to_obj: dt, days: int) -> Iterator:
+        """
+        Split a range of dates in chunks
+        :param date_obj: beginning of range
+        :param to_obj: end of range, included
+        :param days: maximum number of days of a chunk
+        :return: Iterator of (beginning, end) of chunks
+        """
+        start = date_obj
+        while start <= to_obj:
+            end = min(start + timedelta(days - 1), to_obj)
+            yield start, end
+            start = end + timedelta(1)
+
     def fetch_rates(self,
                     base_currency: str = settings.BASE_CURRENCY,
                     currency: str = None,
@@ -55,6 +98,7 @@ class RateService:
         :param date_obj: Date of value
         :param to_obj: Optional range of values
         :return: List of dicts [{'base_currency': base currency,
-            'currency': currency, 'date': date of value, 'value'}]
+            'currency': currency, 'date': date of value, 'value'}],
+            services may return an iterator of them for ranges
         """
         raise NotImplementedError
@@ -1,14 +1,17 @@
 """
 CurrencyLayer service
 """
+import logging
+from datetime import date
 
 import requests
-from datetime import date
 from django.conf import settings
+from geocurrency.core.http import http_client
 from typing import Iterator
 
 from . import RatesNotAvailableError, RateService
-from ..settings import CURRENCYLAYER_API_KEY
+from ..settings import CURRENCYLAYER_API_KEY, \
+    CURRENCYLAYER_TIMEFRAME_CHUNK_DAYS
 
 CURRENCYLAYER_API_URL = 'http://api.currencylayer.com/'
 CURRENCYLAYER_CURRENCIES_ENDPOINT = 'list'
@@ -27,23 +30,62 @@ class CurrencyLayerService(RateService):
     Currency layer service class
     """
 
+    @staticmethod
+    def _get(url: str, params: dict) -> dict:
+        """
+        Request an endpoint of the service
+        Connection errors, error statuses and invalid responses
+        raise RatesNotAvailableError
+        :param url: URL of the endpoint
+        :param params: parameters of the request
+        :return: data of the response
+        """
+        try:
+            response = http_client.get(
+                url=url, params=params, service='currencylayer')
+        except requests.RequestException as e:
+            logging.error(e)
+            raise RatesNotAvailableError(str(e))
+        if response.status_code != 200:
+            raise RatesNotAvailableError(response.text)
+        try:
+            data = response.json()
+        except ValueError as e:
+            logging.error(e)
+            raise RatesNotAvailableError(str(e))
+        if not isinstance(data, dict):
+            raise RatesNotAvailableError('Invalid response')
+        return data
+
     def available_currencies(self) -> Iterator:
         """
         List availbale currencies for the service
         """
-        data = {
+        params = {
             'access_key': CL_API_KEY
         }
         url = CURRENCYLAYER_API_URL + CURRENCYLAYER_CURRENCIES_ENDPOINT
-        response = requests.get(url=url, data=data)
-        if response.status_code == 200:
-            data = response.json()
-            if 'currencies' in data:
-                return data.get('currencies').keys()
-            else:
-                return []
+        data = self._get(url=url, params=params)
+        if 'currencies' in data:
+            return data.get('currencies').keys()
         else:
-            raise RatesNotAvailableError(response.text)
+            return []
+
+    def _fetch(self, url: str, base_currency: str, params: dict) -> Iterator:
+        """
+        Call an endpoint of the service
+        :param url: URL of the endpoint
+        :param base_currency: base currency
+        :param params: parameters of the request
+        :return: Iterator of rates
+        """
+        data = self._get(url=url, params=params)
+        if 'quotes' in data:
+            return self.parse_result(
+                base_currency=base_currency,
+                data=data)
+        else:
+            return iter([])
 
     def fetch_rates(self,
                     base_currency: str = settings.BASE_CURRENCY,
@@ -51,71 +93,81 @@ class CurrencyLayerService(RateService):
                     date_obj: date = date.today(),
                     to_obj: date = None) -> []:
         """
-        Fetch rates
+        Fetch rates, ranges are fetched by chunks
+        of CURRENCYLAYER_TIMEFRAME_CHUNK_DAYS
         :param base_currency: base currency
         :param currency: target currency
         :param date_obj: date of the rate
         :param to_obj: optional range parameter
         """
-        data = {
+        params = {
             'access_key': CL_API_KEY,
             'source': base_currency
         }
         if currency:
-            data['currencies'] = [currency]
+            params['currencies'] = currency
+        if to_obj and to_obj > date_obj:
+            url = CURRENCYLAYER_API_URL + CURRENCYLAYER_TIMEFRAME_ENDPOINT
+            chunk_days = getattr(
+                settings, 'CURRENCYLAYER_TIMEFRAME_CHUNK_DAYS',
+                CURRENCYLAYER_TIMEFRAME_CHUNK_DAYS)
+            rates = []
+            for start, end in self.date_chunks(date_obj, to_obj, chunk_days):
+                params['start_date'] = start.strftime('%Y-%m-%d')
+                params['end_date'] = end.strftime('%Y-%m-%d')
+                rates.extend(self._fetch(
+                    url=url, base_currency=base_currency, params=params))
+            return rates
         if date_obj == date.today():
             url = CURRENCYLAYER_API_URL + CURRENCYLAYER_LIVE_ENDPOINT
-        elif to_obj:
-            url = CURRENCYLAYER_API_URL + CURRENCYLAYER_HISTORICAL_ENDPOINT
-            data['start_date'] = date_obj
-            data['end_date'] = to_obj
         else:
             url = CURRENCYLAYER_API_URL + CURRENCYLAYER_HISTORICAL_ENDPOINT
-            data['date'] = date_obj
-        response = requests.get(url=url, data=data)
-        if response.status_code == 200:
-            data = response.json()
-            if 'quotes' in data:
-                return self.parse_result(
-                    base_currency=base_currency,
-                    data=data.get('quotes'))
-            else:
-                return {}
-        else:
-            raise RatesNotAvailableError(response.text)
+            params['date'] = date_obj.strftime('%Y-%m-%d')
+        return list(self._fetch(
+            url=url, base_currency=base_currency, params=params))
 
-    def parse_result(self, base_currency, data: dict) -> []:
+    def parse_result(self, base_currency, data: dict) -> Iterator:
         """
         Parse output from currencylayout services
+        Malformed data raise RatesNotAvailableError while iterated
+        :param base_currency: base currency
+        :param data: dictionnary of data
+        :return: Iterator of rates
+        """
+        try:
+            yield from self._parse_quotes(base_currency, data)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            logging.error(e)
+            raise RatesNotAvailableError(f'Invalid response: {e!r}')
+
+    def _parse_quotes(self, base_currency, data: dict) -> Iterator:
+        """
+        Rates of the quotes of the output of currencylayer services
         :param base_currency: base currency
         :param data: dictionnary of data
+        :return: Iterator of rates
         """
-        output = []
-        if 'timeframe' in data:
+        if data.get('timeframe'):
             # request is timeframe based, so data is agregated by date
-            for date_obj, rate_dict in data:
-                for code, value in rate_dict:
-                    output.append(
-                        self.serializer(
-                            base_currency=base_currency,
-                            currency=code[3:],
-                            value=value,
-                            date=date_obj)
-                    )
+            for date_str, rate_dict in data['quotes'].items():
+                date_obj = date.fromisoformat(date_str)
+                for code, value in rate_dict.items():
+                    yield self.serializer(
+                        base_currency=base_currency,
+                        currency=code[3:],
+                        value=value,
+                        date=date_obj)
         else:
             if 'date' in data:
                 # Historical search
-                date_obj = data['date']
+                date_obj = date.fromisoformat(data['date'])
             else:
                 # live search
                 date_obj = date.today()
-            for code, value in data:
-                output.append(
-                    self.serializer(
-                        base_currency=base_currency,
-                        currency=code[3:],
-                        value=value,
-                        date=date_obj
-                    )
+            for code, value in data['quotes'].items():
+                yield self.serializer(
+                    base_currency=base_currency,
+                    currency=code[3:],
+                    value=value,
+                    date=date_obj
                 )
-        return output
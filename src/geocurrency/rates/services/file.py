@@ -0,0 +1,185 @@
+"""
+File rate service
+reads rates from local CSV or ECB XML files
+"""
+import csv
+import gzip
+from datetime import date
+from typing import Iterator
+from xml.etree.ElementTree import iterparse
+
+from django.conf import settings
+from geocurrency.core.helpers import to_date
+
+from . import RateService, RatesNotAvailableError
+from ..settings import RATE_FILE_PATH, RATE_FILE_BASE_CURRENCY
+
+
+class FileRateService(RateService):
+    """
+    File rate service
+    Rates are streamed from the file, so that files of any size
+    are read with constant memory. Supported layouts:
+    - CSV with date, base_currency, currency and value columns
+    - CSV with a date column and a column per currency,
+      like the ECB history, values being in base currency
+    - XML of the ECB, with rates in Cube elements
+    Files compressed with gzip are read if their name ends with .gz
+    The service is meant for loading files with the load_rates command.
+    Files are not indexed, each call of fetch_rates reads the whole file,
+    so that large files should be loaded rather than used as RATE_SERVICE.
+    """
+    path = None
+    base_currency = 'EUR'
+
+    def __init__(self, path: str = None, base_currency: str = None):
+        """
+        Initialize service
+        :param path: path of the file, defaults to RATE_FILE_PATH
+        :param base_currency: base currency of files without
+        base currency column, defaults to RATE_FILE_BASE_CURRENCY
+        """
+        self.path = path or getattr(settings, 'RATE_FILE_PATH',
+                                    RATE_FILE_PATH)
+        self.base_currency = base_currency or getattr(
+            settings, 'RATE_FILE_BASE_CURRENCY', RATE_FILE_BASE_CURRENCY)
+
+    def _open(self, mode: str = 'rt'):
+        """
+        Open the file
+        :param mode: 'rt' for text, 'rb' for bytes
+        """
+        if not self.path:
+            raise RatesNotAvailableError('No rate file configured')
+        opener = gzip.open if self.path.endswith('.gz') else open
+        kwargs = {'newline': ''} if 't' in mode else {}
+        try:
+            return opener(self.path, mode, **kwargs)
+        except OSError as e:
+            raise RatesNotAvailableError(str(e))
+
+    def file_format(self) -> str:
+        """
+        Format of the file based on its name, 'xml' or 'csv'
+        """
+        name = self.path[:-3] if self.path.endswith('.gz') else self.path
+        return 'xml' if name.lower().endswith('.xml') else 'csv'
+
+    def iter_rates(self) -> Iterator:
+        """
+        Stream rates from the file
+        :return: Iterator of rates
+        """
+        if self.file_format() == 'xml':
+            return self._iter_xml()
+        return self._iter_csv()
+
+    def _iter_csv(self) -> Iterator:
+        """
+        Stream rates from a CSV file
+        """
+        with self._open() as f:
+            reader = csv.reader(f)
+            header = [h.strip() for h in next(reader, [])]
+            if {'date', 'base_currency', 'currency', 'value'} \
+                    <= set(header):
+                columns = {h: i for i, h in enumerate(header)}
+                for row in reader:
+                    if not row:
+                        continue
+                    value = self._value(row[columns['value']])
+                    if value is None:
+                        continue
+                    yield self.serializer(
+                        base_currency=row[columns['base_currency']].strip(),
+                        currency=row[columns['currency']].strip(),
+                        date=date.fromisoformat(row[columns['date']].strip()),
+                        value=value)
+            else:
+                currencies = header[1:]
+                for row in reader:
+                    if not row:
+                        continue
+                    date_obj = date.fromisoformat(row[0].strip())
+                    for currency, cell in zip(currencies, row[1:]):
+                        value = self._value(cell)
+                        if not currency or value is None:
+                            continue
+                        yield self.serializer(
+                            base_currency=self.base_currency,
+                            currency=currency,
+                            date=date_obj,
+                            value=value)
+
+    def _iter_xml(self) -> Iterator:
+        """
+        Stream rates from an ECB XML file
+        <Cube><Cube time="..."><Cube currency="..." rate="..."/></Cube></Cube>
+        Processed elements are cleared to keep memory constant
+        """
+        date_obj = None
+        parents = []
+        with self._open('rb') as f:
+            for event, elem in iterparse(f, events=('start', 'end')):
+                if not elem.tag.endswith('Cube'):
+                    continue
+                if event == 'start':
+                    if 'time' in elem.attrib:
+                        date_obj = date.fromisoformat(elem.attrib['time'])
+                    elif 'currency' not in elem.attrib:
+                        parents.append(elem)
+                elif 'currency' in elem.attrib:
+                    value = self._value(elem.attrib.get('rate'))
+                    if date_obj and value is not None:
+                        yield self.serializer(
+                            base_currency=self.base_currency,
+                            currency=elem.attrib['currency'],
+                            date=date_obj,
+                            value=value)
+                elif 'time' in elem.attrib:
+                    elem.clear()
+                    for parent in parents:
+                        parent.clear()
+
+    @staticmethod
+    def _value(cell: str) -> float:
+        """
+        Value of a cell, None if not a number
+        :param cell: text of the cell
+        """
+        try:
+            return float(cell)
+        except (TypeError, ValueError):
+            return None
+
+    def available_currencies(self) -> Iterator:
+        """
+        List currencies of the file
+        """
+        currencies = set()
+        for rate in self.iter_rates():
+            currencies.update([rate['base_currency'], rate['currency']])
+        return sorted(currencies)
+
+    def fetch_rates(self,
+                    base_currency: str = settings.BASE_CURRENCY,
+                    currency: str = None,
+                    date_obj: date = date.today(),
+                    to_obj: date = None) -> []:
+        """
+        Get rates of the file for a base currency and a range of dates
+        The whole file is read at each call, see the class documentation
+        :param base_currency: base currency
+        :param currency: currency to convert from
+        :param date_obj: beginning of range
+        :param to_obj: end of range
+        :return: List of rates
+        """
+        start = to_date(date_obj)
+        end = to_date(to_obj or date_obj)
+        return [
+            rate for rate in self.iter_rates()
+            if rate['base_currency'] == base_currency
+            and (not currency or rate['currency'] == currency)
+            and start <= rate['date'] <= end
+        ]
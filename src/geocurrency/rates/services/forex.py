@@ -1,114 +1,235 @@
 """
-Python_forex based wrapper
-uses ratesapi.io
+Forex rates service
+uses ratesapi.io, the source of python-forex
 """
 import logging
 from datetime import date, timedelta
 from typing import Iterator
 
+import requests
 from django.conf import settings
-from forex_python import converter
+from geocurrency.core.http import http_client
 
-from . import RateService, RatesNotAvailableError
+from . import RateService, RatesNotAvailableError, UnusableResponseError
+from ..settings import FOREX_API_URL, FOREX_HISTORY_CHUNK_DAYS
+
+FOREX_HISTORY_ENDPOINT = 'history'
 
 
 class ForexService(RateService):
     """
     Forex Rate service
     """
+    api_url = FOREX_API_URL
+
+    def __init__(self):
+        """
+        Initialize service with the URL of FOREX_API_URL
+        """
+        self.api_url = getattr(settings, 'FOREX_API_URL', FOREX_API_URL)
 
     def available_currencies(self) -> Iterator:
         """
         List available currencies for this service
         """
         rates = self.fetch_rates(base_currency='USD')
-        return [r['currency'] for r in rates]
+        return sorted({'USD'} | {r['currency'] for r in rates})
 
-    def _fetch_all_rates(
-            self,
-            provider: converter.CurrencyRates,
-            base_currency: str,
-            date_obj: date) -> []:
+    def _get(self, endpoint: str, params: dict) -> dict:
+        """
+        Request the API with the shared HTTP client
+        :param endpoint: endpoint of the API
+        :param params: parameters of the request
+        :return: rates from the response
+        """
+        try:
+            response = http_client.get(
+                self.api_url + endpoint,
+                params=dict(params, rtype='fpy'),
+                service='forex')
+        except requests.RequestException as e:
+            logging.error(e)
+            raise RatesNotAvailableError
+        if response.status_code >= 500 or response.status_code == 429:
+            logging.error(response.text)
+            raise RatesNotAvailableError
+        if response.status_code != 200:
+            logging.error(response.text)
+            raise UnusableResponseError
+        try:
+            rates = response.json().get('rates', {})
+        except (ValueError, AttributeError) as e:
+            logging.error(e)
+            raise UnusableResponseError
+        if not isinstance(rates, dict):
+            raise UnusableResponseError
+        return rates
+
+    def _fetch_all_rates(self, base_currency: str, date_obj: date) -> []:
         """
         Fetch all rates for availbale currencies for this service
-        :param provider: Currency rates
         :param base_currency: base currency
         :param date_obj: date of value
         :return: List of conversion rates
         """
-        try:
-            _rates = provider.get_rates(
-                base_cur=base_currency,
-                date_obj=date_obj)
-            return [self.serializer(
-                base_currency=base_currency,
-                currency=key,
-                date=date_obj,
-                value=value
-            ) for key, value in _rates.items()]
-        except converter.RatesNotAvailableError as e:
-            logging.error(e)
-            raise RatesNotAvailableError
+        _rates = self._get(
+            endpoint=date_obj.strftime('%Y-%m-%d'),
+            params={'base': base_currency})
+        return [self.serializer(
+            base_currency=base_currency,
+            currency=key,
+            date=date_obj,
+            value=value
+        ) for key, value in _rates.items()]
 
-    def _fetch_single_rate(self,
-                           provider: converter.CurrencyRates,
-                           base_currency: str,
+    def _fetch_single_rate(self, base_currency: str,
                            currency: str, date_obj: date) -> []:
         """
         Fetch one conversion rate between a currency
         and a base currency at a given date
-        :param provider: provider of the values
         :param base_currency: base currency
         :param currency: currency to convert from
         :param date_obj: date of value
         :return: List of rates
         """
+        if currency == base_currency:
+            value = 1.
+        else:
+            value = self._get(
+                endpoint=date_obj.strftime('%Y-%m-%d'),
+                params={'base': base_currency, 'symbols': currency}
+            ).get(currency)
+        if not value:
+            logging.error(
+                f"Currency Rate {base_currency} => {currency} "
+                f"not available for Date {date_obj}")
+            raise RatesNotAvailableError
+        return [self.serializer(
+            base_currency=base_currency,
+            currency=currency,
+            date=date_obj,
+            value=value
+        )]
+
+    def _fetch_range(self,
+                     base_currency: str,
+                     currency: str,
+                     date_obj: date,
+                     to_obj: date) -> []:
+        """
+        Fetch rates for a range of dates in one request
+        The payload is checked before rates are returned,
+        so that a fallback does not duplicate rates
+        :param base_currency: base currency
+        :param currency: optional currency to convert from
+        :param date_obj: beginning of range
+        :param to_obj: end of range
+        :return: List of rates
+        """
+        params = {
+            'base': base_currency,
+            'start_at': date_obj.strftime('%Y-%m-%d'),
+            'end_at': to_obj.strftime('%Y-%m-%d'),
+        }
+        if currency:
+            params['symbols'] = currency
+        _rates = self._get(endpoint=FOREX_HISTORY_ENDPOINT, params=params)
         try:
-            value = provider.get_rate(
-                dest_cur=currency,
-                base_cur=base_currency,
-                date_obj=date_obj)
-            return [self.serializer(
-                base_currency=base_currency,
-                currency=currency,
-                date=date_obj,
-                value=value
-            )]
+            return [
+                self.serializer(
+                    base_currency=base_currency,
+                    currency=key,
+                    date=date.fromisoformat(date_str),
+                    value=value)
+                for date_str, date_rates in _rates.items()
+                for key, value in date_rates.items()]
+        except (TypeError, ValueError, AttributeError):
+            raise UnusableResponseError
 
-        except converter.RatesNotAvailableError as e:
-            logging.error(e)
-            raise RatesNotAvailableError
+    def _fetch_days(self,
+                    base_currency: str,
+                    currency: str,
+                    date_obj: date,
+                    to_obj: date) -> []:
+        """
+        Fetch rates for a range of dates with one request per day
+        :param base_currency: base currency
+        :param currency: optional currency to convert from
+        :param date_obj: beginning of range
+        :param to_obj: end of range
+        :return: List of rates
+        """
+        rates = []
+        for i in range((to_obj - date_obj).days + 1):
+            if currency:
+                rates.extend(self._fetch_single_rate(
+                    base_currency=base_currency,
+                    currency=currency,
+                    date_obj=date_obj + timedelta(i)))
+            else:
+                rates.extend(self._fetch_all_rates(
+                    base_currency=base_currency,
+                    date_obj=date_obj + timedelta(i)))
+        return rates
+
+    def _fetch_chunks(self,
+                      base_currency: str,
+                      currency: str,
+                      date_obj: date,
+                      to_obj: date) -> Iterator:
+        """
+        Fetch a range of dates by chunks of FOREX_HISTORY_CHUNK_DAYS,
+        each chunk being requested once the previous one is consumed
+        :param base_currency: currency to convert to
+        :param currency: currency to convert from
+        :param date_obj: beginning of range
+        :param to_obj: end of range
+        :return: Iterator of rates
+        """
+        chunk_days = getattr(
+            settings, 'FOREX_HISTORY_CHUNK_DAYS', FOREX_HISTORY_CHUNK_DAYS)
+        for start, end in self.date_chunks(date_obj, to_obj, chunk_days):
+            try:
+                rates = self._fetch_range(
+                    base_currency=base_currency,
+                    currency=currency,
+                    date_obj=start,
+                    to_obj=end)
+            except UnusableResponseError:
+                rates = self._fetch_days(
+                    base_currency=base_currency,
+                    currency=currency,
+                    date_obj=start,
+                    to_obj=end)
+            yield from rates
 
     def fetch_rates(self,
                     base_currency: str = settings.BASE_CURRENCY,
                     currency: str = None,
                     date_obj: date = date.today(),
-                    to_obj: date = None) -> []:
+                    to_obj: date = None) -> Iterator:
         """
         Get conversion rates between currency
-         and base currency for a range of dates
+         and base currency for a range of dates.
+        Ranges are fetched lazily by chunks of FOREX_HISTORY_CHUNK_DAYS,
+        day by day if the history is not supported by the source,
+        so that they are not held in memory.
+        Errors of the source are raised, not retried day by day.
         :param base_currency: currency to convert to
         :param currency: currency to convert from
         :param date_obj: beginning of range
         :param to_obj: end of range
-        :return: List of conversion rates
+        :return: List of conversion rates, Iterator of conversion rates
+        for ranges, raising errors while iterated
         """
-        c = converter.CurrencyRates()
-        rates = []
-        _rates = []
-        if currency:
-            for i in range(((to_obj or date_obj) - date_obj).days + 1):
-                _rates = self._fetch_single_rate(
-                    c,
-                    base_currency=base_currency,
-                    currency=currency,
-                    date_obj=date_obj + timedelta(i))
-                rates.extend(_rates)
-        else:
-            for i in range(((to_obj or date_obj) - date_obj).days + 1):
-                _rates = self._fetch_all_rates(
-                    c,
-                    base_currency=base_currency,
-                    date_obj=date_obj + timedelta(i))
-                rates.extend(_rates)
-        return rates
+        if not to_obj or to_obj <= date_obj:
+            return self._fetch_days(
+                base_currency=base_currency,
+                currency=currency,
+                date_obj=date_obj,
+                to_obj=date_obj)
+        return self._fetch_chunks(
+            base_currency=base_currency,
+            currency=currency,
+            date_obj=date_obj,
+            to_obj=to_obj)
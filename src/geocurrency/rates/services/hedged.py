@@ -0,0 +1,154 @@
+"""
+Hedged rate service
+queries several rate services, the fastest first
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date
+from typing import Iterator
+
+from django.conf import settings
+from geocurrency.core.helpers import service
+
+from . import RateService, RatesNotAvailableError
+from ..settings import RATE_HEDGED_SERVICES, RATE_HEDGE_DELAY
+
+
+class HedgedRateService(RateService):
+    """
+    Hedged rate service
+    Queries the service with the lowest latency, then the next one
+    if no rates arrived after a delay, and returns the first rates
+    """
+    services = []
+    hedge_delay = 0.5
+    # Weight of the last request in the average latency of a service
+    alpha = 0.2
+
+    def __init__(self, services: [str] = None, hedge_delay: float = None):
+        """
+        Initialize service
+        :param services: names of the rate services to query,
+        defaults to RATE_HEDGED_SERVICES
+        :param hedge_delay: time in seconds to wait for a service
+        before querying the next one, defaults to RATE_HEDGE_DELAY
+        """
+        self.services = services or getattr(
+            settings, 'RATE_HEDGED_SERVICES', RATE_HEDGED_SERVICES)
+        self.hedge_delay = hedge_delay if hedge_delay is not None else \
+            getattr(settings, 'RATE_HEDGE_DELAY', RATE_HEDGE_DELAY)
+        self.latencies = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=4 * len(self.services),
+            thread_name_prefix='hedged-rates')
+
+    def ranked_services(self) -> [str]:
+        """
+        Services by increasing average latency,
+        services never queried first
+        """
+        with self._lock:
+            return sorted(self.services,
+                          key=lambda name: self.latencies.get(name, 0))
+
+    def _record(self, name: str, latency: float):
+        """
+        Update the exponentially weighted average latency of a service
+        :param name: name of the service
+        :param latency: latency of the last request in seconds
+        """
+        with self._lock:
+            if name in self.latencies:
+                latency = self.alpha * latency + \
+                    (1 - self.alpha) * self.latencies[name]
+            self.latencies[name] = latency
+
+    def _fetch(self, name: str, **kwargs) -> []:
+        """
+        Fetch rates from a service, recording its latency.
+        Failures count as a request lasting the hedge delay more,
+        so that failing services are queried last.
+        :param name: name of the service
+        :param kwargs: arguments of fetch_rates
+        """
+        start = time.monotonic()
+        try:
+            rates = service(
+                service_type='rates', service_name=name
+            ).fetch_rates(**kwargs)
+        except Exception:
+            self._record(name, time.monotonic() - start + self.hedge_delay)
+            raise
+        if not rates:
+            self._record(name, time.monotonic() - start + self.hedge_delay)
+        else:
+            self._record(name, time.monotonic() - start)
+        return rates
+
+    def stats(self) -> {str: float}:
+        """
+        Average latency of services in seconds
+        """
+        with self._lock:
+            return dict(self.latencies)
+
+    def available_currencies(self) -> Iterator:
+        """
+        List available currencies of the fastest available service
+        """
+        for name in self.ranked_services():
+            try:
+                return service(
+                    service_type='rates', service_name=name
+                ).available_currencies()
+            except (NotImplementedError, RatesNotAvailableError):
+                continue
+        raise RatesNotAvailableError
+
+    def fetch_rates(self,
+                    base_currency: str = settings.BASE_CURRENCY,
+                    currency: str = None,
+                    date_obj: date = date.today(),
+                    to_obj: date = None) -> []:
+        """
+        Fetch rates from the first service answering
+        :param base_currency: base currency
+        :param currency: target currency
+        :param date_obj: date of the rate
+        :param to_obj: optional range parameter
+        """
+        kwargs = {
+            'base_currency': base_currency,
+            'currency': currency,
+            'date_obj': date_obj,
+            'to_obj': to_obj,
+        }
+        candidates = self.ranked_services()
+        names = {}
+        pending = set()
+        while candidates or pending:
+            if candidates:
+                name = candidates.pop(0)
+                future = self._executor.submit(self._fetch, name, **kwargs)
+                names[future] = name
+                pending.add(future)
+            done, pending = wait(
+                pending,
+                timeout=self.hedge_delay if candidates else None,
+                return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    rates = future.result()
+                except Exception as e:
+                    logging.error(f'{names[future]}: {e!r}')
+                    continue
+                if rates:
+                    # Running requests can not be interrupted,
+                    # their results are ignored
+                    for loser in pending:
+                        loser.cancel()
+                    return rates
+        raise RatesNotAvailableError
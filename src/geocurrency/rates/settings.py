@@ -7,3 +7,81 @@ import os
 BASE_CURRENCY = 'EUR'
 RATE_SERVICE = 'forex'
 CURRENCYLAYER_API_KEY = os.environ.get('CURRENCYLAYER_API_KEY')
+# Number of rate graphs, one per (date, key), kept in memory by each process
+RATE_GRAPH_CACHE_SIZE = 128
+# Number of rates written per query by bulk upserts
+RATE_BULK_BATCH_SIZE = 500
+# Number of rate series, one per (key, base currency, currency),
+# kept in memory by each process for "as of" lookups
+RATE_AS_OF_INDEX_SIZE = 1024
+# Maximum age in days of a rate used by an "as of" lookup
+RATE_AS_OF_MAX_STALENESS = 7
+# Number of failed fetches of the rate service remembered by each process
+RATE_FETCH_FAILURE_CACHE_SIZE = 10000
+# Time in seconds during which a failed fetch is not retried
+RATE_FETCH_FAILURE_TTL = 3600
+# Time in seconds after which a process waiting for a fetch
+# done by another process fetches the rates itself
+RATE_SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+# Time in seconds a fetched result is shared with waiting processes
+RATE_SINGLE_FLIGHT_RESULT_TIMEOUT = 10
+# Maximum number of concurrent fetches per rate service
+# by the fetch_rates command
+RATE_SERVICE_CONCURRENCY = {
+    'forex': 4,
+    'currencylayer': 2,
+}
+# Time in seconds the list of currencies available
+# from a rate service is cached
+RATE_AVAILABLE_CURRENCIES_TIMEOUT = 86400
+# URL of the API of the forex service
+FOREX_API_URL = 'https://theratesapi.com/api/'
+# Maximum number of days fetched per request by the forex service
+FOREX_HISTORY_CHUNK_DAYS = 366
+# Number of rates of a range fetched from the rate service
+# written at once by fetches of rates
+RATE_FETCH_CHUNK_SIZE = 10000
+# Maximum number of days fetched per request by the currencylayer
+# service, as limited by its timeframe endpoint
+CURRENCYLAYER_TIMEFRAME_CHUNK_DAYS = 365
+# State file of the incremental mode of the fetch_rates command
+RATE_FETCH_STATE_FILE = '.fetch_rates_state.json'
+# Rate services queried by the hedged rate service
+RATE_HEDGED_SERVICES = ['forex', 'currencylayer']
+# Time in seconds the hedged rate service waits for a service
+# before querying the next one
+RATE_HEDGE_DELAY = 0.5
+# Rate file read by the file rate service, which reads the whole file
+# for each fetch of rates, large files being loaded with load_rates
+RATE_FILE_PATH = None
+# Base currency of rate files without base currency, like ECB files
+RATE_FILE_BASE_CURRENCY = 'EUR'
+# Number of rates read from a file before they are written
+# by the load_rates command
+RATE_FILE_LOAD_CHUNK_SIZE = 10000
+# Directory of the memory-mapped history of rates, None to disable it
+RATE_HISTORY_STORE_PATH = None
+# Store the rates of a pair of currencies in a single direction,
+# the base currency being first in alphabetical order, instead of
+# storing the inverse rate too. Inverse rates are derived when read.
+RATE_CANONICAL_STORAGE = False
+# Number of rates derived from paths of rates kept in memory
+# by each process, instead of being stored as rates
+RATE_DERIVED_CACHE_SIZE = 10000
+# Time in seconds a derived rate is kept in memory
+RATE_DERIVED_CACHE_TTL = 3600
+# Number of rates, one per (key, base currency, currency, date),
+# kept in memory by each process for converters
+RATE_CONVERTER_CACHE_SIZE = 100000
+# Time in seconds rates of today are kept in memory for converters,
+# as they may still change. None to keep them until evicted.
+RATE_CONVERTER_CACHE_TODAY_TTL = 300
+# Send changes of rates to other processes through the pub/sub
+# of the Redis server of the default cache, if it is a django_redis
+# cache, so that they drop their in-process caches
+RATE_INVALIDATION_BUS = True
+# Redis channel of the changes of rates
+RATE_INVALIDATION_CHANNEL = 'geocurrency:rates:invalidation'
+# Time in seconds results of rate list and stats queries are cached,
+# results being no longer read once the rates they read are written
+RATE_RESULT_CACHE_TIMEOUT = 86400
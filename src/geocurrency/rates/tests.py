@@ -2,19 +2,177 @@
 Rates module tests
 """
 import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import uuid
 from datetime import date
+from unittest import mock
 
+import numpy as np
+import requests
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
-from .models import Rate, RateConverter, NoRateFound
+from geocurrency.core.http import HttpClient, http_client
+from geocurrency.core.singleflight import SingleFlight
+from geocurrency.currencies.models import Currency
+
+from .bus import RateInvalidationBus, rate_invalidation_bus
+from .caches import LRUCache, ScopedLRUCache, rate_graph_cache, \
+    rate_fetch_failures, derived_rates, DerivedRateCache, converter_rates, \
+    ConverterRateCache, RateAsOfIndex
+from .history import RateHistoryStore, rate_history_store
+from .models import Rate, RateConverter, NoRateFound, Amount, RateMatrix, \
+    RateRollup, LatestRate
+from .results import rate_results
 from .serializers import RateAmountSerializer
+from .services import RateService, RatesNotAvailableError
+from .services.currencylayer import CurrencyLayerService
+from .services.file import FileRateService
+from .services.forex import ForexService
+from .services.hedged import HedgedRateService
+
+
+class FailingRateService(RateService):
+    """
+    Rate service that never has rates
+    """
+    calls = 0
+
+    def fetch_rates(self, *args, **kwargs) -> []:
+        """
+        Count calls and fail
+        """
+        FailingRateService.calls += 1
+        raise RatesNotAvailableError
+
+
+class SlowFailingRateService(FailingRateService):
+    """
+    Rate service that takes time to never have rates
+    """
+
+    def fetch_rates(self, *args, **kwargs) -> []:
+        """
+        Wait, count calls and fail
+        """
+        time.sleep(0.2)
+        return super(SlowFailingRateService, self).fetch_rates(
+            *args, **kwargs)
+
+
+class StaticRateService(RateService):
+    """
+    Rate service with a constant rate to EUR for every currency
+    """
+
+    def fetch_rates(self, base_currency: str = 'EUR', currency: str = None,
+                    date_obj: date = date.today(), to_obj: date = None) -> []:
+        """
+        Constant rate of EUR in base currency
+        """
+        if base_currency == 'EUR':
+            return []
+        return [self.serializer(
+            base_currency=base_currency, currency='EUR',
+            date=date_obj, value=2)]
+
+
+class PivotRateService(RateService):
+    """
+    Rate service with rates of EUR only
+    """
+    calls = 0
+    quotes = {'USD': 1.2, 'GBP': 0.9, 'JPY': 130}
+
+    def available_currencies(self) -> [str]:
+        """
+        Currencies with rates
+        """
+        return ['EUR'] + list(self.quotes)
+
+    def fetch_rates(self, base_currency: str = 'EUR', currency: str = None,
+                    date_obj: date = date.today(), to_obj: date = None) -> []:
+        """
+        Constant rates of currencies in EUR
+        """
+        PivotRateService.calls += 1
+        if base_currency != 'EUR':
+            raise RatesNotAvailableError
+        return [self.serializer(
+            base_currency='EUR', currency=c,
+            date=date_obj + datetime.timedelta(i), value=v)
+            for i in range(((to_obj or date_obj) - date_obj).days + 1)
+            for c, v in self.quotes.items()]
+
+
+class MultiBaseRateService(RateService):
+    """
+    Rate service with rates of a few base currencies
+    """
+    calls = []
+    # Base currencies answered, others being not available
+    bases = ['EUR', 'USD', 'GBP']
+    quotes = {'EUR': 1, 'USD': 1.2, 'GBP': 0.9}
+
+    def available_currencies(self) -> [str]:
+        """
+        Currencies with rates
+        """
+        return list(self.quotes)
+
+    def fetch_rates(self, base_currency: str = 'EUR', currency: str = None,
+                    date_obj: date = date.today(), to_obj: date = None) -> []:
+        """
+        Constant rates of currencies in base currency
+        """
+        MultiBaseRateService.calls.append(base_currency)
+        if base_currency not in self.bases:
+            raise RatesNotAvailableError
+        return [self.serializer(
+            base_currency=base_currency, currency=c,
+            date=date_obj + datetime.timedelta(i),
+            value=v / self.quotes[base_currency])
+            for i in range(((to_obj or date_obj) - date_obj).days + 1)
+            for c, v in self.quotes.items() if c != base_currency]
+
+
+class SleepyRateService(StaticRateService):
+    """
+    Rate service answering late
+    """
+
+    def fetch_rates(self, *args, **kwargs) -> []:
+        """
+        Wait and return constant rates
+        """
+        time.sleep(0.5)
+        return super(SleepyRateService, self).fetch_rates(*args, **kwargs)
+
+
+TEST_SERVICES = {
+    'rates': {
+        'failing': 'geocurrency.rates.tests.FailingRateService',
+        'slow': 'geocurrency.rates.tests.SlowFailingRateService',
+        'static': 'geocurrency.rates.tests.StaticRateService',
+        'pivot': 'geocurrency.rates.tests.PivotRateService',
+        'multi': 'geocurrency.rates.tests.MultiBaseRateService',
+        'sleepy': 'geocurrency.rates.tests.SleepyRateService',
+    }
+}
 
 
 class RateTest(TestCase):
@@ -146,7 +304,7 @@ class RateTest(TestCase):
         rate = Rate.objects.find_rate(
             base_currency=self.base_currency,
             currency='AUD')
-        self.assertIsNotNone(rate.pk, msg="no pivot rate found")
+        self.assertIsNotNone(rate.value, msg="no pivot rate found")
 
     def test_custom_rate(self):
         """
@@ -761,11 +919,64 @@ class RateAPITest(TestCase):
         )
         self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(
-            len(post_response.json()),
-            (datetime.date(
+            post_response.json()['inserted'],
+            2 * ((datetime.date(
                 year=2020,
                 month=9,
-                day=1) - datetime.date(year=2020, month=1, day=1)).days + 1)
+                day=1) - datetime.date(year=2020, month=1, day=1)).days + 1))
+
+    def test_bulk_create_details_request(self):
+        """
+        Test of bulk creation with details
+        """
+        client = APIClient()
+        token = Token.objects.get(user__username=self.user.username)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        post_response = client.post(
+            '/rates/bulk/?details=true',
+            data={
+                'key': self.key,
+                'currency': 'USD',
+                'base_currency': 'EUR',
+                'from_date': '2020-01-01',
+                'to_date': '2020-01-10',
+                'value': 1.10
+            }
+        )
+        self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(post_response.json()), 10)
+
+    def test_bulk_create_many_request(self):
+        """
+        Test of bulk creation of several ranges
+        """
+        client = APIClient()
+        token = Token.objects.get(user__username=self.user.username)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        data = [
+            {
+                'key': str(self.key),
+                'currency': currency,
+                'base_currency': 'EUR',
+                'from_date': '2020-01-01',
+                'to_date': '2020-01-10',
+                'value': 1.10
+            }
+            for currency in ['USD', 'JPY']
+        ]
+        post_response = client.post('/rates/bulk/', data=data, format='json')
+        self.assertEqual(post_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(post_response.json()['inserted'], 40)
+        data[0]['value'] = 1.2
+        post_response = client.post('/rates/bulk/', data=data, format='json')
+        self.assertEqual(
+            post_response.json(),
+            {'inserted': 0, 'updated': 20, 'unchanged': 20, 'conflicts': 0})
+        self.assertAlmostEqual(
+            Rate.objects.get(
+                key=self.key, currency='EUR', base_currency='USD',
+                value_date='2020-01-01').value,
+            1 / 1.2)
 
     def test_latest_currency_request(self):
         """
@@ -874,8 +1085,8 @@ class RateConverterTest(TestCase):
         self.assertEqual(errors, [])
         self.assertEqual(self.converter.status,
                          self.converter.INSERTING_STATUS)
-        self.assertIsNotNone(self.converter.cached_currencies)
         self.assertIsNotNone(cache.get(self.converter.id))
+        self.assertNotIn('cached_currencies', self.converter.__dict__)
 
     def test_trash_amounts(self):
         """
@@ -1082,3 +1293,1857 @@ class RateConverterAPITest(TestCase):
         self.assertEqual(response.json().get('status'),
                          RateConverter.INSERTING_STATUS)
         self.assertEqual(response.json().get('id'), str(batch_id))
+
+
+class RateGraphCacheTest(TestCase):
+    """
+    Test cache of rate graphs
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        rate_graph_cache.clear()
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        Rate.objects.create(
+            currency='USD',
+            base_currency='EUR',
+            value=1.2,
+            value_date=self.value_date
+        )
+
+    def test_lru_eviction(self):
+        """
+        Test least recently used entries are evicted first
+        """
+        lru = LRUCache(max_size=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(lru.keys(), ['a', 'c'])
+        self.assertIsNone(lru.get('b'))
+
+    def test_scope_is_abstract(self):
+        """
+        Test scoped caches must define the scope of their entries
+        """
+        self.assertRaises(TypeError, ScopedLRUCache)
+
+    def test_scope_index(self):
+        """
+        Test scopes are invalidated without scanning the cache,
+        evicted entries leaving the index of scopes
+        """
+        index = RateAsOfIndex(max_size=3)
+        for key in [(None, 'EUR', 'USD'), ('key', 'USD', 'EUR'),
+                    (None, 'EUR', 'GBP'), (None, 'GBP', 'JPY')]:
+            index.set(key, key)
+        self.assertNotIn((None, 'EUR', 'USD'), index)
+        self.assertEqual(index._scopes[frozenset(['EUR', 'USD'])],
+                         {('key', 'USD', 'EUR')})
+        with mock.patch.object(index, 'keys') as keys:
+            index.invalidate(currency='USD', base_currency='EUR')
+        keys.assert_not_called()
+        self.assertEqual(index.keys(),
+                         [(None, 'EUR', 'GBP'), (None, 'GBP', 'JPY')])
+        self.assertNotIn(frozenset(['EUR', 'USD']), index._scopes)
+
+    def test_graph_is_cached(self):
+        """
+        Test graph is only built once for a date
+        """
+        Rate.objects.currency_shortest_path(
+            currency='USD', base_currency='EUR', date_obj=self.value_date)
+        with self.assertNumQueries(0):
+            path = Rate.objects.currency_shortest_path(
+                currency='EUR', base_currency='USD',
+                date_obj=self.value_date.isoformat())
+        self.assertEqual(path, ['EUR', 'USD'])
+
+    def test_graph_invalidation(self):
+        """
+        Test graph is rebuilt when a rate of the same date is saved
+        """
+        self.assertRaises(
+            NoRateFound,
+            Rate.objects.currency_shortest_path,
+            currency='JPY',
+            base_currency='EUR',
+            date_obj=self.value_date
+        )
+        Rate.objects.create(
+            currency='JPY',
+            base_currency='USD',
+            value=110,
+            value_date=self.value_date
+        )
+        path = Rate.objects.currency_shortest_path(
+            currency='JPY', base_currency='EUR', date_obj=self.value_date)
+        self.assertEqual(path, ['JPY', 'USD', 'EUR'])
+
+    def test_bulk_invalidation(self):
+        """
+        Test graph is rebuilt after a bulk insert
+        """
+        Rate.objects.currency_shortest_path(
+            currency='USD', base_currency='EUR', date_obj=self.value_date)
+        Rate.objects.bulk_create([
+            Rate(currency='GBP', base_currency='EUR',
+                 value=0.9, value_date=self.value_date)
+        ])
+        path = Rate.objects.currency_shortest_path(
+            currency='GBP', base_currency='EUR', date_obj=self.value_date)
+        self.assertEqual(path, ['GBP', 'EUR'])
+
+
+class RateInvalidationBusTest(TestCase):
+    """
+    Test invalidation of caches of other processes
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        self.events = []
+        self.bus = RateInvalidationBus(channel='test')
+        self.bus.subscribe(self.events.append)
+
+    def test_local_fallback(self):
+        """
+        Test events are handled in process without Redis cache
+        """
+        self.assertIsNone(self.bus.connection())
+        self.assertFalse(self.bus.start())
+        self.bus.publish([(self.value_date, None, 'USD', 'EUR')] * 2)
+        self.assertEqual(self.events,
+                         [[(self.value_date, None, 'USD', 'EUR')]])
+
+    def test_publish(self):
+        """
+        Test events are sent once the transaction is committed
+        """
+        connection = mock.Mock()
+        with mock.patch.object(self.bus, 'connection',
+                               return_value=connection):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.bus.publish([(self.value_date, 'key', 'USD', 'EUR')])
+                connection.publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+        channel, message = connection.publish.call_args[0]
+        self.assertEqual(channel, 'test')
+        # Handled again once committed
+        self.assertEqual(len(self.events), 2)
+        other = RateInvalidationBus(channel='test')
+        received = []
+        other.subscribe(received.append)
+        other.receive(message)
+        self.bus.receive(message)
+        self.assertEqual(received, [[(self.value_date, 'key', 'USD', 'EUR')]])
+        self.assertEqual(len(self.events), 2)
+
+    def test_serve(self):
+        """
+        Test listening starts with the first request, and subscribing
+        again after errors is delayed more and more
+        """
+        with mock.patch.object(self.bus, 'start') as start:
+            self.bus.serve()
+            self.bus.serve()
+        start.assert_called_once_with()
+        connection = mock.Mock()
+        connection.pubsub.side_effect = ConnectionError('down')
+        with mock.patch.object(self.bus, 'connection',
+                               return_value=connection), \
+                mock.patch('geocurrency.rates.bus.time.sleep',
+                           side_effect=[None] * 8 + [SystemExit]) as sleep:
+            with self.assertRaises(SystemExit):
+                self.bus._listen()
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],
+                         [1, 2, 4, 8, 16, 32, 60, 60, 60])
+
+    def test_evict(self):
+        """
+        Test caches are dropped by events of other processes
+        """
+        rate_graph_cache.clear()
+        Rate.objects.create(currency='USD', base_currency='EUR',
+                            value=1.2, value_date=self.value_date)
+        Rate.objects.currency_shortest_path(
+            currency='USD', base_currency='EUR', date_obj=self.value_date)
+        self.assertIn((self.value_date, None), rate_graph_cache)
+        other = RateInvalidationBus(channel='test')
+        rate_invalidation_bus.receive(other.dumps(
+            [(self.value_date, None, 'USD', 'EUR')]))
+        self.assertNotIn((self.value_date, None), rate_graph_cache)
+
+
+class DerivedRateCacheTest(TestCase):
+    """
+    Test cache of rates derived from paths of rates
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        rate_graph_cache.clear()
+        derived_rates.clear()
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        Rate.objects.create(currency='USD', base_currency='EUR',
+                            value=1.2, value_date=self.value_date)
+        Rate.objects.create(currency='JPY', base_currency='USD',
+                            value=110, value_date=self.value_date)
+
+    def test_not_stored(self):
+        """
+        Test derived rates are cached instead of stored
+        """
+        count = Rate.objects.count()
+        rate = Rate.objects.find_rate(
+            currency='JPY', base_currency='EUR', date_obj=self.value_date)
+        self.assertAlmostEqual(rate.value, 132)
+        self.assertIsNone(rate.pk)
+        self.assertEqual(Rate.objects.count(), count)
+        with self.assertNumQueries(0):
+            rate = Rate.objects.find_rate(
+                currency='JPY', base_currency='EUR',
+                date_obj=self.value_date)
+        self.assertAlmostEqual(rate.value, 132)
+
+    def test_leg_invalidation(self):
+        """
+        Test derived rates are invalidated when a rate of their path changes
+        """
+        Rate.objects.find_rate(
+            currency='JPY', base_currency='EUR', date_obj=self.value_date)
+        self.assertEqual(len(derived_rates), 1)
+        Rate.objects.create(currency='GBP', base_currency='EUR',
+                            value=0.9, value_date=self.value_date)
+        self.assertEqual(len(derived_rates), 1)
+        rate = Rate.objects.get(currency='USD', base_currency='EUR')
+        rate.value = 1.1
+        rate.save()
+        self.assertEqual(len(derived_rates), 0)
+        rate = Rate.objects.find_rate(
+            currency='JPY', base_currency='EUR', date_obj=self.value_date)
+        self.assertAlmostEqual(rate.value, 121)
+
+    def test_expiration(self):
+        """
+        Test derived rates expire and stale computations are not cached
+        """
+        cache_key = (None, 'EUR', 'JPY', self.value_date)
+        derived = DerivedRateCache(max_size=10, ttl=0)
+        derived.add(cache_key, 132, ['JPY', 'USD', 'EUR'], derived.generation)
+        self.assertIsNone(derived.value(cache_key))
+        derived = DerivedRateCache(max_size=10, ttl=60)
+        generation = derived.generation
+        derived.invalidate('USD', 'EUR', self.value_date)
+        derived.add(cache_key, 132, ['JPY', 'USD', 'EUR'], generation)
+        self.assertIsNone(derived.value(cache_key))
+
+
+class RateResolutionTest(TestCase):
+    """
+    Test batch resolution of rates
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        rate_graph_cache.clear()
+        converter_rates.clear()
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        for currency, base_currency, value in [
+                ('USD', 'EUR', 1.2),
+                ('JPY', 'USD', 100),
+                ('AUD', 'EUR', 1.5)]:
+            Rate.objects.create(
+                currency=currency,
+                base_currency=base_currency,
+                value=value,
+                value_date=self.value_date
+            )
+
+    def test_resolve_rates(self):
+        """
+        Test rates are resolved from a single graph
+        """
+        Rate.objects.rate_graph(date_obj=self.value_date)
+        with self.assertNumQueries(0):
+            rates = Rate.objects.resolve_rates(
+                currencies=['USD', 'JPY', 'AUD', 'EUR'],
+                base_currency='EUR',
+                date_obj=self.value_date,
+                use_forex=False)
+        self.assertEqual(rates['EUR'], 1)
+        self.assertEqual(rates['USD'], 1.2)
+        self.assertAlmostEqual(rates['JPY'], 120)
+        self.assertAlmostEqual(rates['AUD'], 1.5)
+
+    def test_resolve_inverse_rates(self):
+        """
+        Test rates are resolved in both directions
+        """
+        rates = Rate.objects.resolve_rates(
+            currencies=['EUR', 'AUD'],
+            base_currency='JPY',
+            date_obj=self.value_date,
+            use_forex=False)
+        self.assertAlmostEqual(rates['EUR'], 1 / 120)
+        self.assertAlmostEqual(rates['AUD'], 1.5 / 120)
+
+    def test_resolve_missing_rates(self):
+        """
+        Test missing rates are left out
+        """
+        rates = Rate.objects.resolve_rates(
+            currencies=['USD', 'GBP'],
+            base_currency='EUR',
+            date_obj=self.value_date,
+            use_forex=False)
+        self.assertNotIn('GBP', rates)
+
+    def test_converter_cache(self):
+        """
+        Test converter resolves rates of its data per date
+        """
+        user, created = User.objects.get_or_create(
+            username='test',
+            email='test@ipd.com'
+        )
+        converter = RateConverter(user=user, base_currency='EUR')
+        converter.add_data([
+            {
+                'currency': 'JPY',
+                'amount': 1200,
+                'date_obj': '2021-01-01'
+            },
+        ])
+        rates = converter_rates.rates(
+            key=None, base_currency='EUR', currencies=['JPY'],
+            date_obj=self.value_date)
+        self.assertAlmostEqual(rates['JPY'], 120)
+        with self.assertNumQueries(0):
+            self.assertAlmostEqual(converter.rates(
+                date_obj=self.value_date, currencies={'JPY'})['JPY'], 120)
+
+    def test_convert_columns(self):
+        """
+        Test conversion of amounts with missing rates
+        """
+        user, created = User.objects.get_or_create(
+            username='test',
+            email='test@ipd.com'
+        )
+        converter = RateConverter(user=user, base_currency='EUR')
+        converter.data = [
+            Amount(currency='JPY', amount=1200, date_obj=self.value_date),
+            Amount(currency='USD', amount=12, date_obj=self.value_date),
+            Amount(currency='JPY', amount=240, date_obj=self.value_date),
+        ]
+        converter_rates.add(
+            key=None, base_currency='EUR', rates={'JPY': 120},
+            date_obj=self.value_date,
+            generation=converter_rates.generation(self.value_date))
+        with mock.patch.object(Rate.objects, 'resolve_rates',
+                               return_value={}):
+            result = converter.convert()
+        self.assertEqual(converter.status, converter.WITH_ERRORS)
+        self.assertAlmostEqual(result.sum, 12)
+        self.assertEqual([d.converted_value for d in result.detail],
+                         [10, 2])
+        self.assertEqual(len(result.errors), 1)
+        self.assertEqual(result.errors[0].unit, 'USD')
+        with mock.patch.object(Rate.objects, 'resolve_rates',
+                               return_value={}):
+            result = converter.convert(details=False)
+        self.assertAlmostEqual(result.sum, 12)
+        self.assertEqual(result.detail, [])
+
+    def test_converter_rate_cache(self):
+        """
+        Test rates of converters are bounded, invalidated and expire
+        """
+        rates = ConverterRateCache(max_size=2, today_ttl=0)
+        rates.add(key=None, base_currency='EUR',
+                  rates={'JPY': 120, 'USD': 1.2, 'AUD': 1.5},
+                  date_obj=self.value_date,
+                  generation=rates.generation(self.value_date))
+        self.assertEqual(len(rates), 2)
+        self.assertEqual(
+            rates.rates(key=None, base_currency='EUR',
+                        currencies=['JPY', 'USD', 'AUD'],
+                        date_obj=self.value_date),
+            {'USD': 1.2, 'AUD': 1.5})
+        self.assertEqual(rates.rates(
+            key='other', base_currency='EUR', currencies=['USD'],
+            date_obj=self.value_date), {})
+        rates.invalidate(self.value_date)
+        self.assertEqual(len(rates), 0)
+        rates.add(key=None, base_currency='EUR', rates={'USD': 1.2},
+                  date_obj=datetime.date.today(),
+                  generation=rates.generation(datetime.date.today()))
+        self.assertEqual(rates.rates(
+            key=None, base_currency='EUR', currencies=['USD'],
+            date_obj=datetime.date.today()), {})
+
+    def test_rate_invalidation(self):
+        """
+        Test rates of converters are invalidated when rates are written
+        """
+        converter = RateConverter(user=None, base_currency='EUR')
+        converter.rates(date_obj=self.value_date, currencies={'USD'})
+        rate = Rate.objects.get(currency='USD', base_currency='EUR')
+        rate.value = 1.1
+        rate.save()
+        self.assertAlmostEqual(converter.rates(
+            date_obj=self.value_date, currencies={'USD'})['USD'], 1.1)
+
+
+class RateBulkSyncTest(TestCase):
+    """
+    Test bulk upsert of rates
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        self.rates = [
+            {
+                'base_currency': 'EUR',
+                'currency': currency,
+                'date': self.value_date,
+                'value': value
+            }
+            for currency, value in [('USD', 1.25), ('JPY', 125)]
+        ]
+
+    def test_bulk_sync(self):
+        """
+        Test rates and their inverses are inserted
+        """
+        counts = Rate.objects.bulk_sync_rates(self.rates)
+        self.assertEqual(
+            counts,
+            {'inserted': 4, 'updated': 0, 'unchanged': 0, 'conflicts': 0})
+        self.assertEqual(
+            Rate.objects.get(currency='EUR', base_currency='USD').value,
+            0.8)
+
+    def test_bulk_resync(self):
+        """
+        Test only changed rates are updated
+        """
+        Rate.objects.bulk_sync_rates(self.rates)
+        self.rates[0]['value'] = 1.3
+        # select, update, delete of the rate matrices of the date,
+        # then select, delete and insert of the rollups of the rate,
+        # then select and update of the latest rate
+        with self.assertNumQueries(15):
+            counts = Rate.objects.bulk_sync_rates(self.rates)
+        self.assertEqual(
+            counts,
+            {'inserted': 0, 'updated': 1, 'unchanged': 3, 'conflicts': 0})
+        self.assertEqual(
+            Rate.objects.get(currency='USD', base_currency='EUR').value,
+            1.3)
+
+    def test_bulk_sync_conflicts(self):
+        """
+        Test rates of a key used by another user are reported
+        and not overwritten
+        """
+        owner = User.objects.create(username='owner')
+        other = User.objects.create(username='other')
+        Rate.objects.bulk_sync_rates(self.rates, user=owner, key='shared')
+        self.rates[0]['value'] = 1.3
+        counts = Rate.objects.bulk_sync_rates(
+            self.rates, user=other, key='shared')
+        self.assertEqual(
+            counts,
+            {'inserted': 0, 'updated': 0, 'unchanged': 0, 'conflicts': 4})
+        rate = Rate.objects.get(
+            key='shared', currency='USD', base_currency='EUR')
+        self.assertEqual((rate.user, rate.value), (owner, 1.25))
+        counts = Rate.objects.bulk_sync_rates(self.rates, user=other)
+        self.assertEqual(counts['inserted'], 4)
+
+    def test_bulk_sync_batches(self):
+        """
+        Test rates are written by batches
+        """
+        counts = Rate.objects.bulk_sync_rates(self.rates, batch_size=1)
+        self.assertEqual(counts['inserted'], 4)
+        self.assertEqual(Rate.objects.count(), 4)
+
+    def test_fetch_chunks(self):
+        """
+        Test rates iterated from a rate service are written by chunks
+        """
+        rate_service = mock.Mock()
+        rate_service.fetch_rates.return_value = iter(self.rates)
+        with mock.patch('geocurrency.rates.models.service',
+                        return_value=rate_service), \
+                mock.patch.object(Rate.objects, 'bulk_sync_rates',
+                                  wraps=Rate.objects.bulk_sync_rates) as sync, \
+                override_settings(RATE_FETCH_CHUNK_SIZE=1):
+            counts = Rate.objects.fetch_rates(
+                base_currency='EUR', rate_service='chunked',
+                date_obj=self.value_date,
+                to_obj=self.value_date + datetime.timedelta(1), bulk=True)
+        self.assertEqual(sync.call_count, 2)
+        self.assertEqual(counts['inserted'], 4)
+
+
+class RateAsOfTest(TestCase):
+    """
+    Test last known rate lookups
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.friday = datetime.date(year=2021, month=1, day=1)
+        self.monday = datetime.date(year=2021, month=1, day=4)
+        for currency, base_currency, value in [
+                ('USD', 'EUR', 1.2),
+                ('JPY', 'EUR', 125)]:
+            Rate.objects.create(
+                currency=currency,
+                base_currency=base_currency,
+                value=value,
+                value_date=self.friday - datetime.timedelta(1)
+            )
+            Rate.objects.create(
+                currency=currency,
+                base_currency=base_currency,
+                value=value * 2,
+                value_date=self.friday
+            )
+
+    def test_rate_as_of(self):
+        """
+        Test last known rate is used
+        """
+        rate = Rate.objects.rate_as_of(
+            currency='USD', base_currency='EUR', date_obj=self.monday)
+        self.assertEqual(rate.value, 2.4)
+        self.assertEqual(rate.value_date, self.friday)
+        with self.assertNumQueries(0):
+            rate = Rate.objects.rate_as_of(
+                currency='EUR', base_currency='USD', date_obj=self.monday)
+        self.assertAlmostEqual(rate.value, 1 / 2.4)
+
+    def test_rate_as_of_pivot(self):
+        """
+        Test last known rate through the pivot currency
+        """
+        rate = Rate.objects.rate_as_of(
+            currency='JPY', base_currency='USD', date_obj=self.monday)
+        self.assertAlmostEqual(rate.value, 250 / 2.4)
+
+    def test_rate_as_of_staleness(self):
+        """
+        Test rates older than the maximum staleness are ignored
+        """
+        rate = Rate.objects.rate_as_of(
+            currency='USD', base_currency='EUR', date_obj=self.monday,
+            max_staleness=2)
+        self.assertFalse(rate.value)
+        rate = Rate.objects.rate_as_of(
+            currency='USD', base_currency='EUR',
+            date_obj=self.friday - datetime.timedelta(7))
+        self.assertFalse(rate.value)
+
+    def test_rate_as_of_invalidation(self):
+        """
+        Test series are refreshed when a rate is written
+        """
+        Rate.objects.rate_as_of(
+            currency='USD', base_currency='EUR', date_obj=self.monday)
+        Rate.objects.create(
+            currency='USD',
+            base_currency='EUR',
+            value=1.5,
+            value_date=self.monday
+        )
+        rate = Rate.objects.rate_as_of(
+            currency='USD', base_currency='EUR', date_obj=self.monday)
+        self.assertEqual(rate.value, 1.5)
+
+    def test_convert_as_of(self):
+        """
+        Test conversion with last known rates
+        """
+        result = Rate.convert(
+            currency='USD', base_currency='EUR', date_obj=self.monday,
+            amount=24, as_of=True)
+        self.assertEqual(result.errors, [])
+        self.assertAlmostEqual(result.sum, 10)
+
+
+@override_settings(SERVICES=TEST_SERVICES, RATE_SERVICE='failing')
+class RateFetchFailureTest(TestCase):
+    """
+    Test cache of failed fetches
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        rate_fetch_failures.clear()
+        FailingRateService.calls = 0
+
+    def test_failure_cached(self):
+        """
+        Test failed fetches are not repeated
+        """
+        for i in range(3):
+            self.assertFalse(Rate.objects.fetch_rates(
+                base_currency='EUR', currency='XXX',
+                rate_service='failing',
+                date_obj=datetime.date(year=2021, month=1, day=1)))
+        self.assertEqual(FailingRateService.calls, 1)
+        self.assertEqual(
+            Rate.objects.fetch_failures_stats(),
+            {'hits': 2, 'misses': 1, 'size': 1})
+
+    def test_find_rate_failure(self):
+        """
+        Test find_rate fails fast on a recently failed fetch
+        """
+        for i in range(3):
+            rate = Rate.objects.find_rate(
+                currency='XXX', base_currency='EUR',
+                rate_service='failing',
+                date_obj=datetime.date(year=2021, month=1, day=1))
+            self.assertIsNone(rate.pk)
+        self.assertEqual(FailingRateService.calls, 1)
+
+    def test_failure_expires(self):
+        """
+        Test failures expire
+        """
+        rate_fetch_failures.ttl = 0
+        try:
+            for i in range(2):
+                Rate.objects.fetch_rates(
+                    base_currency='EUR', currency='XXX',
+                    rate_service='failing')
+        finally:
+            rate_fetch_failures.ttl = 3600
+        self.assertEqual(FailingRateService.calls, 2)
+
+
+@override_settings(SERVICES=TEST_SERVICES, RATE_SERVICE='failing')
+class RateSingleFlightTest(TestCase):
+    """
+    Test coalescing of concurrent fetches
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        rate_fetch_failures.clear()
+        FailingRateService.calls = 0
+        cache.clear()
+
+    @staticmethod
+    def run_threads(target, count: int = 5):
+        """
+        Run a function in concurrent threads
+        :param target: function to run
+        :param count: number of threads
+        """
+        threads = [threading.Thread(target=target) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_single_flight(self):
+        """
+        Test concurrent calls with the same key run once
+        """
+        flight = SingleFlight(prefix='test')
+        calls = []
+        results = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return 42
+
+        self.run_threads(lambda: results.append(flight.do('key', slow)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [42] * 5)
+        self.assertEqual(flight.do('key', lambda: 43), 43)
+
+    def test_single_flight_error(self):
+        """
+        Test waiting callers get the error of the call
+        """
+        flight = SingleFlight(prefix='test')
+        errors = []
+
+        def failing():
+            time.sleep(0.2)
+            raise ValueError
+
+        def target():
+            try:
+                flight.do('key', failing)
+            except ValueError as e:
+                errors.append(e)
+
+        self.run_threads(target)
+        self.assertEqual(len(errors), 5)
+
+    def test_single_flight_across_processes(self):
+        """
+        Test a call waits for the result of another process
+        """
+        flight = SingleFlight(prefix='test', poll_interval=0.01)
+        # Simulate a lock then a result stored by another process
+        digest = hashlib.md5(b"'key'").hexdigest()
+        cache.set(f'test:{digest}:lock', 'other', 30)
+        timer = threading.Timer(
+            0.1, cache.set, args=(f'test:{digest}:result', ('other', 42)))
+        timer.start()
+        self.assertEqual(flight.do('key', lambda: 43), 42)
+        timer.join()
+
+    def test_concurrent_fetches(self):
+        """
+        Test concurrent fetches of the same rates call the service once
+        """
+        results = []
+
+        def target():
+            results.append(Rate.objects.fetch_rates(
+                base_currency='EUR', currency='XXX',
+                rate_service='slow',
+                date_obj=datetime.date(year=2021, month=1, day=1)))
+
+        self.run_threads(target)
+        self.assertEqual(FailingRateService.calls, 1)
+        self.assertEqual(results, [False] * 5)
+
+
+@override_settings(SERVICES=TEST_SERVICES)
+class FetchRatesCommandTest(TestCase):
+    """
+    Test fetch_rates command
+    """
+
+    def test_concurrent_fetch(self):
+        """
+        Test fetching rates with many workers
+        """
+        out = io.StringIO()
+        call_command('fetch_rates', service='static', workers=4,
+                     from_date='2021-01-01', to_date='2021-01-01',
+                     stdout=out)
+        count = len(Currency.all_currencies()) - 1
+        self.assertEqual(
+            Rate.objects.filter(
+                value_date=datetime.date(year=2021, month=1, day=1)).count(),
+            2 * count)
+        self.assertIn(f'{2 * count} inserted, 0 updated', out.getvalue())
+        self.assertIn('rates/s', out.getvalue())
+
+    def test_no_available_currencies(self):
+        """
+        Test currencies are not filtered by an empty list
+        of available currencies, which is not cached
+        """
+        PivotRateService.calls = 0
+        cache.clear()
+        err = io.StringIO()
+        with mock.patch.object(PivotRateService, 'available_currencies',
+                               return_value=[]) as available:
+            call_command('fetch_rates', service='pivot', workers=2,
+                         from_date='2021-01-01', to_date='2021-01-01',
+                         stdout=io.StringIO(), stderr=err)
+            PivotRateService().cached_available_currencies()
+        self.assertIn('no available currencies from pivot', err.getvalue())
+        self.assertEqual(PivotRateService.calls,
+                         len(Currency.all_currencies()))
+        self.assertEqual(available.call_count, 2)
+
+    def test_single_base(self):
+        """
+        Test deriving rates from a pivot currency
+        """
+        PivotRateService.calls = 0
+        cache.clear()
+        out = io.StringIO()
+        call_command('fetch_rates', service='pivot', mode='single-base',
+                     pivot='EUR', from_date='2021-01-01',
+                     to_date='2021-01-02', stdout=out)
+        self.assertEqual(PivotRateService.calls, 1)
+        self.assertEqual(Rate.objects.count(), 2 * 4 * 3)
+        rate = Rate.objects.get(
+            currency='USD', base_currency='GBP',
+            value_date=datetime.date(year=2021, month=1, day=2))
+        self.assertAlmostEqual(rate.value, 1.2 / 0.9)
+        self.assertIn('24 inserted', out.getvalue())
+
+    def test_incremental(self):
+        """
+        Test only missing dates are fetched
+        """
+        PivotRateService.calls = 0
+        cache.clear()
+        options = {'service': 'pivot', 'mode': 'single-base',
+                   'incremental': True, 'from_date': '2021-01-01',
+                   'to_date': '2021-01-03', 'stdout': io.StringIO()}
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            call_command('fetch_rates', state_file=state_file, **options)
+            self.assertEqual(PivotRateService.calls, 1)
+            self.assertEqual(Rate.objects.count(), 3 * 4 * 3)
+            with open(state_file) as f:
+                self.assertEqual(json.load(f),
+                                 {'pivot': {'EUR': [['2021-01-01',
+                                                     '2021-01-03']]}})
+            call_command('fetch_rates', state_file=state_file, **options)
+            self.assertEqual(PivotRateService.calls, 1)
+            Rate.objects.filter(
+                value_date=datetime.date(year=2021, month=1, day=2)).delete()
+            state_file = os.path.join(directory, 'new_state.json')
+            call_command('fetch_rates', state_file=state_file, **options)
+            self.assertEqual(PivotRateService.calls, 2)
+            self.assertEqual(Rate.objects.count(), 3 * 4 * 3)
+            with open(state_file) as f:
+                self.assertEqual(json.load(f),
+                                 {'pivot': {'EUR': [['2021-01-02',
+                                                     '2021-01-02']]}})
+
+    def test_incremental_bases(self):
+        """
+        Test inverse rates do not count as fetched rates of their base
+        """
+        cache.clear()
+        value_date = datetime.date(year=2021, month=1, day=1)
+        options = {'service': 'multi', 'incremental': True,
+                   'from_date': '2021-01-01', 'to_date': '2021-01-01',
+                   'stdout': io.StringIO()}
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(MultiBaseRateService, 'bases', ['EUR']):
+            MultiBaseRateService.calls = []
+            call_command(
+                'fetch_rates',
+                state_file=os.path.join(directory, 'state.json'),
+                **options)
+            self.assertTrue(Rate.objects.filter(
+                base_currency='USD', currency='EUR').exists())
+            self.assertEqual(
+                Rate.objects.missing_dates(
+                    base_currencies=['EUR', 'USD', 'GBP'],
+                    date_obj=value_date, to_obj=value_date),
+                {'EUR': [], 'USD': [value_date], 'GBP': [value_date]})
+        rate_fetch_failures.clear()
+        MultiBaseRateService.calls = []
+        with tempfile.TemporaryDirectory() as directory:
+            call_command(
+                'fetch_rates',
+                state_file=os.path.join(directory, 'state.json'),
+                **options)
+        self.assertEqual(sorted(MultiBaseRateService.calls), ['GBP', 'USD'])
+        self.assertTrue(Rate.objects.filter(
+            base_currency='USD', currency='GBP').exists())
+
+    def test_unavailable_bases_skipped(self):
+        """
+        Test bases not available from the service are not fetched
+        """
+        PivotRateService.calls = 0
+        cache.clear()
+        call_command('fetch_rates', service='pivot', workers=2,
+                     from_date='2021-01-01', to_date='2021-01-01',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(PivotRateService.calls, 4)
+
+    def test_cross_rates(self):
+        """
+        Test cross rates of a pivot currency
+        """
+        rates = Rate.objects.cross_rates(
+            rates=[
+                {'base_currency': 'EUR', 'currency': 'USD',
+                 'date': '2021-01-01', 'value': 1.2},
+                {'base_currency': 'EUR', 'currency': 'CHF',
+                 'date': '2021-01-01', 'value': 1.1},
+                {'base_currency': 'EUR', 'currency': 'GBP',
+                 'date': '2021-01-01', 'value': 0.9},
+            ],
+            pivot='EUR',
+            currencies=['EUR', 'USD', 'GBP'])
+        self.assertEqual(len(rates), 6)
+        values = {(r['base_currency'], r['currency']): r['value']
+                  for r in rates}
+        self.assertAlmostEqual(values[('USD', 'EUR')], 1 / 1.2)
+        self.assertAlmostEqual(values[('GBP', 'USD')], 1.2 / 0.9)
+
+
+class RateServiceRangeTest(TestCase):
+    """
+    Test fetching ranges of dates from rate services
+    """
+
+    def test_date_chunks(self):
+        """
+        Test splitting a range of dates
+        """
+        chunks = list(RateService.date_chunks(
+            datetime.date(year=2020, month=1, day=1),
+            datetime.date(year=2020, month=12, day=31), 100))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[0][1],
+                         datetime.date(year=2020, month=4, day=9))
+        self.assertEqual(chunks[1][0],
+                         datetime.date(year=2020, month=4, day=10))
+        self.assertEqual(chunks[-1][1],
+                         datetime.date(year=2020, month=12, day=31))
+
+    def test_forex_range(self):
+        """
+        Test a range is fetched by chunks from the forex history
+        """
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'rates': {
+            '2021-01-04': {'USD': 1.2, 'GBP': 0.9},
+            '2021-01-05': {'USD': 1.21, 'GBP': 0.91},
+        }}
+        with mock.patch('requests.Session.get',
+                        return_value=response) as get, \
+                override_settings(FOREX_API_URL='https://example.com/api/'):
+            rates = ForexService().fetch_rates(
+                base_currency='EUR',
+                date_obj=datetime.date(year=2020, month=1, day=1),
+                to_obj=datetime.date(year=2021, month=1, day=5))
+            # Chunks are requested while rates are iterated
+            get.assert_not_called()
+            rates = list(rates)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(get.call_args[0][0],
+                         'https://example.com/api/history')
+        self.assertEqual(len(rates), 8)
+        self.assertEqual(rates[0]['date'],
+                         datetime.date(year=2021, month=1, day=4))
+
+    def test_forex_range_fallback(self):
+        """
+        Test ranges are fetched day by day only if the history
+        is not supported, errors of the source being raised
+        """
+        unsupported = mock.Mock(status_code=404, text='not found')
+        day = mock.Mock(status_code=200)
+        day.json.return_value = {'rates': {'USD': 1.2}}
+        with mock.patch('requests.Session.get',
+                        side_effect=[unsupported, day, day]) as get:
+            rates = list(ForexService().fetch_rates(
+                base_currency='EUR',
+                date_obj=datetime.date(year=2021, month=1, day=4),
+                to_obj=datetime.date(year=2021, month=1, day=5)))
+        self.assertEqual(get.call_count, 3)
+        self.assertEqual(len(rates), 2)
+        failing = mock.Mock(status_code=503, text='unavailable')
+        with mock.patch('requests.Session.get',
+                        return_value=failing) as get:
+            with self.assertRaises(RatesNotAvailableError):
+                list(ForexService().fetch_rates(
+                    base_currency='EUR',
+                    date_obj=datetime.date(year=2021, month=1, day=4),
+                    to_obj=datetime.date(year=2021, month=1, day=5)))
+        self.assertFalse(any(
+            not call[0][0].endswith('history')
+            for call in get.call_args_list))
+
+    def test_currencylayer_timeframe(self):
+        """
+        Test parsing of a timeframe response
+        """
+        rates = list(CurrencyLayerService().parse_result(
+            base_currency='USD',
+            data={
+                'timeframe': True,
+                'source': 'USD',
+                'quotes': {
+                    '2021-01-04': {'USDEUR': 0.81, 'USDGBP': 0.73},
+                    '2021-01-05': {'USDEUR': 0.82, 'USDGBP': 0.74},
+                }
+            }))
+        self.assertEqual(len(rates), 4)
+        self.assertEqual(rates[-1], {
+            'base_currency': 'USD', 'currency': 'GBP',
+            'date': datetime.date(year=2021, month=1, day=5), 'value': 0.74})
+
+    def test_currencylayer_errors(self):
+        """
+        Test request errors and invalid responses of currencylayer
+        raise RatesNotAvailableError
+        """
+        invalid = mock.Mock(status_code=200)
+        invalid.json.side_effect = ValueError('invalid JSON')
+        for kwargs in [{'side_effect': requests.ConnectionError('down')},
+                       {'return_value': invalid}]:
+            with mock.patch('requests.Session.get', **kwargs):
+                with self.assertRaises(RatesNotAvailableError):
+                    CurrencyLayerService().fetch_rates(
+                        base_currency='USD',
+                        date_obj=datetime.date(year=2021, month=1, day=4))
+                with self.assertRaises(RatesNotAvailableError):
+                    CurrencyLayerService().available_currencies()
+        malformed = mock.Mock(status_code=200)
+        malformed.json.return_value = {
+            'timeframe': True, 'quotes': {'2021-13-01': {'USDEUR': 0.8}}}
+        with mock.patch('requests.Session.get', return_value=malformed):
+            with self.assertRaises(RatesNotAvailableError):
+                CurrencyLayerService().fetch_rates(
+                    base_currency='USD',
+                    date_obj=datetime.date(year=2021, month=1, day=4),
+                    to_obj=datetime.date(year=2021, month=1, day=5))
+        with self.assertRaises(RatesNotAvailableError):
+            list(CurrencyLayerService().parse_result(
+                base_currency='USD', data={'date': '2021-01-04'}))
+
+    def test_forex_counters(self):
+        """
+        Test requests of the forex service are counted
+        """
+        http_client.reset_stats()
+        response = mock.Mock(status_code=500, text='error')
+        with mock.patch('requests.Session.get', return_value=response):
+            with self.assertRaises(RatesNotAvailableError):
+                ForexService().fetch_rates(
+                    base_currency='EUR', currency='USD',
+                    date_obj=datetime.date(year=2021, month=1, day=4))
+        stats = http_client.stats()['forex']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['errors'], 1)
+
+
+class HttpClientTest(TestCase):
+    """
+    Test shared HTTP client
+    """
+
+    def test_sessions(self):
+        """
+        Test a session is kept per host
+        """
+        client = HttpClient(retries=2)
+        session = client.session('https://example.com/a')
+        self.assertIs(client.session('https://example.com/b?c=d'), session)
+        self.assertIsNot(client.session('https://example.org/a'), session)
+        adapter = session.get_adapter('https://example.com/a')
+        self.assertEqual(adapter.max_retries.total, 2)
+
+    def test_stats(self):
+        """
+        Test latency and errors are counted per service
+        """
+        client = HttpClient(timeout=5)
+        responses = [mock.Mock(status_code=200), mock.Mock(status_code=404)]
+        with mock.patch('requests.Session.get',
+                        side_effect=responses) as get:
+            client.get('https://example.com/a', service='test')
+            client.get('https://example.com/b', service='test')
+        self.assertEqual(get.call_args[1]['timeout'], 5)
+        stats = client.stats()['test']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertGreaterEqual(stats['latency_max'], stats['latency_mean'])
+
+
+@override_settings(SERVICES=TEST_SERVICES)
+class HedgedRateServiceTest(TestCase):
+    """
+    Test hedged rate service
+    """
+
+    def test_hedge(self):
+        """
+        Test rates of the second service are used if the first is slow
+        """
+        hedged = HedgedRateService(
+            services=['sleepy', 'static'], hedge_delay=0.05)
+        start = time.monotonic()
+        rates = hedged.fetch_rates(base_currency='USD')
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(len(rates), 1)
+        time.sleep(0.6)
+        self.assertEqual(hedged.ranked_services(), ['static', 'sleepy'])
+
+    def test_failover(self):
+        """
+        Test next service is queried at once when a service fails
+        """
+        hedged = HedgedRateService(
+            services=['failing', 'static'], hedge_delay=10)
+        start = time.monotonic()
+        rates = hedged.fetch_rates(base_currency='USD')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(rates), 1)
+        self.assertEqual(hedged.ranked_services(), ['static', 'failing'])
+
+    def test_no_rates(self):
+        """
+        Test error when no service has rates
+        """
+        hedged = HedgedRateService(
+            services=['failing', 'static'], hedge_delay=0.05)
+        with self.assertRaises(RatesNotAvailableError):
+            hedged.fetch_rates(base_currency='EUR')
+
+
+class FileRateServiceTest(TestCase):
+    """
+    Test loading rates from files
+    """
+    ecb_xml = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01"
+    xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">
+    <gesmes:subject>Reference rates</gesmes:subject>
+    <Cube>
+        <Cube time="2021-01-05">
+            <Cube currency="USD" rate="1.2271"/>
+            <Cube currency="JPY" rate="126.62"/>
+        </Cube>
+        <Cube time="2021-01-04">
+            <Cube currency="USD" rate="1.2296"/>
+            <Cube currency="JPY" rate="126.82"/>
+        </Cube>
+    </Cube>
+</gesmes:Envelope>"""
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        """
+        Clean test environment
+        """
+        self.directory.cleanup()
+
+    def write(self, name: str, content: bytes) -> str:
+        """
+        Write a file in the test directory
+        :param name: name of the file
+        :param content: content of the file
+        """
+        path = os.path.join(self.directory.name, name)
+        with (gzip.open if name.endswith('.gz') else open)(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_ecb_xml(self):
+        """
+        Test streaming rates from a gzipped ECB XML file
+        """
+        rates = list(FileRateService(
+            path=self.write('eurofxref.xml.gz', self.ecb_xml)).iter_rates())
+        self.assertEqual(len(rates), 4)
+        self.assertEqual(rates[0], {
+            'base_currency': 'EUR', 'currency': 'USD',
+            'date': datetime.date(year=2021, month=1, day=5),
+            'value': 1.2271})
+
+    def test_csv(self):
+        """
+        Test reading rates from CSV files
+        """
+        path = self.write('rates.csv', b"""date,base_currency,currency,value
+2021-01-04,EUR,USD,1.2296
+2021-01-04,USD,JPY,103.1
+""")
+        self.assertEqual(len(list(FileRateService(path=path).iter_rates())),
+                         2)
+        path = self.write('ecb.csv', b"""Date,USD,JPY,CYP,
+2021-01-05,1.2271,126.62,N/A,
+2021-01-04,1.2296,126.82,N/A,
+""")
+        rates = FileRateService(path=path).fetch_rates(
+            base_currency='EUR', currency='USD',
+            date_obj=datetime.date(year=2021, month=1, day=5))
+        self.assertEqual(len(rates), 1)
+        self.assertEqual(rates[0]['value'], 1.2271)
+
+    def test_load_rates(self):
+        """
+        Test loading a file in the database
+        """
+        out = io.StringIO()
+        call_command('load_rates', self.write('eurofxref.xml', self.ecb_xml),
+                     chunk_size=3, stdout=out)
+        self.assertEqual(Rate.objects.count(), 8)
+        self.assertIn('8 inserted, 0 updated, 0 unchanged, '
+                      '0 owned by another user.', out.getvalue())
+        rate = Rate.objects.get(
+            currency='EUR', base_currency='JPY',
+            value_date=datetime.date(year=2021, month=1, day=4))
+        self.assertAlmostEqual(rate.value, 1 / 126.82)
+
+
+class RateMatrixTest(TestCase):
+    """
+    Test materialized rate matrices
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        rate_graph_cache.clear()
+        self.date = datetime.date(year=2021, month=1, day=4)
+        Rate.objects.bulk_sync_rates(rates=[
+            {'currency': currency, 'base_currency': base_currency,
+             'date': self.date, 'value': value}
+            for currency, base_currency, value in [
+                ('USD', 'EUR', 1.2),
+                ('GBP', 'EUR', 0.9),
+                ('JPY', 'USD', 103)]
+        ])
+
+    def test_materialize(self):
+        """
+        Test computing cross rates of a date
+        """
+        rate_matrix = RateMatrix.objects.materialize(date_obj=self.date)
+        self.assertEqual(rate_matrix.currencies, ['EUR', 'GBP', 'JPY', 'USD'])
+        row = RateMatrix.objects.get(value_date=self.date).row('GBP')
+        self.assertEqual(sorted(row), ['EUR', 'JPY', 'USD'])
+        self.assertAlmostEqual(row['JPY'], 1.2 * 103 / 0.9)
+        self.assertAlmostEqual(row['EUR'], 1 / 0.9)
+        self.assertIsNone(RateMatrix.objects.materialize(
+            date_obj=self.date + datetime.timedelta(1)))
+
+    def test_invalidation(self):
+        """
+        Test matrices are deleted when rates of their date change
+        """
+        RateMatrix.objects.materialize(date_obj=self.date)
+        Rate.objects.create(currency='CHF', base_currency='EUR',
+                            value=1.1, value_date=self.date)
+        self.assertFalse(RateMatrix.objects.exists())
+        self.assertIn('CHF', RateMatrix.objects.at_date(self.date).currencies)
+
+    def test_matrix_request(self):
+        """
+        Test matrix endpoint
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/matrix/',
+            data={'value_date': '2021-01-04', 'base_currency': 'USD'},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(list(data['rates']), ['USD'])
+        self.assertAlmostEqual(data['rates']['USD']['EUR'], 1 / 1.2)
+        self.assertAlmostEqual(data['rates']['USD']['JPY'], 103)
+        response = client.get(
+            '/rates/matrix/', data={'value_date': '2021-01-04'},
+            format='json')
+        self.assertEqual(len(response.json()['rates']), 4)
+        response = client.get(
+            '/rates/matrix/', data={'value_date': '2021-01-05'},
+            format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_materialize_command(self):
+        """
+        Test materialize_rates command
+        """
+        out = io.StringIO()
+        call_command('materialize_rates', from_date='2021-01-03',
+                     to_date='2021-01-04', stdout=out)
+        self.assertIn('2021-01-03: no rates.', out.getvalue())
+        self.assertIn('2021-01-04: 4 currencies.', out.getvalue())
+        self.assertEqual(RateMatrix.objects.count(), 1)
+
+
+class RateHistoryTest(TransactionTestCase):
+    """
+    Test memory-mapped history of rates
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            RATE_HISTORY_STORE_PATH=self.directory.name)
+        self.settings.enable()
+        self.start = datetime.date(year=2021, month=1, day=1)
+        Rate.objects.bulk_sync_rates(rates=[
+            {'currency': 'USD', 'base_currency': 'EUR',
+             'date': self.start + datetime.timedelta(i), 'value': 1 + i / 10}
+            for i in range(10)
+        ])
+
+    def tearDown(self) -> None:
+        """
+        Clean test environment
+        """
+        self.settings.disable()
+        self.directory.cleanup()
+
+    def test_ingest(self):
+        """
+        Test written rates are added to the history
+        """
+        store = rate_history_store()
+        dates, values = store.range(
+            base_currency='EUR', currency='USD',
+            date_obj=self.start + datetime.timedelta(2),
+            to_obj=self.start + datetime.timedelta(4))
+        self.assertEqual(dates.tolist(), [
+            self.start + datetime.timedelta(i) for i in range(2, 5)])
+        self.assertEqual(values.tolist(), [1.2, 1.3, 1.4])
+        self.assertEqual(len(store.series('USD', 'EUR')), 10)
+        rate = Rate.objects.get(currency='USD', base_currency='EUR',
+                                value_date=self.start)
+        rate.value = 2
+        rate.save()
+        self.assertEqual(store.series('EUR', 'USD')['value'][0], 2)
+        rate.delete()
+        self.assertEqual(len(store.series('EUR', 'USD')), 9)
+
+    def test_batch(self):
+        """
+        Test series written in a transaction are rewritten once
+        """
+        store = rate_history_store()
+        rates = list(Rate.objects.filter(currency='USD', base_currency='EUR',
+                                         value_date__lt=self.start +
+                                         datetime.timedelta(3)))
+        with mock.patch.object(store, '_write', wraps=store._write) as write:
+            with transaction.atomic():
+                for rate in rates:
+                    rate.value = 3
+                    rate.save()
+                rates[0].delete()
+                self.assertEqual(store.series('EUR', 'USD')['value'][1], 1.1)
+        write.assert_called_once()
+        self.assertEqual(store.series('EUR', 'USD')['value'][:3].tolist(),
+                         [3, 3, 1.3])
+        self.assertEqual(len(store.series('EUR', 'USD')), 9)
+
+    def test_concurrent_writers(self):
+        """
+        Test writers of other stores on the same files do not lose updates
+        """
+        def write(day):
+            store = RateHistoryStore(self.directory.name)
+            for i in range(10):
+                store.apply([(None, 'EUR', 'GBP',
+                              self.start + datetime.timedelta(day), i)])
+
+        threads = [threading.Thread(target=write, args=(day,))
+                   for day in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        series = rate_history_store().series('EUR', 'GBP')
+        self.assertEqual(len(series), 8)
+        self.assertEqual(series['value'].tolist(), [9] * 8)
+
+    def test_rebuild(self):
+        """
+        Test rebuilding history from the database
+        """
+        store = rate_history_store()
+        Rate.objects.filter(currency='EUR').delete()
+        store.update([Rate(currency='GBP', base_currency='EUR',
+                           value=0.9, value_date=self.start)])
+        out = io.StringIO()
+        call_command('rebuild_rate_indexes', history=True, stdout=out)
+        self.assertIn('1 rate series written.', out.getvalue())
+        self.assertEqual(len(store.series('EUR', 'USD')), 10)
+        self.assertEqual(len(store.series('EUR', 'GBP')), 0)
+
+    def test_history_request(self):
+        """
+        Test history endpoint
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/history/',
+            data={'currency': 'USD', 'base_currency': 'EUR',
+                  'from_obj': '2021-01-09'},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['dates'], ['2021-01-09', '2021-01-10'])
+        self.assertEqual(data['values'], [1.8, 1.9])
+        self.assertEqual(data['stats']['count'], 2)
+        with override_settings(RATE_HISTORY_STORE_PATH=None):
+            response = client.get(
+                '/rates/history/',
+                data={'currency': 'USD', 'base_currency': 'EUR',
+                      'from_obj': '2021-01-09'},
+                format='json')
+        self.assertEqual(response.json(), data)
+
+
+class RateRollupTest(TestCase):
+    """
+    Test rollups of rates
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.start = datetime.date(year=2020, month=12, day=20)
+        Rate.objects.bulk_sync_rates(rates=[
+            {'currency': 'USD', 'base_currency': 'EUR',
+             'date': self.start + datetime.timedelta(i),
+             'value': 1 + (i % 7) / 10}
+            for i in range(60)
+        ])
+
+    @staticmethod
+    def expected(rates, period):
+        """
+        Statistics computed from rates
+        """
+        groups = {}
+        for rate in rates:
+            number = {
+                'week': rate.value_date.isocalendar()[1],
+                'month': rate.value_date.month,
+                'year': 0}[period]
+            groups.setdefault(
+                (rate.currency, rate.base_currency,
+                 rate.value_date.year, number), []).append(rate.value)
+        return {group: {'avg': np.mean(values), 'min': min(values),
+                        'max': max(values), 'std_dev': np.std(values)}
+                for group, values in groups.items()}
+
+    def assertRollups(self, period):
+        """
+        Compare rollups with rates
+        """
+        aggregates = RateRollup.objects.statistics(
+            rollups=RateRollup.objects.all(),
+            rates=Rate.objects.all(),
+            period=period)
+        expected = self.expected(Rate.objects.all(), period)
+        self.assertEqual(set(aggregates), set(expected))
+        for group, values in aggregates.items():
+            for name, value in RateRollup.statistics(values).items():
+                self.assertAlmostEqual(value, expected[group][name])
+
+    def test_buckets(self):
+        """
+        Test periods of dates
+        """
+        days = [datetime.date(2020, 12, 1) + datetime.timedelta(i)
+                for i in range(800)]
+        years, weeks = RateRollup.objects.buckets(days, 'week')
+        self.assertEqual(years.tolist(), [d.year for d in days])
+        self.assertEqual(weeks.tolist(), [d.isocalendar()[1] for d in days])
+        _, months = RateRollup.objects.buckets(days, 'month')
+        self.assertEqual(months.tolist(), [d.month for d in days])
+
+    def test_ingest(self):
+        """
+        Test rollups are updated when rates are written
+        """
+        for period in RateRollup.objects.periods:
+            self.assertRollups(period)
+        rate = Rate.objects.get(currency='USD', base_currency='EUR',
+                                value_date=self.start)
+        rate.value = 5
+        rate.save()
+        self.assertRollups('month')
+        self.assertEqual(RateRollup.objects.get(
+            currency='USD', period='year', year=2020).max, 5)
+        rate.delete()
+        self.assertRollups('week')
+        Rate.objects.create(currency='GBP', base_currency='EUR',
+                            value=0.9, value_date=self.start)
+        self.assertRollups('year')
+
+    def test_refresh(self):
+        """
+        Test updated values are replaced in rollups, which are computed
+        again only when an updated value was their min or max
+        """
+        day = self.start + datetime.timedelta(3)
+        with mock.patch.object(RateRollup.objects, '_recompute',
+                               wraps=RateRollup.objects._recompute) as m:
+            Rate.objects.bulk_sync_rates(rates=[
+                {'currency': 'USD', 'base_currency': 'EUR',
+                 'date': day, 'value': 1.35}])
+            self.assertEqual(m.call_args[0][0], set())
+            for period in RateRollup.objects.periods:
+                self.assertRollups(period)
+            rate = Rate.objects.get(currency='USD', base_currency='EUR',
+                                    value_date=day + datetime.timedelta(3))
+            self.assertEqual(rate.stored_value, 1.6)
+            rate.value = 1
+            rate.save()
+            self.assertEqual(m.call_args[0][0], {
+                (None, None, 'EUR', 'USD', 'week', 2020, 52),
+                (None, None, 'EUR', 'USD', 'month', 2020, 12),
+                (None, None, 'EUR', 'USD', 'year', 2020, 0)})
+        for period in RateRollup.objects.periods:
+            self.assertRollups(period)
+
+    def test_period_ranges(self):
+        """
+        Test dates of periods
+        """
+        self.assertEqual(
+            RateRollup.objects._period_ranges('week', 2022, 52),
+            [(datetime.date(2022, 1, 1), datetime.date(2022, 1, 2)),
+             (datetime.date(2022, 12, 26), datetime.date(2022, 12, 31))])
+        self.assertEqual(
+            RateRollup.objects._period_ranges('month', 2020, 2),
+            [(datetime.date(2020, 2, 1), datetime.date(2020, 2, 29))])
+
+    def test_stats_request(self):
+        """
+        Test stats of a range of dates with partial periods
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/stats/',
+            data={'currency': 'USD', 'base_currency': 'EUR',
+                  'period': 'week',
+                  'from_obj': '2020-12-23', 'to_obj': '2021-02-03'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = self.expected(Rate.objects.filter(
+            currency='USD', base_currency='EUR',
+            value_date__range=('2020-12-23', '2021-02-03')), 'week')
+        results = response.json()['results']
+        self.assertEqual(len(results), len(expected))
+        # January 1st to 3rd of 2021 are in the week 53
+        self.assertEqual(results[0]['period'], '2021-53')
+        self.assertEqual(results[-1]['period'], '2020-52')
+        for result in results:
+            year, number = map(int, result['period'].split('-'))
+            group = expected[('USD', 'EUR', year, number)]
+            for name in ['avg', 'min', 'max', 'std_dev']:
+                self.assertAlmostEqual(result[name], group[name])
+
+    def test_uncommon_filter(self):
+        """
+        Test stats with filters not answered by rollups
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/stats/',
+            data={'currency': 'USD', 'period': 'year',
+                  'lower_bound': 1.3},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual([r['period'] for r in results], ['2021', '2020'])
+        self.assertEqual(min(r['min'] for r in results), 1.3)
+
+    def test_rebuild(self):
+        """
+        Test rebuilding rollups from the database
+        """
+        RateRollup.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_rate_indexes', rollups=True, stdout=out)
+        self.assertIn('rate rollups written.', out.getvalue())
+        for period in RateRollup.objects.periods:
+            self.assertRollups(period)
+
+
+class LatestRateTest(TestCase):
+    """
+    Test index of latest rates
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.start = datetime.date(year=2021, month=1, day=1)
+        self.rates = [
+            {'currency': 'USD', 'base_currency': 'EUR',
+             'date': self.start + datetime.timedelta(i), 'value': 1 + i / 10}
+            for i in range(10)
+        ]
+        Rate.objects.bulk_sync_rates(rates=self.rates)
+
+    def latest(self, currency='USD', base_currency='EUR'):
+        """
+        Latest rate of a pair of currencies without key
+        """
+        return LatestRate.objects.get(
+            key=None, currency=currency, base_currency=base_currency)
+
+    def test_ingest(self):
+        """
+        Test latest rates are updated when rates are written
+        """
+        last_day = self.start + datetime.timedelta(9)
+        self.assertEqual(self.latest().value_date, last_day)
+        self.assertEqual(self.latest('EUR', 'USD').value, 1 / 1.9)
+        self.rates[9]['value'] = 2
+        Rate.objects.bulk_sync_rates(rates=self.rates)
+        self.assertEqual(self.latest().value, 2)
+        rate = Rate.objects.create(
+            currency='USD', base_currency='EUR', value=3,
+            value_date=last_day + datetime.timedelta(1))
+        self.assertEqual(self.latest().rate, rate)
+        rate.delete()
+        self.assertEqual(self.latest().value_date, last_day)
+        Rate.objects.filter(currency='USD').delete()
+        self.assertFalse(LatestRate.objects.filter(currency='USD').exists())
+
+    def test_filters(self):
+        """
+        Test latest values filters read latest rates
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/', data={'currency_latest_values': 'USD'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['value_date'], '2021-01-10')
+
+    def test_latest_request(self):
+        """
+        Test latest rates endpoint
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/latest/', data={'base_currency': 'eur'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['currency'], 'USD')
+        self.assertEqual(results[0]['value'], 1.9)
+        self.assertEqual(
+            results[0]['id'],
+            Rate.objects.get(currency='USD', base_currency='EUR',
+                             value_date='2021-01-10').pk)
+
+    def test_rebuild(self):
+        """
+        Test rebuilding latest rates from the database
+        """
+        LatestRate.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_rate_indexes', latest=True, stdout=out)
+        self.assertIn('2 latest rates written.', out.getvalue())
+        self.assertEqual(self.latest().value, 1.9)
+
+
+@override_settings(RATE_CANONICAL_STORAGE=True)
+class CanonicalStorageTest(TestCase):
+    """
+    Test rates stored in a single direction
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        Rate.objects.bulk_sync_rates(rates=[
+            {'currency': currency, 'base_currency': 'USD',
+             'date': self.value_date, 'value': value}
+            for currency, value in [('EUR', 0.8), ('JPY', 100)]
+        ])
+
+    def test_storage(self):
+        """
+        Test rates are stored once in the canonical direction
+        """
+        self.assertEqual(Rate.objects.count(), 2)
+        self.assertEqual(
+            Rate.objects.get(currency='USD', base_currency='EUR').value,
+            1.25)
+        Rate.objects.create(currency='AUD', base_currency='USD',
+                            value=1.3, value_date=self.value_date)
+        self.assertFalse(Rate.objects.filter(
+            currency='USD', base_currency='AUD').exists())
+
+    def test_find_rate(self):
+        """
+        Test rates are found in both directions
+        """
+        rate = Rate.objects.find_rate(
+            currency='EUR', base_currency='USD', date_obj=self.value_date)
+        self.assertAlmostEqual(rate.value, 0.8)
+        rate = Rate.objects.rate_at_date(
+            currency='USD', base_currency='EUR', date_obj=self.value_date)
+        self.assertAlmostEqual(rate.value, 1.25)
+        rate = Rate.objects.find_rate(
+            currency='EUR', base_currency='JPY', date_obj=self.value_date)
+        self.assertAlmostEqual(rate.value, 0.008)
+        self.assertFalse(Rate.objects.filter(
+            currency__in=['EUR', 'JPY'],
+            base_currency__in=['EUR', 'JPY']).exists())
+
+    def test_list_request(self):
+        """
+        Test rates are listed in the direction requested
+        """
+        client = APIClient()
+        response = client.get(
+            '/rates/',
+            data={'currency': 'EUR', 'base_currency': 'USD'},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['currency'], 'EUR')
+        self.assertEqual(results[0]['base_currency'], 'USD')
+        self.assertAlmostEqual(results[0]['value'], 0.8)
+        response = client.get(
+            '/rates/stats/',
+            data={'currency': 'EUR', 'base_currency': 'USD',
+                  'period': 'year'},
+            format='json')
+        self.assertAlmostEqual(response.json()['results'][0]['avg'], 0.8)
+
+    def test_collapse(self):
+        """
+        Test collapsing rates stored in both directions
+        """
+        with override_settings(RATE_CANONICAL_STORAGE=False):
+            Rate.objects.create(currency='GBP', base_currency='CHF',
+                                value=0.8, value_date=self.value_date)
+            Rate.objects.create(currency='AUD', base_currency='CHF',
+                                value=1.5, value_date=self.value_date,
+                                key='other')
+            Rate.objects.filter(currency='CHF', key='other').delete()
+        self.assertEqual(Rate.objects.count(), 5)
+        out = io.StringIO()
+        call_command('collapse_reverse_rates', stdout=out)
+        self.assertIn('1 reverse rates deleted, 1 rates inverted.',
+                      out.getvalue())
+        self.assertEqual(Rate.objects.count(), 4)
+        self.assertEqual(
+            Rate.objects.get(currency='GBP', base_currency='CHF').value,
+            0.8)
+        self.assertAlmostEqual(
+            Rate.objects.get(currency='CHF', base_currency='AUD').value,
+            1 / 1.5)
+        self.assertEqual(
+            LatestRate.objects.get(currency='CHF', key='other').value,
+            Rate.objects.get(currency='CHF', key='other').value)
+
+
+class RateResultCacheTest(TestCase):
+    """
+    Test cache of results of rate queries
+    """
+
+    def setUp(self) -> None:
+        """
+        Setup test environment
+        """
+        self.value_date = datetime.date(year=2021, month=1, day=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Rate.objects.create(currency='USD', base_currency='EUR',
+                                value=1.2, value_date=self.value_date)
+        self.client = APIClient()
+        self.params = {'currency': 'USD', 'base_currency': 'EUR'}
+
+    def test_etag(self):
+        """
+        Test results are cached and conditional requests answered
+        """
+        response = self.client.get('/rates/', data=self.params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/rates/', data=self.params)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.client.get('/rates/', data=self.params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/rates/stats/', data=self.params)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_versions(self):
+        """
+        Test results are only recomputed when rates they read are written
+        """
+        etag = self.client.get('/rates/', data=self.params)['ETag']
+        global_etag = self.client.get('/rates/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Rate.objects.create(currency='GBP', base_currency='EUR',
+                                value=0.9, value_date=self.value_date)
+        self.assertEqual(
+            self.client.get('/rates/', data=self.params)['ETag'], etag)
+        self.assertNotEqual(self.client.get('/rates/')['ETag'], global_etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            Rate.objects.create(currency='EUR', base_currency='USD',
+                                value=0.8, value_date=self.value_date,
+                                key='other')
+        response = self.client.get('/rates/', data=self.params)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_changed(self):
+        """
+        Test versions written in a transaction are incremented once
+        """
+        events = [(self.value_date, None, 'USD', 'EUR')]
+        version_keys = sorted(rate_results.version_keys(events))
+        versions = rate_results.versions(version_keys)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            rate_results.changed(events)
+            rate_results.changed([(self.value_date, None, 'GBP', 'EUR')])
+            self.assertEqual(rate_results.versions(version_keys), versions)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(rate_results.versions(version_keys),
+                         [version + 1 for version in versions])
+
+    def test_bump_redis(self):
+        """
+        Test versions are incremented in a single round trip with Redis
+        """
+        connection = mock.MagicMock()
+        with mock.patch.object(rate_results, 'connection',
+                               return_value=connection):
+            rate_results.bump({'rates:version', 'rates:version:*:EUR:USD'})
+        pipeline = connection.pipeline.return_value
+        self.assertEqual(pipeline.incr.call_count, 2)
+        pipeline.execute.assert_called_once_with()
+
+    def test_scope(self):
+        """
+        Test versions read by queries
+        """
+        self.assertEqual(rate_results.scope({'currency': 'USD'}),
+                         ['rates:version'])
+        self.assertEqual(
+            rate_results.scope({'currency': 'usd', 'base_currency': 'EUR',
+                                'key_or_null': 'other'}),
+            ['rates:version:other:EUR:USD', 'rates:version:None:EUR:USD'])
@@ -1,9 +1,9 @@
 """
 Rates modules API viewsets
 """
+from datetime import date, datetime
 
-from django.db import models
-from django.db.models.functions import Extract
+from django.db import models, transaction
 from django.http import HttpResponseForbidden
 from django_filters import rest_framework as filters
 from drf_yasg import openapi
@@ -16,13 +16,17 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.views import APIView
 
-from .filters import RateFilter
+from .filters import RateFilter, RateRollupFilter
 from .forms import RateForm
-from .models import Rate, RateConverter
+from .history import RateHistoryStore
+from .models import Rate, RateConverter, RateMatrix, RateRollup, \
+    LatestRate
 from .permissions import RateObjectPermission
+from .results import versioned_result
 from .serializers import RateSerializer, BulkSerializer, \
-    RateConversionPayloadSerializer, \
-    RateStatSerializer
+    BulkResultSerializer, RateConversionPayloadSerializer, \
+    RateStatSerializer, RateMatrixSerializer, RateHistorySerializer, \
+    LatestRateSerializer
 
 
 class RateViewSet(mixins.CreateModelMixin,
@@ -146,9 +150,10 @@ class RateViewSet(mixins.CreateModelMixin,
         lower_bound, higher_bound, currency, base_currency,
         currency_latest_values, base_currency_latest_values, ordering],
         responses={200: RateSerializer})
+    @versioned_result
     def list(self, request, *args, **kwargs):
         """
-        List rates
+        List rates, cached until rates they read are written
         """
         return super().list(request, *args, **kwargs)
 
@@ -160,9 +165,10 @@ class RateViewSet(mixins.CreateModelMixin,
             currency_latest_values, base_currency_latest_values, period],
         responses={200: RateStatSerializer})
     @action(['GET'], detail=False, url_path='stats', url_name='stats')
+    @versioned_result
     def stats(self, request, *args, **kwargs):
         """
-        stats on rates
+        stats on rates, cached until rates they read are written
         """
         period = request.GET.get('period', 'month')
         if period not in ['week', 'month', 'year']:
@@ -173,31 +179,44 @@ class RateViewSet(mixins.CreateModelMixin,
             request.GET,
             queryset=self.queryset,
             request=request)
-        qs = rate_filter.qs.values('currency', 'base_currency')
-        if period == 'month':
-            qs = qs.annotate(month=Extract('value_date', 'month'))
-        if period == 'week':
-            qs = qs.annotate(week=Extract('value_date', 'week'))
-        qs = qs.annotate(
-            year=Extract('value_date', 'year'),
-            avg=models.Avg('value'),
-            max=models.Max('value'),
-            min=models.Min('value'),
-            std_dev=models.StdDev('value')
-        ).order_by('-year', '-' + period)
+        rollup_filter = RateRollupFilter(
+            request.GET,
+            queryset=RateRollup.objects.all(),
+            request=request)
+        if not rate_filter.is_valid():
+            return Response(rate_filter.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+        # Filters on values or on single dates are not answered by rollups
+        uncommon = set(RateFilter.base_filters) - \
+            set(RateRollupFilter.base_filters) - \
+            {'from_obj', 'to_obj', 'ordering'}
+        currency = request.GET.get('currency', '').upper()
+        base_currency = request.GET.get('base_currency', '').upper()
+        if any(request.GET.get(name) for name in uncommon) or (
+                Rate.objects.canonical_storage() and
+                (currency or base_currency)):
+            # Rollups are in the direction rates are stored
+            aggregates = RateRollup.objects.rate_statistics(
+                rate_filter.qs, period,
+                currency=currency, base_currency=base_currency)
+        else:
+            aggregates = RateRollup.objects.statistics(
+                rollups=rollup_filter.qs,
+                rates=rate_filter.qs,
+                period=period,
+                from_obj=rate_filter.form.cleaned_data.get('from_obj'),
+                to_obj=rate_filter.form.cleaned_data.get('to_obj'))
         results = [
-            {
-                'currency': result['currency'],
-                'base_currency': result['base_currency'],
-                'period': f"{result['year']}-{str(result[period]).zfill(2)}"
-                if period != 'year'
-                else result['year'],
-                'avg': result['avg'],
-                'max': result['max'],
-                'min': result['min'],
-                'std_dev': result['std_dev'],
-            }
-            for result in qs
+            dict(
+                currency=currency,
+                base_currency=base_currency,
+                period=f"{year}-{str(number).zfill(2)}"
+                if period != 'year' else year,
+                **RateRollup.statistics(values))
+            for (currency, base_currency, year, number), values in sorted(
+                aggregates.items(),
+                key=lambda item: (-item[0][2], -item[0][3],
+                                  item[0][0], item[0][1]))
         ]
         data = {
             'key': request.GET.get('key'),
@@ -209,6 +228,130 @@ class RateViewSet(mixins.CreateModelMixin,
         serializer = RateStatSerializer(data)
         return Response(serializer.data, content_type="application/json")
 
+    matrix_date = openapi.Parameter(
+        'value_date',
+        openapi.IN_QUERY,
+        description="Date of the rates, defaults to today",
+        type=openapi.TYPE_STRING)
+    matrix_base_currency = openapi.Parameter(
+        'base_currency',
+        openapi.IN_QUERY,
+        description="Only return rates in this base currency",
+        type=openapi.TYPE_STRING)
+
+    @swagger_auto_schema(
+        manual_parameters=[matrix_date, matrix_base_currency],
+        responses={200: RateMatrixSerializer})
+    @action(['GET'], detail=False, url_path='matrix', url_name='matrix')
+    def matrix(self, request, *args, **kwargs):
+        """
+        Rates without key between every pair of currencies at a date
+        """
+        try:
+            value_date = datetime.strptime(
+                request.GET.get('value_date') or
+                date.today().strftime('%Y-%m-%d'), '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                "Invalid date",
+                status=status.HTTP_400_BAD_REQUEST)
+        rate_matrix = RateMatrix.objects.at_date(date_obj=value_date)
+        if not rate_matrix:
+            return Response(
+                "No rates at this date",
+                status=status.HTTP_404_NOT_FOUND)
+        base_currency = request.GET.get('base_currency')
+        if base_currency and base_currency not in rate_matrix.currencies:
+            return Response(
+                "Invalid base currency",
+                status=status.HTTP_400_BAD_REQUEST)
+        data = {
+            'value_date': rate_matrix.value_date,
+            'currencies': rate_matrix.currencies,
+            'rates': {
+                base: rate_matrix.row(base)
+                for base in ([base_currency] if base_currency
+                             else rate_matrix.currencies)
+            }
+        }
+        serializer = RateMatrixSerializer(data)
+        return Response(serializer.data, content_type="application/json")
+
+    @swagger_auto_schema(
+        manual_parameters=[key, currency, base_currency, from_obj, to_obj],
+        responses={200: RateHistorySerializer})
+    @action(['GET'], detail=False, url_path='history', url_name='history')
+    def history(self, request, *args, **kwargs):
+        """
+        Series of rates of a pair of currencies, read from the history
+        store if RATE_HISTORY_STORE_PATH is set
+        """
+        currency = request.GET.get('currency')
+        base_currency = request.GET.get('base_currency')
+        key = request.GET.get('key') or None
+        if not currency or not base_currency:
+            return Response(
+                "currency and base_currency are required",
+                status=status.HTTP_400_BAD_REQUEST)
+        if key and not (
+                request.user and request.user.is_authenticated and
+                Rate.objects.filter(user=request.user, key=key).exists()):
+            return HttpResponseForbidden()
+        try:
+            from_obj = datetime.strptime(
+                request.GET['from_obj'], '%Y-%m-%d').date() \
+                if request.GET.get('from_obj') else None
+            to_obj = datetime.strptime(
+                request.GET['to_obj'], '%Y-%m-%d').date() \
+                if request.GET.get('to_obj') else None
+        except ValueError:
+            return Response(
+                "Invalid date",
+                status=status.HTTP_400_BAD_REQUEST)
+        dates, values = Rate.objects.series(
+            currency=currency, base_currency=base_currency, key=key,
+            date_obj=from_obj, to_obj=to_obj)
+        data = {
+            'currency': currency,
+            'base_currency': base_currency,
+            'key': key,
+            'dates': dates.tolist(),
+            'values': values.tolist(),
+            'stats': RateHistoryStore.statistics(values),
+        }
+        serializer = RateHistorySerializer(data)
+        return Response(serializer.data, content_type="application/json")
+
+    @swagger_auto_schema(
+        manual_parameters=[key, currency, base_currency],
+        responses={200: LatestRateSerializer})
+    @action(['GET'], detail=False, url_path='latest', url_name='latest')
+    def latest(self, request, *args, **kwargs):
+        """
+        Latest rate of each key and pair of currencies,
+        read from the index of latest rates
+        """
+        qs = LatestRate.objects.select_related('user')
+        if request.user and request.user.is_authenticated:
+            qs = qs.filter(
+                models.Q(user=request.user) | models.Q(user__isnull=True))
+        else:
+            qs = qs.filter(user__isnull=True)
+        if request.GET.get('key'):
+            qs = qs.filter(key=request.GET['key'])
+        if request.GET.get('currency'):
+            qs = qs.filter(currency=request.GET['currency'].upper())
+        if request.GET.get('base_currency'):
+            qs = qs.filter(
+                base_currency=request.GET['base_currency'].upper())
+        qs = qs.order_by('key', 'base_currency', 'currency')
+        page = self.paginate_queryset(qs)
+        if page is not None:
+            serializer = LatestRateSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = LatestRateSerializer(qs, many=True)
+        return Response(serializer.data)
+
     def create(self, request, *args, **kwargs):
         """
         Create a new rate
@@ -218,8 +361,11 @@ class RateViewSet(mixins.CreateModelMixin,
             rate = rate_form.save(commit=False)
             if request.user and request.user.is_authenticated:
                 rate.user = request.user
-                rate.save()
-                serializer = RateSerializer(rate)
+                stored = rate.canonical()
+                stored.save()
+                serializer = RateSerializer(stored, context={
+                    'currency': rate.currency,
+                    'base_currency': rate.base_currency})
                 return Response(
                     serializer.data,
                     status=status.HTTP_201_CREATED)
@@ -231,22 +377,46 @@ class RateViewSet(mixins.CreateModelMixin,
                 status=status.HTTP_400_BAD_REQUEST,
                 content_type="application/json")
 
+    details = openapi.Parameter(
+        'details',
+        openapi.IN_QUERY,
+        description="Return created rates instead of counts",
+        type=openapi.TYPE_BOOLEAN)
+
     @swagger_auto_schema(method='post', request_body=BulkSerializer,
-                         responses={201: RateSerializer})
+                         manual_parameters=[details],
+                         responses={201: BulkResultSerializer})
     @action(['POST'], detail=False, url_path='bulk', url_name="bulk_create")
     def create_bulk(self, request):
         """
         Create rates for user on a range of dates
+        Accepts a single range or a list of ranges
         """
         if not request.user or not request.user.is_authenticated:
             return HttpResponseForbidden()
-        bs = BulkSerializer(data=request.data)
+        many = isinstance(request.data, list)
+        bs = BulkSerializer(data=request.data, many=many)
         if not bs.is_valid():
             return Response(bs.errors, status=status.HTTP_400_BAD_REQUEST)
-        bulk_rate = bs.create(validated_data=bs.validated_data)
-        rates = bulk_rate.to_rates(user=request.user)
-        serializer = RateSerializer(rates, many=True)
-        return Response(serializer.data, content_type="application/json",
+        bulk_rates = bs.save() if many else [bs.save()]
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                  'conflicts': 0}
+        with transaction.atomic():
+            for bulk_rate in bulk_rates:
+                for name, count in bulk_rate.to_rates(
+                        user=request.user).items():
+                    counts[name] += count
+        if request.GET.get('details', '').lower() in ['1', 'true']:
+            data = []
+            for bulk_rate in bulk_rates:
+                data.extend(RateSerializer(
+                    bulk_rate.get_rates(user=request.user), many=True,
+                    context={'currency': bulk_rate.currency,
+                             'base_currency': bulk_rate.base_currency}
+                ).data)
+        else:
+            data = BulkResultSerializer(counts).data
+        return Response(data, content_type="application/json",
                         status=status.HTTP_201_CREATED)
 
 
@@ -276,14 +446,16 @@ class ConvertView(APIView):
                 id=cp.batch_id,
                 user=request.user,
                 key=cp.key,
-                base_currency=cp.target
+                base_currency=cp.target,
+                as_of=cp.as_of,
+                max_staleness=cp.max_staleness
             )
         if cp.data:
             errors = converter.add_data(data=cp.data)
             if errors:
                 return Response(errors, status=HTTP_400_BAD_REQUEST)
         if cp.eob or not cp.batch_id:
-            result = converter.convert()
+            result = converter.convert(details=cp.details)
             serializer = ConverterResultSerializer(result)
             return Response(serializer.data, content_type="application/json")
         else:
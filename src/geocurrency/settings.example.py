@@ -316,7 +316,9 @@ SERVICES = {
     'rates': {
         'forex': 'geocurrency.rates.services.forex.ForexService',
         'currencylayer':
-            'geocurrency.rates.services.currencylayer.CurrencyLayerService'
+            'geocurrency.rates.services.currencylayer.CurrencyLayerService',
+        'hedged': 'geocurrency.rates.services.hedged.HedgedRateService',
+        'file': 'geocurrency.rates.services.file.FileRateService',
     }
 }
 
@@ -83,6 +83,7 @@ setup(
         "Babel~=2.8",
         "Pint~=0.17",
         "networkx~=2.5",
+        "numpy",
         "sympy~=1.7",
         "channels~=3.0",
         "uncertainties~=3.1"